@@ -3,7 +3,7 @@
 # requires-python = "==3.12.*"
 # dependencies = [
 #     "mlx>=0.26.2",
-#     "mlx-lm>=0.25.2",
+#     "mlx-lm>=0.32.0",
 #     "urllib3==1.26.6",
 #     "click>=8.0.0",
 #     "rich>=13.0.0",
@@ -15,37 +15,96 @@
 # SPDX-License-Identifier: Apache-2.0
 
 # Standard library imports
+import atexit
+import copy
+import functools
+import hashlib
 import io
+import itertools
 import json
+import math
 import os
+import platform
+import queue
 import re
+import signal
+import socket
+import socketserver
+import statistics
 import sys
+import threading
 import time
-from contextlib import redirect_stderr, redirect_stdout
-from dataclasses import dataclass, field
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext, redirect_stderr, redirect_stdout
+from dataclasses import asdict, dataclass, field, fields
 from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 from typing import Any, Callable, Dict, List, Optional
 
 # Third-party imports
 import click
-from prompt_toolkit import PromptSession
-from prompt_toolkit.history import FileHistory
-from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
-from prompt_toolkit.completion import WordCompleter
-from prompt_toolkit.styles import Style
 from rich.console import Console
+from rich.text import Text
 
-# MLX imports
-from mlx_lm import load, stream_generate
-from mlx_lm.models.cache import load_prompt_cache, make_prompt_cache, save_prompt_cache
+# MLX, mlx_lm, prompt_toolkit and huggingface_hub are imported where they are
+# used: mlx_lm alone takes seconds to import, which --help and argument errors
+# should not pay for. t/bench_startup.py measures the import cost.
 
 # Constants
 THINKING_INDICATORS = ["⠋", "⠙", "⠹", "⠸", "⠼", "⠴", "⠦", "⠧", "⠇", "⠏"]
 INDICATOR_UPDATE_INTERVAL = 0.1
 THINKING_INDENT = "        ∘ "
 CLEAR_LINE = "\r" + " " * 80 + "\r"
+RENDER_FRAME_INTERVAL = 0.016
+THINKING_STYLE = "dim italic"
+ASSISTANT_LABEL_STYLE = "bold magenta"
 DEFAULT_CONTEXT_LENGTH = 32768
+DEFAULT_NUM_DRAFT_TOKENS = 3
+DEFAULT_MAX_TOOL_ROUNDS = 8
+DEFAULT_TOOL_TIMEOUT = 10.0
+DEFAULT_TOOL_ROUND_TIMEOUT = 30.0
+TOOL_MAX_WORKERS = 8
+TOOL_MAX_PROCESSES = 2
+TOOL_CACHE_SIZE = 256
+PROMPT_LOOKUP_MAX_NGRAM = 3
+PROMPT_LOOKUP_PREFILL_STEP = 2048
+DEFAULT_KV_GROUP_SIZE = 64
+DEFAULT_QUANTIZED_KV_START = 5000
+KV_SINK_TOKENS = 4
+DEFAULT_PINNED_TURNS = 2
+PROMPT_BUILDER_VERIFY_RENDERS = 2
+CONTEXT_EVICT_TARGET = 0.75
+DEFAULT_SNAPSHOT_MAX_BYTES = 4 * 1024**3
+DEFAULT_SNAPSHOT_MAX_AGE = 7 * 24 * 60 * 60
+DAEMON_MAX_MODELS = 2
+DAEMON_MAX_SESSIONS = 8
+SERVE_MAX_BATCH_SIZE = 16
+SERVE_PREFILL_BATCH_SIZE = 8
+PROMETHEUS_TTFT_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+BENCH_PROMPT_LENGTHS = (128, 1024, 8192, 32768)
+BENCH_GENERATION_LENGTHS = (128,)
+BENCH_REGRESSION_THRESHOLD = 0.1
+BENCH_PERPLEXITY_CHUNK = 512
+BENCH_PROMPT_TEXT = (
+    "The committee reviewed the quarterly report on water use in the valley, "
+    "noting that the northern reservoirs recovered faster than expected while "
+    "demand from the new orchards kept the southern canals near capacity. "
+)
+
+# Stream markup tags emitted by Qwen3-style models
+THINK_START = "<think>"
+THINK_END = "</think>"
+TOOL_CALL_START = "<tool_call>"
+TOOL_CALL_END = "</tool_call>"
+STREAM_TAGS = (THINK_START, THINK_END, TOOL_CALL_START, TOOL_CALL_END)
+
+# Segment kinds produced by StreamTagParser
+SEGMENT_TEXT = "text"
+SEGMENT_THINKING = "thinking"
+SEGMENT_TOOL_CALL = "tool_call"
 
 # Global console instance
 console = Console()
@@ -57,21 +116,30 @@ class StreamState:
 
     in_thinking: bool = False
     in_tool_call: bool = False
-    thinking_buffer: str = ""
-    full_response: str = ""
-    indicator_idx: int = 0
-    last_indicator_time: float = field(default_factory=time.time)
-    thinking_indicator_shown: bool = False
-    thinking_line_started: bool = False
-    first_thinking_char: bool = True
-    visible_content_printed: bool = False
-    assistant_label_printed: bool = False
+    collect_tool_calls: bool = False
     tool_name: Optional[str] = None
-    tool_call_buffer: str = ""
+    # Response assembly, joined once when the stream ends
+    response_parts: List[str] = field(default_factory=list)
+    tool_call_parts: List[str] = field(default_factory=list)
+    tool_calls: List[Dict[str, Any]] = field(default_factory=list)
     # Statistics tracking
     start_time: float = field(default_factory=time.time)
     first_token_time: Optional[float] = None
     token_count: int = 0
+    # Prefill and decode metrics from the generator's response objects
+    prompt_tps: float = 0.0
+    generation_tokens: int = 0
+    generation_tps: float = 0.0
+    peak_memory: float = 0.0
+    # Speculative decoding
+    draft_proposed_tokens: int = 0
+    draft_accepted_tokens: int = 0
+    speculative_steps: int = 0
+    # Tokens generated inside <think> blocks, tags included
+    thinking_tokens: int = 0
+    # Why generation ended: "stop" (EOS), "length", "stop_sequence" or
+    # "tool_call"
+    stop_reason: Optional[str] = None
 
 
 @dataclass
@@ -84,6 +152,42 @@ class GenerationStats:
     total_time: float
     time_to_first_token: float
     tokens_per_second: float
+    reused_tokens: int = 0
+    prefilled_tokens: int = 0
+    prefill_time: float = 0.0
+    prefill_tokens_per_second: float = 0.0
+    decode_time: float = 0.0
+    decode_tokens_per_second: float = 0.0
+    # Peak memory in GB
+    peak_memory: float = 0.0
+    draft_proposed_tokens: int = 0
+    draft_accepted_tokens: int = 0
+    speculative_steps: int = 0
+    thinking_tokens: int = 0
+    tool_rounds: int = 0
+    tool_time: float = 0.0
+    tool_cache_hits: int = 0
+    tool_cache_misses: int = 0
+    stop_reason: Optional[str] = None
+
+    @property
+    def answer_tokens(self) -> int:
+        """Completion tokens generated outside thinking blocks"""
+        return self.completion_tokens - self.thinking_tokens
+
+    @property
+    def draft_acceptance_rate(self) -> float:
+        """Fraction of proposed draft tokens the model accepted"""
+        if self.draft_proposed_tokens == 0:
+            return 0.0
+        return self.draft_accepted_tokens / self.draft_proposed_tokens
+
+    @property
+    def accepted_tokens_per_step(self) -> float:
+        """Average draft tokens accepted per verification forward pass"""
+        if self.speculative_steps == 0:
+            return 0.0
+        return self.draft_accepted_tokens / self.speculative_steps
 
 
 @dataclass
@@ -94,6 +198,8 @@ class StreamResult:
     tool_calls: List[Dict[str, Any]]
     visible_content_printed: bool
     stats: GenerationStats
+    # Generated token ids, so a caller can continue from the cached sequence
+    tokens: List[int] = field(default_factory=list)
 
 
 @dataclass
@@ -104,6 +210,16 @@ class SessionStats:
     total_prompt_tokens: int = 0
     total_completion_tokens: int = 0
     total_tokens: int = 0
+    total_reused_tokens: int = 0
+    total_draft_proposed_tokens: int = 0
+    total_draft_accepted_tokens: int = 0
+    total_tool_cache_hits: int = 0
+    total_tool_cache_misses: int = 0
+    total_prefilled_tokens: int = 0
+    total_prefill_time: float = 0.0
+    total_decode_time: float = 0.0
+    total_time_to_first_token: float = 0.0
+    peak_memory: float = 0.0
     total_time: float = 0.0
     session_start: float = field(default_factory=time.time)
 
@@ -122,6 +238,18 @@ class RunConfig:
     verbose: bool = False
     print_output: bool = False
     max_kv_size: Optional[int] = None
+    kv_bits: Optional[int] = None
+    kv_group_size: int = DEFAULT_KV_GROUP_SIZE
+    quantized_kv_start: int = DEFAULT_QUANTIZED_KV_START
+    use_snapshots: bool = True
+    snapshot_dir: Optional[str] = None
+    draft_model: Optional[str] = None
+    num_draft_tokens: int = DEFAULT_NUM_DRAFT_TOKENS
+    prompt_lookup_tokens: int = 0
+    max_tool_rounds: int = DEFAULT_MAX_TOOL_ROUNDS
+    stop_at_tool_call: bool = False
+    stop_sequences: List[str] = field(default_factory=list)
+    thinking_budget: Optional[int] = None
 
 
 class ModelError(Exception):
@@ -148,865 +276,4608 @@ class PromptError(ModelError):
     pass
 
 
-def stream_with_thinking_handler(
-    model,
-    tokenizer,
-    prompt,
-    max_tokens,
-    show_thinking=False,
-    tools=None,
-    verbose=False,
-    print_assistant_label=True,
-    prompt_cache=None,
-    max_kv_size=None,
-    **kwargs,
-) -> StreamResult:
-    """Stream generation with thinking process handling and tool support
-
-    Args:
-        model: The language model
-        tokenizer: The tokenizer
-        prompt: Input prompt (string or token list)
-        max_tokens: Maximum tokens to generate
-        show_thinking: Whether to display thinking process
-        tools: Available tools dictionary
-        verbose: Enable verbose output
-        print_assistant_label: Whether to print "Assistant:" label
-        prompt_cache: Optional prompt cache
-        max_kv_size: Maximum KV cache size
-        **kwargs: Additional generation parameters
+@dataclass
+class StreamSegment:
+    """A typed piece of streamed output
 
-    Returns:
-        StreamResult containing response, tool calls, and statistics
+    Content segments carry text with kind SEGMENT_TEXT, SEGMENT_THINKING or
+    SEGMENT_TOOL_CALL. Tag segments have kind set to one of STREAM_TAGS and
+    empty text, and mark a transition between content kinds.
     """
-    state = StreamState()
-
-    # Get token count for the prompt
-    prompt_tokens = _get_prompt_token_count(prompt, tokenizer)
 
-    # Create cache if not provided
-    if prompt_cache is None:
-        prompt_cache = make_prompt_cache(model, max_kv_size=max_kv_size)
+    kind: str
+    text: str = ""
 
-    for response in stream_generate(
-        model,
-        tokenizer,
-        prompt,
-        max_tokens=max_tokens,
-        prompt_cache=prompt_cache,
-        **kwargs,
-    ):
-        text = response.text
-        state.full_response += text
-        state.token_count += 1
-
-        # Track time to first token
-        if state.first_token_time is None and text.strip():
-            state.first_token_time = time.time()
-
-        i = 0
-        while i < len(text):
-            char = text[i]
-
-            # Check for tag transitions first
-            if text[i:].startswith("<think>"):
-                state.in_thinking = True
-                state.thinking_buffer = ""
-                state.thinking_line_started = False
-                state.first_thinking_char = True
-                i += 7  # Skip "<think>"
 
-                if (
-                    not show_thinking
-                    and not state.thinking_indicator_shown
-                    and sys.stdout.isatty()
-                ):
-                    print(
-                        f"\r{THINKING_INDICATORS[state.indicator_idx]} Thinking...",
-                        end="",
-                        flush=True,
-                    )
-                    state.thinking_indicator_shown = True
-                continue
+class StreamTagParser:
+    """Incremental parser for <think> and <tool_call> markup in streamed text
 
-            elif text[i:].startswith("</think>"):
-                state.in_thinking = False
-                state.thinking_line_started = False
-                i += 8  # Skip "</think>"
+    Chunks are scanned once with str.find, so the cost of a feed() is linear in
+    the chunk length. A tag split across two chunks is held back until the
+    next chunk completes (or rules out) the match.
+    """
 
-                if show_thinking and state.thinking_buffer.strip():
-                    console.print()  # Final newline after thinking content
-                elif state.thinking_indicator_shown and sys.stdout.isatty():
-                    print(CLEAR_LINE, end="", flush=True)
-                    state.thinking_indicator_shown = False
+    _MODE_FOR_TAG = {
+        THINK_START: SEGMENT_THINKING,
+        THINK_END: SEGMENT_TEXT,
+        TOOL_CALL_START: SEGMENT_TOOL_CALL,
+        TOOL_CALL_END: SEGMENT_TEXT,
+    }
 
-                state.thinking_buffer = ""
+    def __init__(self):
+        self.mode = SEGMENT_TEXT
+        self._pending = ""
+
+    def feed(self, chunk: str) -> List[StreamSegment]:
+        """Consume a chunk of text and return the segments it completes"""
+        text = self._pending + chunk if self._pending else chunk
+        self._pending = ""
+        segments: List[StreamSegment] = []
+        start = 0
+        pos = text.find("<")
+
+        while pos != -1:
+            tag = self._match_tag(text, pos)
+            if tag is None:
+                if self._is_partial_tag(text, pos):
+                    # Possible tag cut off by the chunk boundary
+                    self._emit(segments, text, start, pos)
+                    self._pending = text[pos:]
+                    return segments
+                pos = text.find("<", pos + 1)
                 continue
 
-            elif text[i:].startswith("<tool_call>"):
-                state.in_tool_call = True
-                state.tool_call_buffer = ""  # Reset buffer for new tool call
-                state.tool_name = None  # Reset tool name for new call
-                i += 11  # Skip "<tool_call>"
-
-                # Show indicator for tool calls
-                if not state.thinking_indicator_shown and sys.stdout.isatty():
-                    print(
-                        f"\r{THINKING_INDICATORS[state.indicator_idx]} Calling tool...",
-                        end="",
-                        flush=True,
-                    )
-                    state.thinking_indicator_shown = True
-
-                if verbose:
-                    # Ensure we're on a clean line for tool call output
-                    if state.thinking_indicator_shown and sys.stdout.isatty():
-                        print(CLEAR_LINE, end="", flush=True)
-                        state.thinking_indicator_shown = False
-                    print("<tool_call>", end="", flush=True)
-                continue
+            self._emit(segments, text, start, pos)
+            segments.append(StreamSegment(kind=tag))
+            self.mode = self._MODE_FOR_TAG[tag]
+            start = pos + len(tag)
+            pos = text.find("<", start)
+
+        self._emit(segments, text, start, len(text))
+        return segments
+
+    def flush(self) -> List[StreamSegment]:
+        """Emit any held-back text once the stream has ended"""
+        segments: List[StreamSegment] = []
+        if self._pending:
+            self._emit(segments, self._pending, 0, len(self._pending))
+            self._pending = ""
+        return segments
+
+    @staticmethod
+    def _match_tag(text: str, pos: int) -> Optional[str]:
+        for tag in STREAM_TAGS:
+            if text.startswith(tag, pos):
+                return tag
+        return None
 
-            elif text[i:].startswith("</tool_call>"):
-                state.in_tool_call = False
-                i += 12  # Skip "</tool_call>"
+    @staticmethod
+    def _is_partial_tag(text: str, pos: int) -> bool:
+        tail_length = len(text) - pos
+        return any(
+            tail_length < len(tag) and text.startswith(tag[:tail_length], pos)
+            for tag in STREAM_TAGS
+        )
 
-                # Parse tool name from buffer if we haven't already
-                if state.tool_name is None:
-                    try:
-                        tool_data = json.loads(state.tool_call_buffer.strip())
-                        state.tool_name = tool_data.get("name")
-                    except (json.JSONDecodeError, AttributeError):
-                        pass
+    def _emit(self, segments: List[StreamSegment], text: str, start: int, end: int):
+        if end > start:
+            segments.append(StreamSegment(kind=self.mode, text=text[start:end]))
 
-                state.tool_call_buffer = ""  # Clear buffer
-                state.in_tool_call = False  # Reset tool call state
 
-                # Clear the indicator
-                if state.thinking_indicator_shown and sys.stdout.isatty():
-                    print(CLEAR_LINE, end="", flush=True)
-                    state.thinking_indicator_shown = False
+class StopSequenceMatcher:
+    """Incremental search for stop strings in streamed text
 
-                if verbose:
-                    print("</tool_call>", end="", flush=True)
-                continue
+    Text that could be the start of a stop string split across chunks is
+    held back until the next chunk completes (or rules out) the match, so
+    no part of a stop string is ever emitted.
+    """
 
-            # Handle content based on current state
-            if state.in_thinking:
-                state.thinking_buffer += char
-                _handle_thinking_output(state, char, show_thinking)
-            elif state.in_tool_call:
-                state.tool_call_buffer += char
-                # Try to parse tool name if we don't have it yet
-                if (
-                    state.tool_name is None
-                    and "{" in state.tool_call_buffer
-                    and "name" in state.tool_call_buffer
-                ):
-                    try:
-                        # Try to parse partial JSON to get tool name early
-                        partial = state.tool_call_buffer.strip()
-                        if "name" in partial and '"' in partial:
-                            # Extract name field value
-                            name_match = re.search(r'"name"\s*:\s*"([^"]+)"', partial)
-                            if name_match:
-                                state.tool_name = name_match.group(1)
-                                # Update indicator with tool name
-                                if (
-                                    state.thinking_indicator_shown
-                                    and sys.stdout.isatty()
-                                ):
-                                    print(
-                                        f"\r{THINKING_INDICATORS[state.indicator_idx]} Calling: {state.tool_name}...",
-                                        end="",
-                                        flush=True,
-                                    )
-                    except Exception:
-                        pass
-
-                if verbose:
-                    print(char, end="", flush=True)
-            else:
-                _handle_normal_output(state, char, print_assistant_label)
+    def __init__(self, stop_sequences: List[str]):
+        self.stop_sequences = [stop for stop in stop_sequences if stop]
+        self.matched: Optional[str] = None
+        self._pending = ""
+
+    def feed(self, chunk: str) -> str:
+        """Consume a chunk and return the text before any stop string
+
+        Sets matched once a stop string is found; generation should end.
+        """
+        text = self._pending + chunk if self._pending else chunk
+        self._pending = ""
+
+        first = None
+        for stop in self.stop_sequences:
+            pos = text.find(stop)
+            if pos != -1 and (first is None or pos < first[0]):
+                first = (pos, stop)
+        if first is not None:
+            self.matched = first[1]
+            return text[: first[0]]
+
+        # Hold back the longest tail that a later chunk could complete
+        hold = 0
+        for stop in self.stop_sequences:
+            for length in range(min(len(stop) - 1, len(text)), hold, -1):
+                if stop.startswith(text[-length:]):
+                    hold = length
+                    break
+        if hold:
+            self._pending = text[-hold:]
+            return text[:-hold]
+        return text
 
-            i += 1
+    def flush(self) -> str:
+        """Return any held-back text once the stream has ended"""
+        pending, self._pending = self._pending, ""
+        return pending
 
-    # Final cleanup
-    if state.thinking_indicator_shown and sys.stdout.isatty():
-        print(CLEAR_LINE, end="", flush=True)
 
-    # Clean response for conversation history (remove thinking tags)
-    clean_response = re.sub(
-        r"<think>.*?</think>", "", state.full_response, flags=re.DOTALL
-    )
-    clean_response = clean_response.strip()
+class StreamRenderer:
+    """Frame-rate-limited terminal output for streamed responses
 
-    # Handle tool calls if tools are available
-    tool_calls = []
-    if tools:
-        tool_calls = parse_tool_call(state.full_response)
-        if tool_calls:
-            # Remove tool call XML from clean response
-            clean_response = re.sub(
-                r"<tool_call>.*?</tool_call>", "", clean_response, flags=re.DOTALL
-            ).strip()
+    Visible and thinking text are buffered and written out at most once per
+    frame interval (or when a newline arrives), instead of one write per
+    character. The thinking/tool spinner and the "Assistant:" label are drawn
+    by the same renderer so everything reaches the terminal in order.
+    """
 
-    # Calculate statistics
-    stats = _calculate_generation_stats(state, prompt_tokens)
+    def __init__(
+        self,
+        show_thinking: bool = False,
+        print_assistant_label: bool = True,
+        frame_interval: float = RENDER_FRAME_INTERVAL,
+        enabled: bool = True,
+    ):
+        self.show_thinking = show_thinking
+        self.print_assistant_label = print_assistant_label
+        self.frame_interval = frame_interval
+        self.enabled = enabled
+        self.is_tty = enabled and sys.stdout.isatty()
+        # Pending (text, style) pairs; style None is written as plain text
+        self._pending: List[tuple[str, Optional[str]]] = []
+        self._last_flush = time.perf_counter()
+        # Spinner state
+        self.indicator_idx = 0
+        self.last_indicator_time = time.time()
+        self.indicator_shown = False
+        # Visible text state
+        self.visible_content_printed = False
+        self.assistant_label_printed = False
+        # Thinking text state
+        self.thinking_line_started = False
+        self.first_thinking_line = True
+        self.thinking_content_printed = False
+
+    def show_indicator(self, message: str):
+        """Draw the spinner with a status message"""
+        if not self.is_tty:
+            return
+        self.flush()
+        print(
+            f"\r{THINKING_INDICATORS[self.indicator_idx]} {message}",
+            end="",
+            flush=True,
+        )
+        self.indicator_shown = True
+
+    def tick_indicator(self, message: str):
+        """Advance the spinner if the indicator interval has elapsed"""
+        if not self.is_tty:
+            return
+        current_time = time.time()
+        if current_time - self.last_indicator_time > INDICATOR_UPDATE_INTERVAL:
+            self.indicator_idx = (self.indicator_idx + 1) % len(THINKING_INDICATORS)
+            self.show_indicator(message)
+            self.last_indicator_time = current_time
+
+    def clear_indicator(self):
+        """Erase the spinner line if it is showing"""
+        if self.indicator_shown and self.is_tty:
+            self.flush()
+            print(CLEAR_LINE, end="", flush=True)
+        self.indicator_shown = False
+
+    def start_thinking(self):
+        """Reset thinking layout at a <think> tag"""
+        self.thinking_line_started = False
+        self.first_thinking_line = True
+        self.thinking_content_printed = False
+
+    def end_thinking(self):
+        """Finish the thinking block at a </think> tag"""
+        self.thinking_line_started = False
+        if self.show_thinking and self.thinking_content_printed:
+            self._write("\n")  # Final newline after thinking content
+            self.flush()
+        else:
+            self.clear_indicator()
+
+    def thinking(self, text: str, message: str = "Thinking..."):
+        """Render thinking text, or tick the spinner if thinking is hidden"""
+        if not self.show_thinking:
+            self.tick_indicator(message)
+            return
+
+        lines = text.split("\n")
+        for i, line in enumerate(lines):
+            if i > 0:
+                self._write("\n")
+                self.thinking_line_started = False
+            if not self.thinking_line_started:
+                # Skip indentation at the start of each thinking line
+                line = line.lstrip()
+                if not line:
+                    continue
+                if self.first_thinking_line:
+                    self._write("\n")  # Newline before first thinking content
+                    self.first_thinking_line = False
+                self._write(THINKING_INDENT)
+                self.thinking_line_started = True
+            self._write(line, THINKING_STYLE)
+            self.thinking_content_printed = True
+        self._maybe_flush("\n" in text)
+
+    def text(self, text: str):
+        """Render visible response text"""
+        self.clear_indicator()
+
+        if not self.visible_content_printed:
+            # Skip leading whitespace before the first visible character
+            text = text.lstrip()
+            if not text:
+                return
+            if self.print_assistant_label and not self.assistant_label_printed:
+                self._write("Assistant", ASSISTANT_LABEL_STYLE)
+                self._write(": ")
+                self.assistant_label_printed = True
+            self.visible_content_printed = True
+
+        self._write(text)
+        self._maybe_flush("\n" in text)
+
+    def raw(self, text: str):
+        """Write text verbatim and flush, e.g. verbose tool-call echo"""
+        self._write(text)
+        self.flush()
+
+    def flush(self):
+        """Write out all buffered text"""
+        self._last_flush = time.perf_counter()
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        if not self.enabled:
+            return
+
+        plain: List[str] = []
+        for text, style in pending:
+            if style is None:
+                plain.append(text)
+                continue
+            if plain:
+                sys.stdout.write("".join(plain))
+                plain = []
+            console.print(
+                Text(text, style=style), end="", soft_wrap=True, highlight=False
+            )
+        if plain:
+            sys.stdout.write("".join(plain))
+        sys.stdout.flush()
 
-    return StreamResult(
-        response=clean_response,
-        tool_calls=tool_calls,
-        visible_content_printed=state.visible_content_printed,
-        stats=stats,
-    )
+    def close(self):
+        """Flush remaining text and clear the spinner at the end of a stream"""
+        self.flush()
+        self.clear_indicator()
 
+    def _write(self, text: str, style: Optional[str] = None):
+        self._pending.append((text, style))
 
-def _get_prompt_token_count(prompt, tokenizer) -> int:
-    """Get token count for different prompt types"""
-    if isinstance(prompt, str):
-        try:
-            return len(tokenizer.encode(prompt))
-        except Exception:
-            # Fallback: estimate tokens from string length
-            return int(len(prompt.split()) * 1.3)
-    elif isinstance(prompt, list):
-        return len(prompt)
-    else:
-        try:
-            return len(prompt)
-        except Exception:
-            return 0
+    def _maybe_flush(self, newline: bool):
+        if newline or time.perf_counter() - self._last_flush >= self.frame_interval:
+            self.flush()
 
 
-def _calculate_generation_stats(
-    state: StreamState, prompt_tokens: int
-) -> GenerationStats:
-    """Calculate generation statistics"""
-    end_time = time.time()
-    total_time = end_time - state.start_time
-    time_to_first = (
-        state.first_token_time - state.start_time if state.first_token_time else 0
-    )
-    tokens_per_second = state.token_count / total_time if total_time > 0 else 0
+class PromptCacheManager:
+    """KV cache that tracks the tokens it holds
 
-    return GenerationStats(
-        prompt_tokens=prompt_tokens,
-        completion_tokens=state.token_count,
-        total_tokens=prompt_tokens + state.token_count,
-        total_time=total_time,
-        time_to_first_token=time_to_first,
-        tokens_per_second=tokens_per_second,
-    )
+    Before each generation the cached tokens are compared with the new prompt.
+    The cache is trimmed back to their longest common prefix, and only the
+    remaining suffix is prefilled, so a chat turn costs time proportional to
+    the new message rather than the whole conversation.
 
+    With a draft model the draft's layers are appended to the model's, which
+    is the layout speculative decoding in stream_generate expects.
 
-def _handle_thinking_output(state: StreamState, char: str, show_thinking: bool):
-    """Handle output when in thinking mode"""
-    if show_thinking:
-        if char == "\n":
-            console.print()
-            state.thinking_line_started = False
-        elif not char.isspace() or state.thinking_line_started:
-            if not state.thinking_line_started:
-                if state.first_thinking_char:
-                    console.print()  # Newline before first thinking content
-                    state.first_thinking_char = False
-                console.print(THINKING_INDENT, end="")
-                state.thinking_line_started = True
-            console.print(f"[dim italic]{char}[/dim italic]", end="")
-    else:
-        # Only show thinking indicators if we're in a real terminal
-        if sys.stdout.isatty():
-            # Update thinking indicator periodically
-            current_time = time.time()
-            if current_time - state.last_indicator_time > INDICATOR_UPDATE_INTERVAL:
-                state.indicator_idx = (state.indicator_idx + 1) % len(
-                    THINKING_INDICATORS
-                )
-                # Show appropriate message based on current state
-                if state.in_tool_call and state.tool_name:
-                    message = f"Calling: {state.tool_name}..."
-                elif state.in_tool_call:
-                    message = "Calling tool..."
-                else:
-                    message = "Thinking..."
-                print(
-                    f"\r{THINKING_INDICATORS[state.indicator_idx]} {message}",
-                    end="",
-                    flush=True,
+    With kv_bits, layers holding quantized_kv_start tokens or more are
+    replaced by quantized ones, in place in the cache list, so the manager
+    keeps seeing them across turns and saves them as they are.
+
+    With max_kv_size, the cache keeps its first keep tokens (the system
+    prompt and tool schema, see _pinned_prefix_length) and a sliding window
+    of the most recent ones.
+    """
+
+    def __init__(
+        self,
+        model,
+        max_kv_size: Optional[int] = None,
+        prompt_cache: Optional[List[Any]] = None,
+        tokens: Optional[List[int]] = None,
+        draft_model=None,
+        kv_bits: Optional[int] = None,
+        kv_group_size: int = DEFAULT_KV_GROUP_SIZE,
+        quantized_kv_start: int = DEFAULT_QUANTIZED_KV_START,
+        keep: int = KV_SINK_TOKENS,
+    ):
+        self.model = model
+        self.max_kv_size = max_kv_size
+        self.draft_model = draft_model
+        self.kv_bits = kv_bits
+        self.kv_group_size = kv_group_size
+        self.quantized_kv_start = quantized_kv_start
+        self.keep = keep
+        if prompt_cache is None:
+            prompt_cache = self._make_cache()
+            tokens = None
+        self.cache = prompt_cache
+        self.tokens: List[int] = list(tokens) if tokens else []
+
+    @classmethod
+    def load(
+        cls,
+        path: str,
+        model,
+        max_kv_size: Optional[int] = None,
+        draft_model=None,
+        kv_bits: Optional[int] = None,
+        kv_group_size: int = DEFAULT_KV_GROUP_SIZE,
+        quantized_kv_start: int = DEFAULT_QUANTIZED_KV_START,
+        keep: int = KV_SINK_TOKENS,
+    ) -> "PromptCacheManager":
+        """Load a cache saved with save()
+
+        A bounded cache keeps the prefix length it was saved with; keep only
+        applies once the manager is reset.
+
+        Raises:
+            ModelError: If the file has no token metadata to match against, was
+                saved for a different set of layers, or holds layers quantized
+                differently from kv_bits and kv_group_size
+        """
+        from mlx_lm.models.cache import load_prompt_cache
+
+        prompt_cache, metadata = load_prompt_cache(path, return_metadata=True)
+        if "tokens" not in metadata:
+            raise ModelError(f"Prompt cache '{path}' has no token metadata")
+        cache_manager = cls(
+            model,
+            max_kv_size=max_kv_size,
+            prompt_cache=prompt_cache,
+            tokens=json.loads(metadata["tokens"]),
+            draft_model=draft_model,
+            kv_bits=kv_bits,
+            kv_group_size=kv_group_size,
+            quantized_kv_start=quantized_kv_start,
+            keep=keep,
+        )
+        if len(prompt_cache) != len(cache_manager._make_cache()):
+            raise ModelError(
+                f"Prompt cache '{path}' does not match the model and draft model"
+            )
+        for c in prompt_cache:
+            bits = getattr(c, "bits", None)
+            if bits is not None and (bits, c.group_size) != (kv_bits, kv_group_size):
+                raise ModelError(
+                    f"Prompt cache '{path}' holds a {bits}-bit KV cache (group "
+                    f"size {c.group_size}); load it with the same --kv-bits "
+                    "and --kv-group-size"
                 )
-                state.last_indicator_time = current_time
+        return cache_manager
 
+    def save(self, path: str):
+        """Save the cache and its token sequence to a .safetensors file"""
+        from mlx_lm.models.cache import save_prompt_cache
 
-def _handle_normal_output(state: StreamState, char: str, print_assistant_label: bool):
-    """Handle normal text output"""
-    # Clear any remaining thinking indicator only if we're in a terminal
-    if state.thinking_indicator_shown and sys.stdout.isatty():
-        print(CLEAR_LINE, end="", flush=True)
-        state.thinking_indicator_shown = False
+        save_prompt_cache(
+            path, self.cache, metadata={"tokens": json.dumps(self.tokens)}
+        )
 
-    # Print assistant label if needed and this is the first visible content
-    if (
-        print_assistant_label
-        and not state.assistant_label_printed
-        and not char.isspace()
-    ):
-        console.print("[bold magenta]Assistant[/bold magenta]: ", end="")
-        state.assistant_label_printed = True
-        state.visible_content_printed = True
-
-    # Print the character
-    if print_assistant_label:
-        # In label mode, only print after label is shown or for non-space chars
-        if state.assistant_label_printed or not char.isspace():
-            print(char, end="", flush=True)
-            if not char.isspace():
-                state.visible_content_printed = True
-    else:
-        # In no-label mode, print everything after first non-space char
-        if state.visible_content_printed or not char.isspace():
-            print(char, end="", flush=True)
-            if not char.isspace():
-                state.visible_content_printed = True
+    def reset(self):
+        """Drop all cached state"""
+        self.cache = self._make_cache()
+        self.tokens = []
+
+    def _make_cache(self) -> List[Any]:
+        from mlx_lm.models.cache import make_prompt_cache
+
+        prompt_cache = _make_kv_cache(self.model, self.max_kv_size, self.keep)
+        if self.draft_model is not None:
+            prompt_cache += make_prompt_cache(self.draft_model)
+        return prompt_cache
+
+    def prepare(self, prompt_tokens: List[int]) -> List[int]:
+        """Align the cache with a prompt and return the tokens left to prefill"""
+        prefix = _common_prefix_length(self.tokens, prompt_tokens)
+        # The model needs at least one new token to produce logits from
+        prefix = min(prefix, len(prompt_tokens) - 1)
+
+        if not self.truncate(prefix):
+            # Rotated or non-trimmable caches have to start over
+            self.reset()
+            prefix = 0
+
+        return prompt_tokens[prefix:]
+
+    def truncate(self, length: int) -> bool:
+        """Trim the cache back to its first length tokens, if possible"""
+        from mlx_lm.models.cache import can_trim_prompt_cache, trim_prompt_cache
+
+        stale = len(self.tokens) - length
+        if stale <= 0:
+            return stale == 0
+        if (
+            not can_trim_prompt_cache(self.cache)
+            or trim_prompt_cache(self.cache, stale) != stale
+        ):
+            return False
+        del self.tokens[length:]
+        return True
+
+    def extend(self, tokens: List[int]):
+        """Record tokens that were fed through the cache"""
+        self.tokens.extend(tokens)
+
+    def sync(self):
+        """Trim every layer back to the tokens all layers hold
+
+        Speculative decoding can leave the model and draft layers a token
+        apart, and does not feed the final sampled token through the model.
+        """
+        offsets = [c.offset for c in self.cache if hasattr(c, "offset")]
+        length = min(offsets + [len(self.tokens)])
+        for c in self.cache:
+            stale = getattr(c, "offset", length) - length
+            if stale > 0:
+                c.trim(stale)
+        del self.tokens[length:]
+
+
+def _quantize_kv_cache(
+    prompt_cache: List[Any],
+    kv_bits: Optional[int],
+    kv_group_size: int = DEFAULT_KV_GROUP_SIZE,
+    quantized_kv_start: int = DEFAULT_QUANTIZED_KV_START,
+):
+    """Replace the layers holding quantized_kv_start tokens by quantized ones
 
+    Layers are replaced in place in the list, as stream_generate does while
+    generating with kv_bits; already quantized layers are left alone.
+    """
+    from mlx_lm.generate import maybe_quantize_kv_cache
 
-def _get_safe_math_context() -> Dict[str, Any]:
-    """Get safe mathematical functions for calculator"""
-    import math
+    maybe_quantize_kv_cache(prompt_cache, quantized_kv_start, kv_group_size, kv_bits)
 
-    return {
-        "__builtins__": {},
-        "abs": abs,
-        "round": round,
-        "min": min,
-        "max": max,
-        "sum": sum,
-        "pow": pow,
-        "sqrt": math.sqrt,
-        "sin": math.sin,
-        "cos": math.cos,
-        "tan": math.tan,
-        "log": math.log,
-        "log10": math.log10,
-        "exp": math.exp,
-        "pi": math.pi,
-        "e": math.e,
-    }
 
+def _make_kv_cache(
+    model, max_kv_size: Optional[int] = None, keep: int = KV_SINK_TOKENS
+) -> List[Any]:
+    """make_prompt_cache, with bounded caches keeping their first keep tokens
 
-def calculator(expression: str) -> str:
+    make_prompt_cache always keeps 4 tokens of a bounded cache; models that
+    build their own cache are left to it.
     """
-    Safely evaluate a mathematical expression
+    from mlx_lm.models.cache import RotatingKVCache, make_prompt_cache
 
-    Args:
-        expression: A mathematical expression like '2 + 3 * 4' or 'sqrt(16)'
+    if max_kv_size is None or hasattr(model, "make_cache"):
+        return make_prompt_cache(model, max_kv_size=max_kv_size)
+    return [RotatingKVCache(max_size=max_kv_size, keep=keep) for _ in model.layers]
 
-    Returns:
-        Calculation result as string
 
-    Raises:
-        ToolExecutionError: If expression is unsafe or evaluation fails
+def _pinned_prefix_length(
+    tokenizer,
+    conversation: List[Dict[str, str]],
+    available_tools: Optional[Dict[str, Callable]],
+    max_kv_size: int,
+) -> int:
+    """Tokens a bounded KV cache should never drop
+
+    That is everything the template renders before the first user message:
+    the system prompt and tool schema. Once the cache wraps, the model still
+    sees its instructions, and the first tokens also act as the attention
+    sink that keeps a sliding window stable. At least KV_SINK_TOKENS are
+    kept, and at most half of max_kv_size, leaving room for recent tokens.
     """
-    # Basic sanitization
-    unsafe_keywords = {"import", "__", "exec", "eval", "open", "file"}
-    if any(keyword in expression for keyword in unsafe_keywords):
-        raise ToolExecutionError("Expression contains unsafe operations")
+    system = list(itertools.takewhile(lambda m: m["role"] == "system", conversation))
+    first = _render_prompt(
+        tokenizer, system + [{"role": "user", "content": "a"}], available_tools
+    )
+    second = _render_prompt(
+        tokenizer, system + [{"role": "user", "content": "b"}], available_tools
+    )
+    keep = max(_common_prefix_length(first, second), KV_SINK_TOKENS)
+    limit = max_kv_size // 2
+    if keep > limit:
+        console.print(
+            f"[yellow]Warning: the system prompt and tools take {keep:,} tokens; "
+            f"only the first {limit:,} are kept once the {max_kv_size:,} token "
+            "KV cache is full[/yellow]"
+        )
+        keep = limit
+    return keep
 
-    safe_dict = _get_safe_math_context()
 
-    try:
-        result = eval(expression, safe_dict, {})
-        return str(result)
-    except Exception as e:
-        raise ToolExecutionError(f"Calculation failed: {str(e)}") from e
+def _common_prefix_length(a: List[int], b: List[int]) -> int:
+    """Length of the longest common prefix of two token sequences"""
+    limit = min(len(a), len(b))
+    i = 0
+    while i < limit and a[i] == b[i]:
+        i += 1
+    return i
 
 
-def get_current_time(timezone: str = "local") -> str:
-    """
-    Get the current date and time
+class ConversationWindow:
+    """Keeps a conversation's rendered prompt under a token budget
 
-    Args:
-        timezone: The timezone to use ('local', 'utc')
+    Token counts are cached per message, so checking the budget costs time
+    proportional to the new messages rather than the whole history. Once
+    the budget is exceeded, the oldest turns are evicted until the prompt
+    is back under CONTEXT_EVICT_TARGET of it, so evictions (and the prefill
+    that follows each one) stay rare. Leading system messages and the most
+    recent turns are pinned.
+
+    Evicted turns are removed from the front of the history, right after
+    the system prompt, so a PromptCacheManager keeps the cached system
+    prompt and tool schema and only prefills again from the first evicted
+    message onward.
     """
-    if timezone.lower() == "utc":
-        now = datetime.utcnow()
-        return f"Current UTC time: {now.strftime('%Y-%m-%d %H:%M:%S UTC')}"
-    else:
-        now = datetime.now()
-        return f"Current local time: {now.strftime('%Y-%m-%d %H:%M:%S')}"
 
+    def __init__(
+        self,
+        tokenizer,
+        budget: int,
+        available_tools: Optional[Dict[str, Callable]] = None,
+        pinned_turns: int = DEFAULT_PINNED_TURNS,
+    ):
+        self.tokenizer = tokenizer
+        self.budget = budget
+        self.pinned_turns = pinned_turns
+        self._counts: Dict[tuple, int] = {}
+        self._framing, self._overhead = self._measure_template(available_tools)
+
+    def _measure_template(
+        self, available_tools: Optional[Dict[str, Callable]]
+    ) -> tuple[int, int]:
+        """Tokens the template adds per message, and once per prompt
+
+        The per-prompt overhead covers the tool schema, any default system
+        preamble and the generation prompt.
+        """
+        user = {"role": "user", "content": "?"}
+        assistant = {"role": "assistant", "content": "!"}
+        one = len(_render_prompt(self.tokenizer, [user], available_tools))
+        two = len(_render_prompt(self.tokenizer, [user, assistant], available_tools))
+        framing = max(two - one - self._content_tokens("!"), 0)
+        overhead = max(one - framing - self._content_tokens("?"), 0)
+        return framing, overhead
+
+    def _content_tokens(self, content: str) -> int:
+        return len(self.tokenizer.encode(content, add_special_tokens=False))
+
+    def message_tokens(self, message: Dict[str, str]) -> int:
+        """Tokens a message adds to the rendered prompt, cached per message"""
+        key = (message.get("role"), message.get("content") or "")
+        count = self._counts.get(key)
+        if count is None:
+            count = self._content_tokens(key[1]) + self._framing
+            self._counts[key] = count
+        return count
+
+    def prompt_tokens(self, conversation: List[Dict[str, str]]) -> int:
+        """Estimated length of the rendered prompt for a conversation"""
+        return self._overhead + sum(map(self.message_tokens, conversation))
+
+    def fit(self, conversation: List[Dict[str, str]]) -> int:
+        """Evict old turns in place until the conversation fits the budget
+
+        Returns:
+            Number of messages evicted
+        """
+        total = self.prompt_tokens(conversation)
+        if total <= self.budget:
+            return 0
 
-def _prepare_conversation(config: RunConfig) -> List[Dict[str, str]]:
-    """Prepare conversation history from config"""
-    conversation = []
+        first = 0
+        while first < len(conversation) and conversation[first]["role"] == "system":
+            first += 1
+        # Every user message starts a turn; the last pinned_turns stay
+        starts = [
+            i
+            for i in range(first, len(conversation))
+            if conversation[i]["role"] == "user"
+        ]
+        cuts = starts[1 : max(len(starts) - self.pinned_turns, 0) + 1]
+
+        target = self.budget * CONTEXT_EVICT_TARGET
+        end = first
+        for cut in cuts:
+            if total <= target:
+                break
+            for message in conversation[end:cut]:
+                total -= self.message_tokens(message)
+            end = cut
 
-    # Load and add system prompt if provided
-    system_prompt = load_system_prompt(config.system)
-    if system_prompt:
-        conversation.append({"role": "system", "content": system_prompt})
+        evicted = conversation[first:end]
+        del conversation[first:end]
+        for message in evicted:
+            self._counts.pop((message.get("role"), message.get("content") or ""), None)
+        return len(evicted)
 
-    # Add user prompt
-    conversation.append({"role": "user", "content": config.prompt})
 
-    return conversation
+def _context_budget(
+    context_length: int, max_kv_size: Optional[int], max_tokens: int
+) -> int:
+    """Prompt tokens that fit in the context alongside a full response"""
+    if max_kv_size is not None:
+        # A rotating cache drops the oldest tokens after the pinned prefix
+        # past this size
+        context_length = min(context_length, max_kv_size)
+    return max(context_length - max_tokens, 0)
 
 
-def bizarro_run(config: RunConfig) -> str:
+class PromptSnapshotStore:
+    """Content-addressed on-disk store of KV cache snapshots
+
+    Each snapshot holds the KV cache for a prompt prefix (typically the
+    system prompt and tool schema) and is keyed by a hash of the model and
+    tokenizer files, the cache configuration, and the exact prefix tokens.
+    Entries are evicted least-recently-used first once the store exceeds its
+    size budget, and unconditionally once they pass the maximum age.
     """
-    Run the language model with the given configuration
 
-    Args:
-        config: Run configuration
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        max_bytes: int = DEFAULT_SNAPSHOT_MAX_BYTES,
+        max_age: float = DEFAULT_SNAPSHOT_MAX_AGE,
+    ):
+        self.directory = Path(directory) if directory else _default_snapshot_dir()
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def key(
+        self,
+        model_fingerprint: str,
+        prefix_tokens: List[int],
+        max_kv_size: Optional[int] = None,
+        kv_quantization: Optional[tuple[int, int, int]] = None,
+        keep: Optional[int] = None,
+    ) -> str:
+        """Content address for a prefix snapshot
+
+        kv_quantization is the (bits, group size, start) the cache is
+        quantized with, if any, and keep the prefix a bounded cache keeps.
+        """
+        digest = hashlib.sha256()
+        digest.update(model_fingerprint.encode())
+        digest.update(f"\0{max_kv_size}\0".encode())
+        if kv_quantization is not None:
+            digest.update(f"kv{kv_quantization}\0".encode())
+        if keep is not None:
+            digest.update(f"keep{keep}\0".encode())
+        digest.update(json.dumps(prefix_tokens).encode())
+        return digest.hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.directory / f"{key}.safetensors"
+
+    def load(
+        self,
+        key: str,
+        model,
+        max_kv_size: Optional[int] = None,
+        draft_model=None,
+        **cache_options,
+    ) -> Optional[PromptCacheManager]:
+        """Load a snapshot, or return None if it is missing or unreadable
+
+        cache_options are passed on to PromptCacheManager.load: kv_bits,
+        kv_group_size, quantized_kv_start and keep.
+        """
+        path = self.path(key)
+        if not path.exists():
+            return None
+        try:
+            cache_manager = PromptCacheManager.load(
+                str(path),
+                model,
+                max_kv_size=max_kv_size,
+                draft_model=draft_model,
+                **cache_options,
+            )
+        except Exception:
+            path.unlink(missing_ok=True)
+            return None
+        # Touch the entry so eviction treats it as recently used
+        os.utime(path)
+        return cache_manager
+
+    def save(self, key: str, cache_manager: PromptCacheManager):
+        """Write a snapshot atomically, then evict stale entries"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.directory / f"{key}.{os.getpid()}.tmp.safetensors"
+        try:
+            cache_manager.save(str(tmp_path))
+            os.replace(tmp_path, self.path(key))
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        self.evict()
+
+    def evict(self):
+        """Remove entries past max_age, then the oldest until under max_bytes"""
+        now = time.time()
+        entries = []
+        for path in self.directory.glob("*.safetensors"):
+            if ".tmp." in path.name:
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if now - stat.st_mtime > self.max_age:
+                path.unlink(missing_ok=True)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
 
-    Returns:
-        Generated response text
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
 
-    Raises:
-        ModelError: If model operations fail
-    """
-    # Load the model and tokenizer
-    model_obj, tokenizer = load_model_quietly(config.model)
 
-    # Validate context length
-    model_max_context = get_model_context_length(model_obj, tokenizer)
-    if config.context_length is not None:
-        validate_context_length(config.context_length, model_max_context)
+def _default_snapshot_dir() -> Path:
+    """Default location of the prompt snapshot store"""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or str(Path.home() / ".cache")
+    return Path(cache_home) / "bizarro" / "prompt-snapshots"
 
-    # Get available tools if enabled
-    available_tools = get_available_tools() if config.enable_tools else None
 
-    # Prepare conversation
-    conversation = _prepare_conversation(config)
+def _model_fingerprint(model_path: str) -> str:
+    """Identify a model and tokenizer by the files they were loaded from"""
+    path = Path(model_path)
+    if not path.exists():
+        from huggingface_hub import snapshot_download
 
-    # Create prompt cache for single run
-    prompt_cache = make_prompt_cache(model_obj, max_kv_size=config.max_kv_size)
+        try:
+            path = Path(snapshot_download(model_path, local_files_only=True))
+        except Exception:
+            return model_path
 
-    # Capture output if not printing directly
-    output_buffer = None
-    original_stdout = None
-    if not config.print_output:
-        output_buffer = io.StringIO()
-        original_stdout = sys.stdout
-        sys.stdout = output_buffer
+    # The resolved snapshot path pins the revision of hub models, and file
+    # sizes and mtimes catch local models being rewritten in place
+    parts = [str(path.resolve())]
+    for file in sorted(path.iterdir()):
+        if file.is_file():
+            stat = file.stat()
+            parts.append(f"{file.name}:{stat.st_size}:{stat.st_mtime_ns}")
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
 
-    try:
-        # Generate response
-        handle_conversation_turn(
-            model_obj=model_obj,
-            tokenizer=tokenizer,
-            conversation=conversation,
-            available_tools=available_tools,
-            max_tokens=config.max_tokens,
-            show_thinking=config.show_thinking,
-            verbose=config.verbose,
-            print_assistant_label=False,  # Never print "Assistant:" in run mode
-            prompt_cache=prompt_cache,
-            max_kv_size=config.max_kv_size,
-        )
 
-        # Return the response if capturing output
-        if not config.print_output:
-            sys.stdout = original_stdout
+def make_thinking_budget_processor(tokenizer, budget: int):
+    """Build a logits processor that ends thinking after budget tokens
 
-            # Extract the response from conversation
-            for msg in reversed(conversation):
-                if msg["role"] == "assistant":
-                    return msg["content"]
+    Once budget tokens have been generated since the last unclosed <think>,
+    every token but </think> is masked out so the model moves on to its
+    answer. The state is derived from the token history on each call rather
+    than kept in the processor, so it stays correct when speculative decoding
+    rolls back rejected draft tokens.
 
-            # Fallback to captured output
-            return output_buffer.getvalue().strip()
+    Args:
+        tokenizer: Tokenizer with single-token <think> and </think>
+        budget: Thinking tokens allowed before </think> is forced
 
-    finally:
-        if not config.print_output and original_stdout:
-            sys.stdout = original_stdout
+    Returns:
+        A processor for mlx_lm's logits_processors
+    """
+    import mlx.core as mx
 
+    start = tokenizer.encode(THINK_START, add_special_tokens=False)
+    end = tokenizer.encode(THINK_END, add_special_tokens=False)
+    if len(start) != 1 or len(end) != 1:
+        raise ModelError(
+            f"--thinking-budget needs {THINK_START} and {THINK_END} to be "
+            "single tokens in this model's vocabulary"
+        )
+    start, end = start[0], end[0]
 
-def get_available_tools() -> Dict[str, Callable]:
-    """Get the dictionary of available tools"""
-    return {
-        "calculator": calculator,
-        "get_current_time": get_current_time,
-    }
+    def processor(tokens, logits):
+        positions = mx.arange(tokens.size)
+        last_start = mx.max(mx.where(tokens == start, positions, -1))
+        last_end = mx.max(mx.where(tokens == end, positions, -1))
+        thinking = tokens.size - 1 - last_start
+        force = (last_start > last_end) & (thinking >= budget)
+        forced = mx.where(mx.arange(logits.shape[-1]) == end, 0.0, float("-inf"))
+        return mx.where(force, forced.astype(logits.dtype), logits)
 
+    return processor
 
-def parse_tool_call(response_text: str) -> List[Dict[str, Any]]:
-    """Parse tool calls from model response (XML or JSON format)
 
-    Args:
-        response_text: Model response text containing tool calls
+class PromptLookupDecoder:
+    """Speculative decoding with drafts looked up in the context
+
+    The last few tokens are matched against everything seen so far (prompt
+    and output), and the tokens that followed the first earlier match
+    are proposed as a draft and verified in one forward pass. Rewrite and
+    summarize prompts copy long spans of their input, so drafts are often
+    accepted whole without a draft model. Verification is greedy, so the
+    output is the same as plain greedy decoding.
+    """
+
+    def __init__(self, num_draft_tokens: int, max_ngram: int = PROMPT_LOOKUP_MAX_NGRAM):
+        self.num_draft_tokens = num_draft_tokens
+        self.max_ngram = max_ngram
+        self.tokens: List[int] = []
+        self.proposed_tokens = 0
+        # For each n-gram size, n-gram -> position of the token that followed
+        # its first occurrence, which leaves the longest continuation to draft
+        self._index: List[Dict[tuple, int]] = [{} for _ in range(max_ngram)]
+
+    def extend(self, tokens: List[int]):
+        """Append tokens to the context drafts are looked up in"""
+        for token in tokens:
+            self.tokens.append(token)
+            # Index the n-grams ending just before the new token, so the
+            # trailing n-gram is only ever matched against earlier text
+            end = len(self.tokens) - 1
+            for n in range(1, self.max_ngram + 1):
+                if end - n >= 0:
+                    self._index[n - 1].setdefault(
+                        tuple(self.tokens[end - n : end]), end
+                    )
+
+    def propose(self, limit: int) -> List[int]:
+        """Draft up to limit tokens continuing the longest matching n-gram"""
+        if limit <= 0:
+            return []
+        for n in range(min(self.max_ngram, len(self.tokens)), 0, -1):
+            start = self._index[n - 1].get(tuple(self.tokens[-n:]))
+            if start is not None:
+                return self.tokens[start : start + limit]
+        return []
+
+    def generate_step(
+        self,
+        prompt: List[int],
+        model,
+        prompt_cache: List[Any],
+        max_tokens: int,
+        logits_processors: Optional[List[Callable]] = None,
+        quantize_cache: Optional[Callable[[List[Any]], None]] = None,
+    ):
+        """Yield (token, logprobs, from_draft) for each generated token
+
+        quantize_cache, if given, is called with the cache after every
+        forward pass, like stream_generate's kv_bits handling.
+        """
+        import mlx.core as mx
+        from mlx_lm.models.cache import trim_prompt_cache
+
+        # Prefill all but the last prompt token, which produces the first logits
+        y = list(prompt)
+        while len(y) > 1:
+            n = min(PROMPT_LOOKUP_PREFILL_STEP, len(y) - 1)
+            model(mx.array(y[:n])[None], cache=prompt_cache)
+            if quantize_cache is not None:
+                quantize_cache(prompt_cache)
+            mx.eval([c.state for c in prompt_cache])
+            y = y[n:]
+
+        ntoks = 0
+        while True:
+            draft = self.propose(min(self.num_draft_tokens, max_tokens - ntoks - 1))
+            self.proposed_tokens += len(draft)
+
+            logits = model(mx.array(y + draft)[None], cache=prompt_cache)[0]
+            if logits_processors:
+                # Process each position against the history it would follow
+                rows = []
+                for i in range(len(draft) + 1):
+                    history = mx.array(self.tokens + draft[:i])
+                    row = logits[i : i + 1]
+                    for processor in logits_processors:
+                        row = processor(history, row)
+                    rows.append(row)
+                logits = mx.concatenate(rows)
+            logprobs = logits - mx.logsumexp(logits, axis=-1, keepdims=True)
+            tokens = mx.argmax(logprobs, axis=-1).tolist()
+
+            accepted = 0
+            while accepted < len(draft) and tokens[accepted] == draft[accepted]:
+                accepted += 1
+            # Drop the rejected draft tokens from the cache
+            if accepted < len(draft):
+                trim_prompt_cache(prompt_cache, len(draft) - accepted)
+            if quantize_cache is not None:
+                quantize_cache(prompt_cache)
+
+            step_tokens = draft[:accepted] + [tokens[accepted]]
+            self.extend(step_tokens)
+            for i, token in enumerate(step_tokens):
+                ntoks += 1
+                yield token, logprobs[i], i < accepted
+                if ntoks == max_tokens:
+                    return
+            y = step_tokens[-1:]
+
+    def stream_generate(
+        self,
+        model,
+        tokenizer,
+        prompt: List[int],
+        context: List[int],
+        max_tokens: int,
+        prompt_cache: List[Any],
+        logits_processors: Optional[List[Callable]] = None,
+        quantize_cache: Optional[Callable[[List[Any]], None]] = None,
+    ):
+        """Drop-in for mlx_lm's stream_generate using prompt lookup drafts
+
+        Args:
+            prompt: Tokens to feed through the cache (may be a suffix of context)
+            context: Full prompt, which drafts are looked up in
+            max_tokens: Maximum tokens to generate
+            prompt_cache: Trimmable KV cache holding the tokens before prompt
+            logits_processors: Processors applied before greedy verification
+            quantize_cache: Called with the cache after every forward pass
+
+        Yields:
+            GenerationResponse for each generated token
+        """
+        import mlx.core as mx
+        from mlx_lm.generate import GenerationResponse
+        from mlx_lm.models.cache import can_trim_prompt_cache
+
+        if not can_trim_prompt_cache(prompt_cache):
+            raise ModelError("Prompt lookup decoding needs a trimmable KV cache")
+
+        self.extend(context)
+        detokenizer = tokenizer.detokenizer
+        detokenizer.reset()
+
+        tic = time.perf_counter()
+        prompt_tps = 0.0
+        token_generator = self.generate_step(
+            prompt, model, prompt_cache, max_tokens, logits_processors, quantize_cache
+        )
+        for n, (token, logprobs, from_draft) in enumerate(token_generator):
+            if n == 0:
+                prompt_time = time.perf_counter() - tic
+                prompt_tps = len(prompt) / prompt_time
+                tic = time.perf_counter()
+            if token in tokenizer.eos_token_ids:
+                break
+
+            detokenizer.add_token(token)
+            if (n + 1) == max_tokens:
+                break
+
+            yield GenerationResponse(
+                text=detokenizer.last_segment,
+                token=token,
+                logprobs=logprobs,
+                from_draft=from_draft,
+                prompt_tokens=len(prompt),
+                prompt_tps=prompt_tps,
+                generation_tokens=n + 1,
+                generation_tps=(n + 1) / (time.perf_counter() - tic),
+                peak_memory=mx.get_peak_memory() / 1e9,
+                finish_reason=None,
+            )
+
+        token_generator.close()
+        detokenizer.finalize()
+        yield GenerationResponse(
+            text=detokenizer.last_segment,
+            token=token,
+            logprobs=logprobs,
+            from_draft=from_draft,
+            prompt_tokens=len(prompt),
+            prompt_tps=prompt_tps,
+            generation_tokens=n + 1,
+            generation_tps=(n + 1) / (time.perf_counter() - tic),
+            peak_memory=mx.get_peak_memory() / 1e9,
+            finish_reason="stop" if token in tokenizer.eos_token_ids else "length",
+        )
+
+
+class Tracer:
+    """Timed spans of a generation, exported for latency profiling
+
+    Spans are kept in memory as (name, start, duration, thread, args) and
+    written once at the end, as Chrome trace-event JSON (load it in
+    chrome://tracing or Perfetto) or, for .jsonl paths, one compact JSON
+    object per span. Token arrival times are kept per generated response
+    for the inter-token latency summary.
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.spans: List[tuple] = []
+        self.token_times: List[List[float]] = []
+
+    @contextmanager
+    def span(self, name: str, **args):
+        """Record the duration of the enclosed block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.perf_counter(), **args)
+
+    def add(self, name: str, start: float, end: float, **args):
+        """Record a span measured by the caller, in perf_counter seconds"""
+        self.spans.append((name, start, end - start, threading.get_ident(), args))
+
+    def begin_stream(self):
+        """Start a new response, so gaps between responses are not latencies"""
+        self.token_times.append([])
+
+    def token(self, when: float):
+        """Record the arrival of a generated token"""
+        if not self.token_times:
+            self.begin_stream()
+        self.token_times[-1].append(when)
+
+    def inter_token_latencies(self) -> List[float]:
+        """Seconds between consecutive tokens of the same response"""
+        return [
+            later - earlier
+            for times in self.token_times
+            for earlier, later in zip(times, times[1:])
+        ]
+
+    def summary(self) -> Dict[str, Any]:
+        """Inter-token latency percentiles and total time per span name"""
+        latencies = sorted(self.inter_token_latencies())
+        totals: Dict[str, List[float]] = {}
+        for name, _, duration, _, _ in self.spans:
+            totals.setdefault(name, []).append(duration)
+        return {
+            "tokens": sum(map(len, self.token_times)),
+            "inter_token_latency": {
+                f"p{q}": _percentile(latencies, q) for q in (50, 95, 99)
+            },
+            "spans": {
+                name: {"count": len(durations), "total": sum(durations)}
+                for name, durations in totals.items()
+            },
+        }
+
+    def save(self, path: str):
+        """Write the spans as Chrome trace JSON, or JSONL for .jsonl paths"""
+        pid = os.getpid()
+        with open(path, "w", encoding="utf-8") as f:
+            if path.endswith(".jsonl"):
+                for name, start, duration, _, args in self.spans:
+                    record = {
+                        "name": name,
+                        "ts": round(start - self.origin, 6),
+                        "dur": round(duration, 6),
+                    }
+                    record.update(args)
+                    f.write(json.dumps(record) + "\n")
+                return
+
+            events = [
+                {
+                    "name": name,
+                    "ph": "X",
+                    "ts": (start - self.origin) * 1e6,
+                    "dur": duration * 1e6,
+                    "pid": pid,
+                    "tid": tid,
+                    "args": args,
+                }
+                for name, start, duration, tid, args in self.spans
+            ]
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an ascending list, 0.0 if empty"""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(q / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+class _TracedDetokenizer:
+    """Streaming detokenizer wrapper that traces each add_token call"""
+
+    def __init__(self, detokenizer, tracer: Tracer):
+        self._detokenizer = detokenizer
+        self._tracer = tracer
+
+    def __copy__(self):
+        # TokenizerWrapper.detokenizer hands out a copy per stream
+        return _TracedDetokenizer(copy.copy(self._detokenizer), self._tracer)
+
+    def add_token(self, token: int):
+        with self._tracer.span("detokenize"):
+            self._detokenizer.add_token(token)
+
+    def __getattr__(self, name: str):
+        return getattr(self._detokenizer, name)
+
+
+# Active tracer set by --trace; None keeps tracing off the hot path
+_tracer: Optional[Tracer] = None
+
+
+def _trace_span(name: str, **args):
+    """A span on the active tracer, or a no-op context when not tracing"""
+    if _tracer is None:
+        return nullcontext()
+    return _tracer.span(name, **args)
+
+
+@contextmanager
+def _traced_detokenizer(tokenizer):
+    """Trace detokenization inside stream_generate while tracing is on"""
+    tracer = _tracer
+    detokenizer = getattr(tokenizer, "_detokenizer", None)
+    if tracer is None or detokenizer is None:
+        yield
+        return
+    tokenizer._detokenizer = _TracedDetokenizer(detokenizer, tracer)
+    try:
+        yield
+    finally:
+        tokenizer._detokenizer = detokenizer
+
+
+def _start_trace() -> Tracer:
+    """Turn on tracing for the rest of the process"""
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def _finish_trace(path: str):
+    """Turn tracing off, write the trace and print its latency summary"""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is None:
+        return
+    tracer.save(path)
+
+    summary = tracer.summary()
+    latency = summary["inter_token_latency"]
+    err_console = Console(stderr=True)
+    err_console.print(
+        f"[dim]Trace written to {path}: {summary['tokens']:,} tokens, "
+        f"inter-token latency p50 {latency['p50'] * 1000:.2f} ms, "
+        f"p95 {latency['p95'] * 1000:.2f} ms, p99 {latency['p99'] * 1000:.2f} ms"
+        "[/dim]"
+    )
+    spans = ", ".join(
+        f"{name} {span['total']:.3f}s ({span['count']:,}x)"
+        for name, span in summary["spans"].items()
+    )
+    err_console.print(f"[dim]Trace spans: {spans}[/dim]")
+
+
+def stream_with_thinking_handler(
+    model,
+    tokenizer,
+    prompt,
+    max_tokens,
+    show_thinking=False,
+    tools=None,
+    verbose=False,
+    print_assistant_label=True,
+    prompt_cache=None,
+    max_kv_size=None,
+    renderer=None,
+    cache_manager=None,
+    draft_model=None,
+    num_draft_tokens=DEFAULT_NUM_DRAFT_TOKENS,
+    prompt_lookup_tokens=0,
+    stop_at_tool_call=False,
+    stop_sequences=None,
+    thinking_budget=None,
+    kv_bits=None,
+    kv_group_size=DEFAULT_KV_GROUP_SIZE,
+    quantized_kv_start=DEFAULT_QUANTIZED_KV_START,
+    kv_keep=KV_SINK_TOKENS,
+    **kwargs,
+) -> StreamResult:
+    """Stream generation with thinking process handling and tool support
+
+    Args:
+        model: The language model
+        tokenizer: The tokenizer
+        prompt: Input prompt (string or token list)
+        max_tokens: Maximum tokens to generate
+        show_thinking: Whether to display thinking process
+        tools: Available tools dictionary
+        verbose: Enable verbose output
+        print_assistant_label: Whether to print "Assistant:" label
+        prompt_cache: Optional prompt cache
+        max_kv_size: Maximum KV cache size
+        renderer: Optional StreamRenderer for terminal output
+        cache_manager: Optional PromptCacheManager; when given, only the
+            prompt suffix not already in its cache is prefilled
+        draft_model: Optional draft model for speculative decoding
+        num_draft_tokens: Tokens proposed by the draft model per step
+        prompt_lookup_tokens: Tokens drafted per step by prompt lookup
+            decoding; 0 disables it
+        stop_at_tool_call: End generation as soon as a complete tool call
+            has streamed out, so the caller can run it right away
+        stop_sequences: Strings that end generation when they appear in the
+            decoded stream; the stop string itself is not part of the output
+        thinking_budget: Tokens allowed inside a <think> block before
+            </think> is forced; None leaves thinking unbounded
+        kv_bits: Quantize the KV cache to this many bits; None keeps it in
+            full precision
+        kv_group_size: Group size for KV cache quantization
+        quantized_kv_start: Cache length at which a layer is quantized
+        kv_keep: Leading tokens a bounded cache created here always keeps
+        **kwargs: Additional generation parameters
+
+    Returns:
+        StreamResult containing response, tool calls, and statistics
+    """
+    from mlx_lm import stream_generate
+    from mlx_lm.models.cache import make_prompt_cache
+
+    state = StreamState(collect_tool_calls=bool(tools))
+    if renderer is None:
+        renderer = StreamRenderer(
+            show_thinking=show_thinking, print_assistant_label=print_assistant_label
+        )
+
+    if isinstance(prompt, str):
+        # Encode as stream_generate would, adding BOS unless already there
+        add_special_tokens = tokenizer.bos_token is None or not prompt.startswith(
+            tokenizer.bos_token
+        )
+        prompt = tokenizer.encode(prompt, add_special_tokens=add_special_tokens)
+    prompt_tokens = len(prompt)
+
+    # Reuse the cached prefix of the prompt if a cache manager is given
+    prompt_input = prompt
+    if cache_manager is not None:
+        prompt_input = cache_manager.prepare(list(prompt))
+        prompt_cache = cache_manager.cache
+    elif prompt_cache is None:
+        prompt_cache = _make_kv_cache(model, max_kv_size, kv_keep)
+        if draft_model is not None:
+            prompt_cache += make_prompt_cache(draft_model)
+
+    if thinking_budget is not None:
+        kwargs["logits_processors"] = list(kwargs.get("logits_processors") or []) + [
+            make_thinking_budget_processor(tokenizer, thinking_budget)
+        ]
+
+    quantize_cache = None
+    if kv_bits is not None:
+        quantize_cache = functools.partial(
+            _quantize_kv_cache,
+            kv_bits=kv_bits,
+            kv_group_size=kv_group_size,
+            quantized_kv_start=quantized_kv_start,
+        )
+
+    lookup = None
+    if prompt_lookup_tokens > 0:
+        lookup = PromptLookupDecoder(prompt_lookup_tokens)
+        responses = lookup.stream_generate(
+            model,
+            tokenizer,
+            list(prompt_input),
+            list(prompt),
+            max_tokens=max_tokens,
+            prompt_cache=prompt_cache,
+            logits_processors=kwargs.get("logits_processors"),
+            quantize_cache=quantize_cache,
+        )
+    else:
+        if draft_model is not None:
+            kwargs.update(draft_model=draft_model, num_draft_tokens=num_draft_tokens)
+            if quantize_cache is not None:
+                # Speculative decoding quantizes copies of the cache list, so
+                # quantize ours up front for the layers the prompt fills up
+                _quantize_kv_cache(
+                    prompt_cache,
+                    kv_bits,
+                    kv_group_size,
+                    quantized_kv_start - len(prompt_input),
+                )
+        elif quantize_cache is not None:
+            # Layers are swapped in place in prompt_cache as they fill up
+            kwargs.update(
+                kv_bits=kv_bits,
+                kv_group_size=kv_group_size,
+                quantized_kv_start=quantized_kv_start,
+            )
+        responses = stream_generate(
+            model,
+            tokenizer,
+            prompt_input,
+            max_tokens=max_tokens,
+            prompt_cache=prompt_cache,
+            **kwargs,
+        )
+
+    parser = StreamTagParser()
+    if _prompt_opens_thinking(tokenizer, prompt):
+        # Templates that open <think> in the prompt only generate </think>
+        parser.mode = SEGMENT_THINKING
+        _handle_segment(state, StreamSegment(kind=THINK_START), renderer, verbose)
+    stop_matcher = StopSequenceMatcher(stop_sequences) if stop_sequences else None
+    generated_tokens: List[int] = []
+    speculative = draft_model is not None or lookup is not None
+    in_step = False
+
+    tracer = _tracer
+    if tracer is not None:
+        tracer.begin_stream()
+    step_start = time.perf_counter()
+    try:
+        with _traced_detokenizer(tokenizer):
+            for response in responses:
+                if tracer is not None:
+                    # The first wait covers the prefill, later ones a decode step
+                    now = time.perf_counter()
+                    tracer.add(
+                        "step" if generated_tokens else "prefill", step_start, now
+                    )
+                    tracer.token(now)
+                generated_tokens.append(response.token)
+                state.prompt_tps = response.prompt_tps
+                state.generation_tokens = response.generation_tokens
+                state.generation_tps = response.generation_tps
+                state.peak_memory = response.peak_memory
+                if speculative:
+                    if not in_step:
+                        # mlx_lm shortens the draft to the tokens still allowed
+                        remaining = max_tokens - (len(generated_tokens) - 1)
+                        state.draft_proposed_tokens += min(num_draft_tokens, remaining)
+                        state.speculative_steps += 1
+                        in_step = True
+                    if response.from_draft:
+                        state.draft_accepted_tokens += 1
+                    else:
+                        # Every verify step ends with one token from the model,
+                        # unless the whole draft was accepted up to max_tokens
+                        in_step = False
+                text = response.text
+                if stop_matcher is not None:
+                    text = stop_matcher.feed(text)
+                with _trace_span("render"):
+                    _handle_response_text(state, parser, renderer, text, verbose)
+                state.stop_reason = response.finish_reason
+
+                # End early; anything decoded after this point would be discarded
+                if stop_matcher is not None and stop_matcher.matched is not None:
+                    state.stop_reason = "stop_sequence"
+                elif stop_at_tool_call and state.tool_calls:
+                    state.stop_reason = "tool_call"
+                if state.stop_reason in ("stop_sequence", "tool_call"):
+                    responses.close()
+                    break
+                step_start = time.perf_counter()
+
+            if stop_matcher is not None and stop_matcher.matched is None:
+                # Text held back as a possible stop string prefix
+                for segment in parser.feed(stop_matcher.flush()):
+                    _handle_segment(state, segment, renderer, verbose)
+    except BaseException:
+        # The cache may hold a partial prefill we can no longer account for
+        if cache_manager is not None:
+            cache_manager.reset()
+        raise
+
+    if lookup is not None:
+        # Lookup drafts vary in length, so use the decoder's own count
+        state.draft_proposed_tokens = lookup.proposed_tokens
+    if quantize_cache is not None and draft_model is not None:
+        quantize_cache(prompt_cache)
+
+    if cache_manager is not None:
+        cache_manager.extend(prompt_input)
+        cache_manager.extend(generated_tokens)
+        cache_manager.sync()
+
+    return _finish_stream(
+        state,
+        parser,
+        renderer,
+        tools,
+        verbose,
+        prompt_tokens=prompt_tokens,
+        prefilled_tokens=len(prompt_input),
+        tokens=generated_tokens,
+    )
+
+
+def _finish_stream(
+    state: StreamState,
+    parser: StreamTagParser,
+    renderer: StreamRenderer,
+    tools: Optional[Dict[str, Any]],
+    verbose: bool,
+    prompt_tokens: int,
+    prefilled_tokens: int,
+    tokens: Optional[List[int]] = None,
+) -> StreamResult:
+    """Flush the parser at the end of a stream and assemble the result"""
+    # Emit any partial tag text held back at the end of the stream
+    for segment in parser.flush():
+        _handle_segment(state, segment, renderer, verbose)
+
+    # Keep a tool call cut off by max_tokens as plain response text
+    if state.in_tool_call:
+        state.response_parts.append(TOOL_CALL_START + "".join(state.tool_call_parts))
+
+    # Final cleanup
+    renderer.close()
+
+    # Thinking and parsed tool calls were kept out of the response parts
+    # while streaming, so the clean response is a single join
+    clean_response = "".join(state.response_parts).strip()
+
+    # Fall back to fenced JSON tool calls in the visible text
+    tool_calls = state.tool_calls
+    if tools and not tool_calls and "```" in clean_response:
+        tool_calls = parse_tool_call(clean_response)
+
+    # Calculate statistics
+    stats = _calculate_generation_stats(
+        state, prompt_tokens, prefilled_tokens=prefilled_tokens
+    )
+
+    return StreamResult(
+        response=clean_response,
+        tool_calls=tool_calls,
+        visible_content_printed=renderer.visible_content_printed,
+        stats=stats,
+        tokens=tokens or [],
+    )
+
+
+def _prompt_opens_thinking(tokenizer, prompt) -> bool:
+    """Whether the prompt ends inside an unclosed <think> block"""
+    if isinstance(prompt, str):
+        tail = prompt[-64:]
+    else:
+        tail = tokenizer.decode(list(prompt[-16:]))
+    return tail.rfind(THINK_START) > tail.rfind(THINK_END)
+
+
+def _handle_response_text(
+    state: StreamState,
+    parser: StreamTagParser,
+    renderer: StreamRenderer,
+    text: str,
+    verbose: bool,
+):
+    """Parse and render one chunk of generated text"""
+    state.token_count += 1
+
+    # Track time to first token
+    if state.first_token_time is None:
+        state.first_token_time = time.time()
+
+    was_thinking = state.in_thinking
+    for segment in parser.feed(text):
+        _handle_segment(state, segment, renderer, verbose)
+    if was_thinking or state.in_thinking:
+        state.thinking_tokens += 1
+
+
+def _handle_segment(
+    state: StreamState,
+    segment: StreamSegment,
+    renderer: StreamRenderer,
+    verbose: bool,
+):
+    """Update stream state and terminal output for a parsed segment"""
+    kind = segment.kind
+
+    if kind == THINK_START:
+        state.in_thinking = True
+        renderer.start_thinking()
+        if not renderer.show_thinking and not renderer.indicator_shown:
+            renderer.show_indicator("Thinking...")
+
+    elif kind == THINK_END:
+        state.in_thinking = False
+        renderer.end_thinking()
+
+    elif kind == TOOL_CALL_START:
+        state.in_tool_call = True
+        state.tool_call_parts = []  # Reset buffer for new tool call
+        state.tool_name = None  # Reset tool name for new call
+
+        # Show indicator for tool calls
+        if not renderer.indicator_shown:
+            renderer.show_indicator("Calling tool...")
+
+        if verbose:
+            # Ensure we're on a clean line for tool call output
+            renderer.clear_indicator()
+            renderer.raw(TOOL_CALL_START)
+
+    elif kind == TOOL_CALL_END:
+        tool_call_text = "".join(state.tool_call_parts)
+        tool_call = _parse_tool_call_json(tool_call_text)
+        if tool_call is not None:
+            state.tool_name = tool_call["name"]
+
+        if state.collect_tool_calls and tool_call is not None:
+            state.tool_calls.append(tool_call)
+        else:
+            # Keep unparsed or unhandled tool calls in the response text
+            state.response_parts.append(
+                f"{TOOL_CALL_START}{tool_call_text}{TOOL_CALL_END}"
+            )
+
+        state.tool_call_parts = []  # Clear buffer
+        state.in_tool_call = False  # Reset tool call state
+
+        # Clear the indicator
+        renderer.clear_indicator()
+
+        if verbose:
+            renderer.raw(TOOL_CALL_END)
+
+    elif kind == SEGMENT_THINKING:
+        renderer.thinking(segment.text, _indicator_message(state))
+
+    elif kind == SEGMENT_TOOL_CALL:
+        state.tool_call_parts.append(segment.text)
+        if state.tool_name is None:
+            _update_tool_name(state, renderer)
+
+        if verbose:
+            renderer.raw(segment.text)
+
+    else:
+        state.response_parts.append(segment.text)
+        renderer.text(segment.text)
+
+
+def _indicator_message(state: StreamState) -> str:
+    """Spinner message for the current stream state"""
+    if state.in_tool_call and state.tool_name:
+        return f"Calling: {state.tool_name}..."
+    elif state.in_tool_call:
+        return "Calling tool..."
+    return "Thinking..."
+
+
+def _update_tool_name(state: StreamState, renderer: StreamRenderer):
+    """Try to extract the tool name from a partially streamed tool call"""
+    # Extract name field value from the partial JSON
+    partial = "".join(state.tool_call_parts)
+    name_match = re.search(r'"name"\s*:\s*"([^"]+)"', partial)
+    if not name_match:
+        return
+
+    state.tool_name = name_match.group(1)
+    # Update indicator with tool name
+    if renderer.indicator_shown:
+        renderer.show_indicator(_indicator_message(state))
+
+
+def _calculate_generation_stats(
+    state: StreamState, prompt_tokens: int, prefilled_tokens: Optional[int] = None
+) -> GenerationStats:
+    """Calculate generation statistics
+
+    Prefill and decode rates come from the generator's response objects
+    when it reports them, and from the time of the first token otherwise.
+    """
+    end_time = time.time()
+    total_time = end_time - state.start_time
+    time_to_first = (
+        state.first_token_time - state.start_time if state.first_token_time else 0
+    )
+    completion_tokens = state.generation_tokens or state.token_count
+    tokens_per_second = completion_tokens / total_time if total_time > 0 else 0
+    if prefilled_tokens is None:
+        prefilled_tokens = prompt_tokens
+
+    if state.generation_tps > 0:
+        prefill_tps = state.prompt_tps
+        prefill_time = prefilled_tokens / prefill_tps if prefill_tps > 0 else 0.0
+        decode_tps = state.generation_tps
+        decode_time = completion_tokens / decode_tps
+    else:
+        prefill_time = time_to_first
+        prefill_tps = prefilled_tokens / prefill_time if prefill_time > 0 else 0.0
+        decode_time = end_time - state.first_token_time if state.first_token_time else 0
+        decode_tps = completion_tokens / decode_time if decode_time > 0 else 0.0
+
+    return GenerationStats(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        total_tokens=prompt_tokens + completion_tokens,
+        total_time=total_time,
+        time_to_first_token=time_to_first,
+        tokens_per_second=tokens_per_second,
+        reused_tokens=prompt_tokens - prefilled_tokens,
+        prefilled_tokens=prefilled_tokens,
+        prefill_time=prefill_time,
+        prefill_tokens_per_second=prefill_tps,
+        decode_time=decode_time,
+        decode_tokens_per_second=decode_tps,
+        peak_memory=state.peak_memory,
+        draft_proposed_tokens=state.draft_proposed_tokens,
+        draft_accepted_tokens=state.draft_accepted_tokens,
+        speculative_steps=state.speculative_steps,
+        thinking_tokens=state.thinking_tokens,
+        stop_reason=state.stop_reason,
+    )
+
+
+def _get_safe_math_context() -> Dict[str, Any]:
+    """Get safe mathematical functions for calculator"""
+    import math
+
+    return {
+        "__builtins__": {},
+        "abs": abs,
+        "round": round,
+        "min": min,
+        "max": max,
+        "sum": sum,
+        "pow": pow,
+        "sqrt": math.sqrt,
+        "sin": math.sin,
+        "cos": math.cos,
+        "tan": math.tan,
+        "log": math.log,
+        "log10": math.log10,
+        "exp": math.exp,
+        "pi": math.pi,
+        "e": math.e,
+    }
+
+
+# Tools offered to the model, registered by name with @tool
+TOOL_REGISTRY: Dict[str, Callable] = {}
+
+
+def tool(
+    cpu_bound: bool = False,
+    timeout: Optional[float] = None,
+    pure: bool = False,
+    ttl: Optional[float] = None,
+):
+    """Register a tool function and declare how it is executed
+
+    Args:
+        cpu_bound: Run the tool in a worker process, so it does not hold the
+            GIL while the model decodes and can be killed when it times out
+        timeout: Seconds before the call is abandoned (default: the
+            executor's per-tool timeout)
+        pure: The result depends only on the arguments, so it may be served
+            from the tool result cache
+        ttl: Seconds a cached result stays valid (default: until evicted)
+    """
+
+    def decorate(func: Callable) -> Callable:
+        func.cpu_bound = cpu_bound
+        func.timeout = timeout
+        func.pure = pure
+        func.ttl = ttl
+        TOOL_REGISTRY[func.__name__] = func
+        return func
+
+    return decorate
+
+
+@tool(cpu_bound=True, pure=True)
+def calculator(expression: str) -> str:
+    """
+    Safely evaluate a mathematical expression
+
+    Args:
+        expression: A mathematical expression like '2 + 3 * 4' or 'sqrt(16)'
+
+    Returns:
+        Calculation result as string
+
+    Raises:
+        ToolExecutionError: If expression is unsafe or evaluation fails
+    """
+    # Basic sanitization
+    unsafe_keywords = {"import", "__", "exec", "eval", "open", "file"}
+    if any(keyword in expression for keyword in unsafe_keywords):
+        raise ToolExecutionError("Expression contains unsafe operations")
+
+    safe_dict = _get_safe_math_context()
+
+    try:
+        result = eval(expression, safe_dict, {})
+        return str(result)
+    except Exception as e:
+        raise ToolExecutionError(f"Calculation failed: {str(e)}") from e
+
+
+@tool()
+def get_current_time(timezone: str = "local") -> str:
+    """
+    Get the current date and time
+
+    Args:
+        timezone: The timezone to use ('local', 'utc')
+    """
+    if timezone.lower() == "utc":
+        now = datetime.utcnow()
+        return f"Current UTC time: {now.strftime('%Y-%m-%d %H:%M:%S UTC')}"
+    else:
+        now = datetime.now()
+        return f"Current local time: {now.strftime('%Y-%m-%d %H:%M:%S')}"
+
+
+def _prepare_conversation(config: RunConfig) -> List[Dict[str, str]]:
+    """Prepare conversation history from config"""
+    conversation = []
+
+    # Load and add system prompt if provided
+    system_prompt = load_system_prompt(config.system)
+    if system_prompt:
+        conversation.append({"role": "system", "content": system_prompt})
+
+    # Add user prompt
+    conversation.append({"role": "user", "content": config.prompt})
+
+    return conversation
+
+
+def bizarro_run(config: RunConfig) -> str:
+    """
+    Run the language model with the given configuration
+
+    Args:
+        config: Run configuration
+
+    Returns:
+        Generated response text
+
+    Raises:
+        ModelError: If model operations fail
+    """
+    # Load the model and tokenizer
+    model_obj, tokenizer = load_model_quietly(config.model)
+    draft_model = load_draft_model(config.draft_model, tokenizer)
+
+    # Capture output if not printing directly
+    output_buffer = None
+    original_stdout = None
+    if not config.print_output:
+        output_buffer = io.StringIO()
+        original_stdout = sys.stdout
+        sys.stdout = output_buffer
+
+    try:
+        # Generate response
+        _, conversation = _generate_run(model_obj, tokenizer, config, draft_model)
+
+        # Return the response if capturing output
+        if not config.print_output:
+            sys.stdout = original_stdout
+
+            # Extract the response from conversation
+            for msg in reversed(conversation):
+                if msg["role"] == "assistant":
+                    return msg["content"]
+
+            # Fallback to captured output
+            return output_buffer.getvalue().strip()
+
+    finally:
+        if not config.print_output and original_stdout:
+            sys.stdout = original_stdout
+
+
+def _generate_run(
+    model_obj, tokenizer, config: RunConfig, draft_model=None
+) -> tuple[Optional[GenerationStats], List[Dict[str, str]]]:
+    """Generate the response for a one-shot run with a loaded model
+
+    draft_model is the loaded config.draft_model, if one is configured.
+
+    Returns:
+        Tuple of (generation statistics, final conversation)
+
+    Raises:
+        ModelError: If model operations fail
+    """
+    # Validate context length
+    model_max_context = get_model_context_length(model_obj, tokenizer)
+    if config.context_length is not None:
+        validate_context_length(config.context_length, model_max_context)
+
+    # Get available tools if enabled
+    available_tools = get_available_tools() if config.enable_tools else None
+
+    # Prepare conversation
+    conversation = _prepare_conversation(config)
+
+    # Create prompt cache for single run, seeded from a prefix snapshot
+    cache_manager, store, snapshot_key, prefix_length = _open_run_cache(
+        model_obj, tokenizer, config, conversation, available_tools, draft_model
+    )
+
+    # Generate response and collect statistics
+    stats = handle_conversation_turn(
+        model_obj=model_obj,
+        tokenizer=tokenizer,
+        conversation=conversation,
+        available_tools=available_tools,
+        max_tokens=config.max_tokens,
+        show_thinking=config.show_thinking,
+        verbose=config.verbose,
+        print_assistant_label=False,  # Never print "Assistant:" in run mode
+        cache_manager=cache_manager,
+        max_kv_size=config.max_kv_size,
+        kv_bits=config.kv_bits,
+        kv_group_size=config.kv_group_size,
+        quantized_kv_start=config.quantized_kv_start,
+        draft_model=draft_model,
+        num_draft_tokens=config.num_draft_tokens,
+        prompt_lookup_tokens=config.prompt_lookup_tokens,
+        max_tool_rounds=config.max_tool_rounds,
+        stop_at_tool_call=config.stop_at_tool_call,
+        stop_sequences=config.stop_sequences,
+        thinking_budget=config.thinking_budget,
+    )
+    _save_run_snapshot(store, snapshot_key, cache_manager, prefix_length)
+
+    return stats, conversation
+
+
+def get_available_tools() -> Dict[str, Callable]:
+    """Get the dictionary of available tools"""
+    return dict(TOOL_REGISTRY)
+
+
+def parse_tool_call(response_text: str) -> List[Dict[str, Any]]:
+    """Parse tool calls from model response (XML or JSON format)
+
+    Args:
+        response_text: Model response text containing tool calls
+
+    Returns:
+        List of parsed tool call dictionaries
+    """
+    tool_calls = []
+    patterns = [
+        (r"<tool_call>(.*?)</tool_call>", re.DOTALL),
+        (r"```json\s*({.*?})\s*```", re.DOTALL),
+    ]
+
+    for pattern, flags in patterns:
+        matches = re.findall(pattern, response_text, flags)
+        for match in matches:
+            tool_call = _parse_tool_call_json(match)
+            if tool_call is not None:
+                tool_calls.append(tool_call)
+        if tool_calls:
+            break
+    return tool_calls
+
+
+def _parse_tool_call_json(text: str) -> Optional[Dict[str, Any]]:
+    """Parse the JSON body of a single tool call, or None if it is invalid"""
+    try:
+        tool_call = json.loads(text.strip())
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(tool_call, dict) or "name" not in tool_call:
+        return None
+    tool_call.setdefault("arguments", {})
+    return tool_call
+
+
+def execute_tool_call(
+    tool_call: Dict[str, Any], available_tools: Dict[str, Callable]
+) -> str:
+    """Execute a tool call and return the result
+
+    Args:
+        tool_call: Tool call dictionary with 'name' and 'arguments'
+        available_tools: Dictionary of available tool functions
+
+    Returns:
+        Tool execution result as string
+
+    Raises:
+        ToolExecutionError: If tool execution fails
+    """
+    tool_name = tool_call.get("name")
+    tool_args = tool_call.get("arguments", {})
+
+    if tool_name not in available_tools:
+        raise ToolExecutionError(
+            f"Tool '{tool_name}' not found. Available tools: {', '.join(available_tools.keys())}"
+        )
+
+    try:
+        return str(available_tools[tool_name](**tool_args))
+    except Exception as e:
+        raise ToolExecutionError(f"Error executing {tool_name}: {str(e)}") from e
+
+
+def _run_tool(
+    tool_call: Dict[str, Any], tools: Dict[str, Callable]
+) -> tuple[bool, str]:
+    """Execute one tool call in a worker
+
+    Returns:
+        Tuple of (succeeded, result or error text)
+    """
+    try:
+        return True, execute_tool_call(tool_call, tools)
+    except ToolExecutionError as e:
+        return False, str(e)
+
+
+@dataclass
+class ToolResult:
+    """Result of one tool call"""
+
+    content: str
+    # True if served from the cache, False if a pure tool missed it, None
+    # for tools whose results are never cached
+    cache_hit: Optional[bool] = None
+
+
+class ToolResultCache:
+    """LRU cache of pure tool results keyed by tool name and arguments"""
+
+    def __init__(self, max_entries: int = TOOL_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[str, Optional[float]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(tool_call: Dict[str, Any]) -> Optional[str]:
+        """Canonical key for a call, or None if its arguments are not JSON"""
+        try:
+            return json.dumps(
+                [tool_call.get("name"), tool_call.get("arguments", {})],
+                sort_keys=True,
+                separators=(",", ":"),
+            )
+        except (TypeError, ValueError):
+            return None
+
+    def get(self, key: str) -> Optional[str]:
+        """Cached result for key, or None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            result, expires = entry
+            if expires is not None and time.monotonic() >= expires:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return result
+
+    def put(self, key: str, result: str, ttl: Optional[float] = None):
+        """Cache a result, evicting the least recently used beyond the limit"""
+        with self._lock:
+            expires = time.monotonic() + ttl if ttl is not None else None
+            self._entries[key] = (result, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class ToolExecutor:
+    """Runs the tool calls of one response concurrently
+
+    Tools run on a thread pool, except those declared cpu_bound, which run
+    in a pool of spawned worker processes. Each call has its own timeout and
+    the whole round is capped, so a runaway expression cannot freeze the
+    session. A process pool with a timed-out call is terminated and started
+    again on next use; a timed-out thread is left to finish in the background.
+    Successful results of pure tools are memoized in a ToolResultCache.
+    """
+
+    def __init__(
+        self,
+        tool_timeout: float = DEFAULT_TOOL_TIMEOUT,
+        round_timeout: float = DEFAULT_TOOL_ROUND_TIMEOUT,
+        max_workers: int = TOOL_MAX_WORKERS,
+        max_processes: int = TOOL_MAX_PROCESSES,
+        cache_size: int = TOOL_CACHE_SIZE,
+    ):
+        self.tool_timeout = tool_timeout
+        self.round_timeout = round_timeout
+        self.max_processes = max_processes
+        self._threads = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="bizarro-tool"
+        )
+        self._processes = None
+        self._lock = threading.Lock()
+        self.cache = ToolResultCache(cache_size)
+
+    def run(
+        self, tool_calls: List[Dict[str, Any]], available_tools: Dict[str, Callable]
+    ) -> List[ToolResult]:
+        """Execute tool calls concurrently
+
+        Returns:
+            Result (or error) of each call, in the order of tool_calls
+        """
+        started = time.monotonic()
+        round_deadline = started + self.round_timeout
+
+        # Serve repeated calls to pure tools from the cache, submit the rest
+        results: List[Optional[ToolResult]] = []
+        pending = []
+        for tool_call in tool_calls:
+            func = available_tools.get(tool_call.get("name"))
+            key = self.cache.key(tool_call) if getattr(func, "pure", False) else None
+            cached = self.cache.get(key) if key is not None else None
+            if cached is not None:
+                results.append(ToolResult(cached, cache_hit=True))
+                pending.append(None)
+            else:
+                results.append(None)
+                pending.append((key, func, *self._submit(tool_call, available_tools)))
+
+        for i, (tool_call, submitted) in enumerate(zip(tool_calls, pending)):
+            if submitted is None:
+                continue
+            key, func, handle, pool, timeout = submitted
+            name = tool_call.get("name")
+            remaining = min(started + timeout, round_deadline) - time.monotonic()
+            try:
+                ok, content = self._wait(handle, pool, max(0.0, remaining))
+            except TimeoutError:
+                if pool is not None:
+                    self._terminate(pool)
+                elapsed = time.monotonic() - started
+                ok, content = (
+                    False,
+                    f"Error executing {name}: timed out after {elapsed:.1f}s",
+                )
+            except Exception as e:
+                ok, content = False, f"Error executing {name}: {e}"
+            if ok and key is not None:
+                self.cache.put(key, content, func.ttl)
+            results[i] = ToolResult(content, cache_hit=False if key else None)
+        return results
+
+    def close(self):
+        """Stop the worker threads and processes"""
+        self._threads.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            pool, self._processes = self._processes, None
+        if pool is not None:
+            pool.terminate()
+
+    def _submit(self, tool_call: Dict[str, Any], available_tools: Dict[str, Callable]):
+        """Start a tool call, returning (handle, process pool or None, timeout)"""
+        func = available_tools.get(tool_call.get("name"))
+        timeout = getattr(func, "timeout", None) or self.tool_timeout
+        if not getattr(func, "cpu_bound", False):
+            # Unknown tools also end up here and fail with the usual message
+            future = self._threads.submit(_run_tool, tool_call, available_tools)
+            return future, None, timeout
+        pool = self._process_pool()
+        tools = {tool_call.get("name"): func}
+        return pool.apply_async(_run_tool, (tool_call, tools)), pool, timeout
+
+    def _wait(self, handle, pool, timeout: float) -> tuple[bool, str]:
+        """Wait for a submitted call, raising TimeoutError when it is late"""
+        import multiprocessing
+
+        if pool is None:
+            return handle.result(timeout)
+        if pool is not self._processes and not handle.ready():
+            # Another call's timeout already terminated this pool
+            raise ToolExecutionError("cancelled after another tool timed out")
+        try:
+            return handle.get(timeout)
+        except multiprocessing.TimeoutError as e:
+            raise TimeoutError from e
+
+    def _process_pool(self):
+        import multiprocessing
+
+        with self._lock:
+            if self._processes is None:
+                # Spawned rather than forked: forking a process that has
+                # initialized Metal is not safe
+                context = multiprocessing.get_context("spawn")
+                self._processes = context.Pool(self.max_processes)
+            return self._processes
+
+    def _terminate(self, pool):
+        with self._lock:
+            if self._processes is pool:
+                self._processes = None
+        pool.terminate()
+
+
+_tool_executor: Optional[ToolExecutor] = None
+_tool_executor_lock = threading.Lock()
+
+
+def get_tool_executor() -> ToolExecutor:
+    """Shared ToolExecutor for the process, created on first use"""
+    global _tool_executor
+    with _tool_executor_lock:
+        if _tool_executor is None:
+            _tool_executor = ToolExecutor()
+            atexit.register(_tool_executor.close)
+        return _tool_executor
+
+
+def _execute_tool_calls(
+    tool_calls: List[Dict[str, Any]],
+    available_tools: Dict[str, Callable],
+    conversation: List[Dict[str, str]],
+    verbose: bool,
+    stats: Optional[GenerationStats] = None,
+) -> List[Dict[str, str]]:
+    """Execute tool calls and add results to conversation
+
+    Args:
+        tool_calls: List of tool calls to execute
+        available_tools: Available tool functions
+        conversation: Conversation history to update
+        verbose: Whether to print verbose output
+        stats: Optional statistics to record tool cache hits and misses in
+
+    Returns:
+        The tool result messages appended to conversation
+    """
+    if verbose:
+        for tool_call in tool_calls:
+            console.print(f"[dim]Executing tool: {tool_call.get('name')}[/dim]")
+
+    with _trace_span("tools", calls=[call.get("name") for call in tool_calls]):
+        results = get_tool_executor().run(tool_calls, available_tools)
+
+    first_result = len(conversation)
+    for tool_call, tool_result in zip(tool_calls, results):
+        if verbose:
+            cached = " (cached)" if tool_result.cache_hit else ""
+            console.print(f"[green]Tool result{cached}: {tool_result.content}[/green]")
+        if stats is not None and tool_result.cache_hit is not None:
+            if tool_result.cache_hit:
+                stats.tool_cache_hits += 1
+            else:
+                stats.tool_cache_misses += 1
+
+        # Add tool result to conversation
+        conversation.append(
+            {
+                "role": "tool",
+                "name": tool_call.get("name"),
+                "content": tool_result.content,
+            }
+        )
+    return conversation[first_result:]
+
+
+def _render_prompt(
+    tokenizer,
+    conversation: List[Dict[str, str]],
+    available_tools: Optional[Dict[str, Callable]],
+    add_generation_prompt: bool = True,
+    tool_schemas: Optional[List[Dict[str, Any]]] = None,
+) -> List[int]:
+    """Render a conversation to prompt tokens with the chat template
+
+    Tools are rendered from available_tools if given, otherwise from
+    tool_schemas (JSON schemas supplied by an API client).
+    """
+    tools_list = _tool_schemas(available_tools) if available_tools else tool_schemas
+
+    if tools_list:
+        return tokenizer.apply_chat_template(
+            conversation=conversation,
+            add_generation_prompt=add_generation_prompt,
+            tools=tools_list,
+        )
+    return tokenizer.apply_chat_template(
+        conversation=conversation, add_generation_prompt=add_generation_prompt
+    )
+
+
+def _tool_schemas(available_tools: Dict[str, Callable]) -> List[Dict[str, Any]]:
+    """JSON schemas of tool functions, converted once per set of tools
+
+    apply_chat_template builds these from the docstrings of the functions
+    it is given, on every call, so pass it the cached schemas instead.
+    """
+    return _tool_schemas_for(tuple(available_tools.values()))
+
+
+@functools.lru_cache(maxsize=8)
+def _tool_schemas_for(functions: tuple) -> List[Dict[str, Any]]:
+    from transformers.utils import get_json_schema
+
+    return [get_json_schema(function) for function in functions]
+
+
+class PromptBuilder:
+    """Incremental chat template rendering for a growing conversation
+
+    Rendering with apply_chat_template costs time proportional to the whole
+    conversation. The builder keeps the rendered text and tokens of the
+    conversation so far; messages appended to it are rendered with only
+    the leading system messages and the current exchange as context, and
+    the text they add is tokenized and appended. Any other change to the
+    conversation (such as evicted turns) falls back to a full render.
+
+    The first verify_renders incremental renders are checked byte for byte
+    against a full render. Templates that render a message differently
+    depending on the messages after it fail the check, and the builder
+    renders in full from then on.
+    """
+
+    def __init__(
+        self,
+        tokenizer,
+        available_tools: Optional[Dict[str, Callable]] = None,
+        verify_renders: int = PROMPT_BUILDER_VERIFY_RENDERS,
+    ):
+        self.tokenizer = tokenizer
+        self.available_tools = available_tools
+        self.tools = _tool_schemas(available_tools) if available_tools else None
+        self.verify_renders = verify_renders
+        self.incremental = True
+        self.messages: List[Dict[str, str]] = []
+        self.text = ""
+        self.tokens: List[int] = []
+        self._generation_prompt: Optional[List[int]] = None
+
+    def render(
+        self, conversation: List[Dict[str, str]], add_generation_prompt: bool = True
+    ) -> List[int]:
+        """Prompt tokens for conversation, reusing what was rendered before"""
+        appended = (
+            self.incremental
+            and 0 < len(self.messages) < len(conversation)
+            and conversation[: len(self.messages)] == self.messages
+        )
+        delta = self._render_appended(conversation) if appended else None
+        if delta is None:
+            self.text = self._render_text(conversation)
+            self.tokens = self._encode(self.text)
+        else:
+            self.text += delta
+            self.tokens += self._encode(delta)
+            if self.verify_renders > 0:
+                self.verify_renders -= 1
+                self.verify(conversation)
+        self.messages = [dict(message) for message in conversation]
+
+        if not add_generation_prompt:
+            return list(self.tokens)
+        generation_prompt = self._generation_prompt_tokens()
+        if generation_prompt is None:
+            return self._encode(self._render_text(conversation, True))
+        return self.tokens + generation_prompt
+
+    def verify(self, conversation: List[Dict[str, str]]) -> bool:
+        """Check the builder's state against a full render of conversation
+
+        On a mismatch the full render is adopted and incremental rendering
+        is turned off.
+        """
+        text = self._render_text(conversation)
+        tokens = self._encode(text)
+        if text == self.text and tokens == self.tokens:
+            return True
+        self.incremental = False
+        self.text, self.tokens = text, tokens
+        return False
+
+    def _render_appended(self, conversation: List[Dict[str, str]]) -> Optional[str]:
+        """Text the messages after self.messages add, or None if not a suffix"""
+        head = 0
+        while head < len(self.messages) and self.messages[head]["role"] == "system":
+            head += 1
+        exchange = head
+        for i in range(head, len(self.messages)):
+            if self.messages[i]["role"] == "user":
+                exchange = i
+        context = self.messages[:head] + self.messages[exchange:]
+
+        before = self._render_text(context)
+        after = self._render_text(context + conversation[len(self.messages) :])
+        if not after.startswith(before):
+            return None
+        return after[len(before) :]
+
+    def _generation_prompt_tokens(self) -> Optional[List[int]]:
+        """Tokens add_generation_prompt appends, if it only appends"""
+        if self._generation_prompt is None:
+            probe = [{"role": "user", "content": "?"}]
+            before = self._render_text(probe)
+            after = self._render_text(probe, add_generation_prompt=True)
+            if not after.startswith(before):
+                return None
+            self._generation_prompt = self._encode(after[len(before) :])
+        return self._generation_prompt
+
+    def _render_text(
+        self, conversation: List[Dict[str, str]], add_generation_prompt: bool = False
+    ) -> str:
+        return self.tokenizer.apply_chat_template(
+            conversation=conversation,
+            add_generation_prompt=add_generation_prompt,
+            tools=self.tools,
+            tokenize=False,
+        )
+
+    def _encode(self, text: str) -> List[int]:
+        return self.tokenizer.encode(text, add_special_tokens=False)
+
+
+def _tool_results_suffix(
+    tokenizer, generated_tokens: List[int], tool_messages: List[Dict[str, str]]
+) -> Optional[List[int]]:
+    """Tokens that continue a generated response with its tool results
+
+    A stand-in exchange is rendered with and without the tool messages and
+    the difference is taken, so the rest of the conversation is not
+    re-templated and the response stays exactly as generated in the cache.
+
+    Returns:
+        Tokens to append after generated_tokens, ending with the generation
+        prompt, or None if the template does not render tool results as a
+        plain suffix of the previous turn
+    """
+    # Non-empty reasoning keeps templates that only add an empty think block
+    # to the last assistant message (Qwen3) rendering the turn the same way
+    probe = [
+        {"role": "user", "content": "?"},
+        {"role": "assistant", "content": "<think>\nx\n</think>\n\n!"},
+    ]
+    before = tokenizer.apply_chat_template(probe, tokenize=False)
+    after = tokenizer.apply_chat_template(
+        probe + tool_messages, add_generation_prompt=True, tokenize=False
+    )
+    if not after.startswith(before) or "!" not in before:
+        return None
+
+    # What the template closes the assistant turn with, minus the EOS token
+    # the model may already have generated
+    terminator = before[before.rindex("!") + 1 :]
+    if generated_tokens and generated_tokens[-1] in tokenizer.eos_token_ids:
+        eos_text = tokenizer.decode(generated_tokens[-1:])
+        if not terminator.startswith(eos_text):
+            return None
+        terminator = terminator[len(eos_text) :]
+
+    return tokenizer.encode(terminator + after[len(before) :], add_special_tokens=False)
+
+
+def _open_run_cache(
+    model_obj,
+    tokenizer,
+    config: RunConfig,
+    conversation: List[Dict[str, str]],
+    available_tools: Optional[Dict[str, Callable]],
+    draft_model=None,
+) -> tuple[PromptCacheManager, Optional[PromptSnapshotStore], Optional[str], int]:
+    """Create the cache for a one-shot run, seeded from a prefix snapshot
+
+    Returns:
+        Tuple of (cache manager, snapshot store, snapshot key, prefix length).
+        The key is only set when no snapshot exists yet and one should be
+        written with _save_run_snapshot after generation.
+    """
+    keep = None
+    if config.max_kv_size is not None:
+        keep = _pinned_prefix_length(
+            tokenizer, conversation, available_tools, config.max_kv_size
+        )
+    cache_options = {
+        "kv_bits": config.kv_bits,
+        "kv_group_size": config.kv_group_size,
+        "quantized_kv_start": config.quantized_kv_start,
+        "keep": keep or KV_SINK_TOKENS,
+    }
+    cache_manager = PromptCacheManager(
+        model_obj,
+        max_kv_size=config.max_kv_size,
+        draft_model=draft_model,
+        **cache_options,
+    )
+    prefix = conversation[:-1]
+    if not config.use_snapshots or not prefix:
+        return cache_manager, None, None, 0
+
+    # The snapshot covers everything the template renders before the user turn
+    prefix_tokens = _render_prompt(
+        tokenizer, prefix, available_tools, add_generation_prompt=False
+    )
+    full_tokens = _render_prompt(tokenizer, conversation, available_tools)
+    prefix_tokens = prefix_tokens[: _common_prefix_length(prefix_tokens, full_tokens)]
+    if not prefix_tokens:
+        return cache_manager, None, None, 0
+
+    store = PromptSnapshotStore(config.snapshot_dir)
+    fingerprint = _model_fingerprint(config.model)
+    if draft_model is not None:
+        # The snapshot holds the draft model's layers too
+        fingerprint += ":" + _model_fingerprint(config.draft_model)
+    key = store.key(
+        fingerprint,
+        prefix_tokens,
+        config.max_kv_size,
+        kv_quantization=(
+            (config.kv_bits, config.kv_group_size, config.quantized_kv_start)
+            if config.kv_bits is not None
+            else None
+        ),
+        keep=keep,
+    )
+    snapshot = store.load(
+        key,
+        model_obj,
+        max_kv_size=config.max_kv_size,
+        draft_model=draft_model,
+        **cache_options,
+    )
+    if snapshot is not None:
+        return snapshot, store, None, len(prefix_tokens)
+    return cache_manager, store, key, len(prefix_tokens)
+
+
+def _save_run_snapshot(
+    store: Optional[PromptSnapshotStore],
+    key: Optional[str],
+    cache_manager: PromptCacheManager,
+    prefix_length: int,
+):
+    """Trim a finished run's cache back to its prefix and store it"""
+    if store is None or key is None:
+        return
+    if not cache_manager.truncate(prefix_length):
+        return
+    try:
+        with _trace_span("cache_save"):
+            store.save(key, cache_manager)
+    except Exception:
+        # A failed snapshot only costs the next run a full prefill
+        pass
+
+
+def handle_conversation_turn(
+    model_obj,
+    tokenizer,
+    conversation: List[Dict[str, str]],
+    available_tools: Optional[Dict[str, Callable]],
+    max_tokens: int,
+    show_thinking: bool,
+    verbose: bool,
+    print_assistant_label: bool = True,
+    cache_manager: Optional[PromptCacheManager] = None,
+    max_kv_size: Optional[int] = None,
+    kv_bits: Optional[int] = None,
+    kv_group_size: int = DEFAULT_KV_GROUP_SIZE,
+    quantized_kv_start: int = DEFAULT_QUANTIZED_KV_START,
+    draft_model=None,
+    num_draft_tokens: int = DEFAULT_NUM_DRAFT_TOKENS,
+    prompt_lookup_tokens: int = 0,
+    max_tool_rounds: int = DEFAULT_MAX_TOOL_ROUNDS,
+    stop_at_tool_call: bool = False,
+    stop_sequences: Optional[List[str]] = None,
+    thinking_budget: Optional[int] = None,
+    context_window: Optional[ConversationWindow] = None,
+    prompt_builder: Optional[PromptBuilder] = None,
+) -> Optional[GenerationStats]:
+    """
+    Handle a complete conversation turn including tool calls if needed.
+
+    Updates conversation in place and returns statistics. After each round
+    of tool calls, generation continues from the tokens already in the cache
+    with only the tool results appended.
+
+    Args:
+        model_obj: Language model object
+        tokenizer: Tokenizer object
+        conversation: Conversation history (updated in place)
+        available_tools: Available tool functions
+        max_tokens: Maximum tokens to generate
+        show_thinking: Whether to show thinking process
+        verbose: Enable verbose output
+        print_assistant_label: Whether to print assistant label
+        cache_manager: Optional prompt cache manager kept across turns
+        max_kv_size: Maximum KV cache size
+        kv_bits: Quantize the KV cache to this many bits; None keeps it in
+            full precision
+        kv_group_size: Group size for KV cache quantization
+        quantized_kv_start: Cache length at which a layer is quantized
+        draft_model: Optional draft model for speculative decoding
+        num_draft_tokens: Tokens proposed by the draft model per step
+        prompt_lookup_tokens: Tokens drafted per step by prompt lookup
+            decoding; 0 disables it
+        max_tool_rounds: Maximum rounds of tool calls before the turn ends
+        stop_at_tool_call: Run each tool call as soon as it has streamed out
+            instead of after the whole response
+        stop_sequences: Strings that end generation when they are produced
+        thinking_budget: Tokens allowed per thinking block before the model
+            is made to close it; None leaves thinking unbounded
+        context_window: Optional ConversationWindow; old turns are evicted
+            from conversation before rendering to keep the prompt in budget
+        prompt_builder: Optional PromptBuilder kept across turns, so only the
+            messages added since the last turn are rendered
+
+    Returns:
+        Generation statistics or None
+    """
+    if context_window is not None:
+        evicted = context_window.fit(conversation)
+        if evicted:
+            console.print(
+                f"[dim]Dropped {evicted} old messages to stay within "
+                f"{context_window.budget:,} prompt tokens[/dim]"
+            )
+
+    # Generate the prompt
+    if prompt_builder is None:
+        prompt_builder = PromptBuilder(tokenizer, available_tools)
+    prompt = prompt_builder.render(conversation)
+    stats = None
+
+    # A cache manager was set up with its pinned prefix already
+    kv_keep = KV_SINK_TOKENS
+    if cache_manager is None and max_kv_size is not None:
+        kv_keep = _pinned_prefix_length(
+            tokenizer, conversation, available_tools, max_kv_size
+        )
+
+    for tool_round in range(max_tool_rounds + 1):
+        generation_start = time.time()
+        result = stream_with_thinking_handler(
+            model=model_obj,
+            tokenizer=tokenizer,
+            prompt=prompt,
+            max_tokens=max_tokens,
+            show_thinking=show_thinking,
+            tools=available_tools,
+            verbose=verbose,
+            print_assistant_label=print_assistant_label,
+            max_kv_size=max_kv_size,
+            kv_bits=kv_bits,
+            kv_group_size=kv_group_size,
+            quantized_kv_start=quantized_kv_start,
+            kv_keep=kv_keep,
+            cache_manager=cache_manager,
+            draft_model=draft_model,
+            num_draft_tokens=num_draft_tokens,
+            prompt_lookup_tokens=prompt_lookup_tokens,
+            stop_at_tool_call=stop_at_tool_call,
+            stop_sequences=stop_sequences,
+            thinking_budget=thinking_budget,
+        )
+        generation_time = time.time() - generation_start
+        stats = (
+            _combine_generation_stats(stats, result.stats) if stats else result.stats
+        )
+
+        # Add assistant response to conversation if there's content
+        if result.response:
+            conversation.append({"role": "assistant", "content": result.response})
+
+        # If content was printed, add newline
+        if result.visible_content_printed:
+            print()  # Newline after response
+
+        if not result.tool_calls:
+            break
+        if tool_round == max_tool_rounds:
+            console.print(
+                f"[yellow]Stopped after {max_tool_rounds} rounds of tool calls[/yellow]"
+            )
+            break
+
+        tool_start = time.time()
+        tool_messages = _execute_tool_calls(
+            result.tool_calls, available_tools, conversation, verbose, stats=stats
+        )
+        tool_time = time.time() - tool_start
+        stats.tool_rounds += 1
+        stats.tool_time += tool_time
+        if verbose:
+            console.print(
+                f"[dim]Tool round {tool_round + 1}: {generation_time:.2f}s "
+                f"generating, {tool_time:.2f}s in tools[/dim]"
+            )
+
+        # Continue from the cached sequence with only the tool results added
+        suffix = _tool_results_suffix(tokenizer, result.tokens, tool_messages)
+        if suffix is None:
+            prompt = prompt_builder.render(conversation)
+        else:
+            prompt = list(prompt) + result.tokens + suffix
+
+    return stats
+
+
+def _combine_generation_stats(
+    stats: GenerationStats, follow_up_stats: GenerationStats
+) -> GenerationStats:
+    """Aggregate the statistics of a response and its follow-up after tools"""
+    total_time = stats.total_time + follow_up_stats.total_time
+    completion_tokens = stats.completion_tokens + follow_up_stats.completion_tokens
+    prefilled_tokens = stats.prefilled_tokens + follow_up_stats.prefilled_tokens
+    prefill_time = stats.prefill_time + follow_up_stats.prefill_time
+    decode_time = stats.decode_time + follow_up_stats.decode_time
+    return GenerationStats(
+        prompt_tokens=stats.prompt_tokens,
+        completion_tokens=completion_tokens,
+        total_tokens=stats.total_tokens + follow_up_stats.total_tokens,
+        total_time=total_time,
+        time_to_first_token=stats.time_to_first_token,
+        tokens_per_second=completion_tokens / total_time if total_time > 0 else 0,
+        reused_tokens=stats.reused_tokens + follow_up_stats.reused_tokens,
+        prefilled_tokens=prefilled_tokens,
+        prefill_time=prefill_time,
+        prefill_tokens_per_second=prefilled_tokens / prefill_time
+        if prefill_time > 0
+        else 0,
+        decode_time=decode_time,
+        decode_tokens_per_second=completion_tokens / decode_time
+        if decode_time > 0
+        else 0,
+        peak_memory=max(stats.peak_memory, follow_up_stats.peak_memory),
+        draft_proposed_tokens=stats.draft_proposed_tokens
+        + follow_up_stats.draft_proposed_tokens,
+        draft_accepted_tokens=stats.draft_accepted_tokens
+        + follow_up_stats.draft_accepted_tokens,
+        speculative_steps=stats.speculative_steps + follow_up_stats.speculative_steps,
+        tool_rounds=stats.tool_rounds + follow_up_stats.tool_rounds,
+        tool_time=stats.tool_time + follow_up_stats.tool_time,
+        tool_cache_hits=stats.tool_cache_hits + follow_up_stats.tool_cache_hits,
+        tool_cache_misses=stats.tool_cache_misses + follow_up_stats.tool_cache_misses,
+        thinking_tokens=stats.thinking_tokens + follow_up_stats.thinking_tokens,
+        stop_reason=follow_up_stats.stop_reason,
+    )
+
+
+def load_system_prompt(system_input: Optional[str]) -> Optional[str]:
+    """Load system prompt from string or file
+
+    Args:
+        system_input: System prompt string or file path
 
     Returns:
-        List of parsed tool call dictionaries
+        System prompt text or None
+
+    Raises:
+        PromptError: If file reading fails
+    """
+    if not system_input:
+        return None
+
+    # Try file first, then treat as string
+    if os.path.isfile(system_input):
+        try:
+            with open(system_input, "r", encoding="utf-8") as f:
+                return f.read().strip()
+        except Exception as e:
+            raise PromptError(
+                f"Error reading system prompt file '{system_input}': {e}"
+            ) from e
+
+    return system_input
+
+
+def print_generation_stats(stats: GenerationStats, verbose: bool = False):
+    """Print generation statistics in a concise format"""
+    if not stats:
+        return
+
+    # Create a console that outputs to stderr
+    err_console = Console(stderr=True)
+
+    # Only print detailed stats if verbose, otherwise just the summary
+    if verbose:
+        err_console.print("\n[dim]─" * 50 + "[/dim]")
+        err_console.print("[bold]Generation Statistics:[/bold]")
+        err_console.print(
+            f"[dim]Prompt tokens: {stats.prompt_tokens:,} "
+            f"({stats.reused_tokens:,} reused from cache, "
+            f"{stats.prefilled_tokens:,} prefilled)[/dim]"
+        )
+        if stats.thinking_tokens:
+            err_console.print(
+                f"[dim]Completion tokens: {stats.completion_tokens:,} "
+                f"({stats.thinking_tokens:,} thinking, "
+                f"{stats.answer_tokens:,} answer)[/dim]"
+            )
+        else:
+            err_console.print(
+                f"[dim]Completion tokens: {stats.completion_tokens:,}[/dim]"
+            )
+        err_console.print(f"[dim]Total tokens: {stats.total_tokens:,}[/dim]")
+        err_console.print(
+            f"[dim]Time to first token: {stats.time_to_first_token:.3f}s[/dim]"
+        )
+        err_console.print(f"[dim]Total time: {stats.total_time:.2f}s[/dim]")
+        err_console.print(
+            f"[dim]Prefill: {stats.prefilled_tokens:,} tokens in "
+            f"{stats.prefill_time:.2f}s "
+            f"({stats.prefill_tokens_per_second:.1f} tokens/s)[/dim]"
+        )
+        # Speculative decoding emits several tokens per model step
+        effective = "effective " if stats.speculative_steps else ""
+        err_console.print(
+            f"[dim]Decode: {stats.completion_tokens:,} tokens in "
+            f"{stats.decode_time:.2f}s "
+            f"({stats.decode_tokens_per_second:.1f} {effective}tokens/s)[/dim]"
+        )
+        if stats.peak_memory:
+            err_console.print(f"[dim]Peak memory: {stats.peak_memory:.2f} GB[/dim]")
+        if stats.stop_reason:
+            err_console.print(f"[dim]Stop reason: {stats.stop_reason}[/dim]")
+        if stats.tool_rounds:
+            err_console.print(
+                f"[dim]Tool rounds: {stats.tool_rounds} "
+                f"({stats.tool_time:.2f}s in tools, "
+                f"{stats.tool_cache_hits} cache hits, "
+                f"{stats.tool_cache_misses} misses)[/dim]"
+            )
+        if stats.speculative_steps:
+            err_console.print(
+                f"[dim]Draft tokens accepted: {stats.draft_accepted_tokens:,}"
+                f"/{stats.draft_proposed_tokens:,} "
+                f"({stats.draft_acceptance_rate:.0%})[/dim]"
+            )
+            err_console.print(
+                f"[dim]Accepted tokens/step: {stats.accepted_tokens_per_step:.2f}[/dim]"
+            )
+    else:
+        # Concise one-line summary
+        draft_info = ""
+        if stats.speculative_steps:
+            draft_info = f", {stats.draft_acceptance_rate:.0%} draft acceptance"
+        err_console.print(
+            f"\n[dim]{stats.completion_tokens} tokens in {stats.total_time:.1f}s "
+            f"({stats.decode_tokens_per_second:.1f} tokens/s decode, "
+            f"{stats.prefill_tokens_per_second:.1f} tokens/s prefill{draft_info})[/dim]"
+        )
+
+
+def print_chat_session_summary(session_stats: SessionStats):
+    """Print a summary of the chat session statistics"""
+    session_duration = time.time() - session_stats.session_start
+
+    # Create a console that outputs to stderr
+    err_console = Console(stderr=True)
+
+    err_console.print("\n[bold]Chat Session Summary:[/bold]")
+    err_console.print("[dim]─" * 50 + "[/dim]")
+
+    # Basic stats
+    err_console.print(f"Total turns: {session_stats.total_turns}")
+    err_console.print(f"Total prompt tokens: {session_stats.total_prompt_tokens:,}")
+    err_console.print(
+        f"Prompt tokens reused from cache: {session_stats.total_reused_tokens:,}"
+    )
+    err_console.print(
+        f"Total completion tokens: {session_stats.total_completion_tokens:,}"
+    )
+    err_console.print(f"Total tokens: {session_stats.total_tokens:,}")
+
+    # Time stats
+    err_console.print(f"Total generation time: {session_stats.total_time:.1f}s")
+    err_console.print(f"Session duration: {session_duration:.1f}s")
+
+    # Average stats
+    if session_stats.total_turns > 0:
+        avg_completion_tokens = (
+            session_stats.total_completion_tokens / session_stats.total_turns
+        )
+        avg_time_per_turn = session_stats.total_time / session_stats.total_turns
+        err_console.print(f"Average tokens/turn: {avg_completion_tokens:.0f}")
+        err_console.print(f"Average time/turn: {avg_time_per_turn:.1f}s")
+
+        avg_ttft = session_stats.total_time_to_first_token / session_stats.total_turns
+        err_console.print(f"Average time to first token: {avg_ttft:.3f}s")
+
+    # Overall performance
+    if session_stats.total_time > 0:
+        overall_tps = session_stats.total_completion_tokens / session_stats.total_time
+        err_console.print(f"Overall tokens/second: {overall_tps:.1f}")
+    if session_stats.total_prefill_time > 0:
+        prefill_tps = (
+            session_stats.total_prefilled_tokens / session_stats.total_prefill_time
+        )
+        err_console.print(f"Prefill tokens/second: {prefill_tps:.1f}")
+    if session_stats.total_decode_time > 0:
+        decode_tps = (
+            session_stats.total_completion_tokens / session_stats.total_decode_time
+        )
+        err_console.print(f"Decode tokens/second: {decode_tps:.1f}")
+    if session_stats.peak_memory > 0:
+        err_console.print(f"Peak memory: {session_stats.peak_memory:.2f} GB")
+    if session_stats.total_draft_proposed_tokens > 0:
+        acceptance_rate = (
+            session_stats.total_draft_accepted_tokens
+            / session_stats.total_draft_proposed_tokens
+        )
+        err_console.print(f"Draft acceptance rate: {acceptance_rate:.0%}")
+    tool_cache_lookups = (
+        session_stats.total_tool_cache_hits + session_stats.total_tool_cache_misses
+    )
+    if tool_cache_lookups > 0:
+        err_console.print(
+            f"Tool cache: {session_stats.total_tool_cache_hits} hits, "
+            f"{session_stats.total_tool_cache_misses} misses"
+        )
+
+    err_console.print("[dim]─" * 50 + "[/dim]")
+
+
+# Machine-readable metrics
+
+
+class MetricsSink:
+    """Append one JSON record per generation to a file or Unix socket
+
+    A target of the form unix:PATH is connected to as a stream socket, and
+    anything else is a file opened for appending. A failed write drops the
+    record (with a single warning) and reconnects on the next one, so a
+    missing collector never interrupts generation.
+    """
+
+    def __init__(self, target: str):
+        self.target = target
+        self._stream = None
+        self._warned = False
+        self._lock = threading.Lock()
+
+    def _open(self):
+        if not self.target.startswith("unix:"):
+            return open(self.target, "a", encoding="utf-8")
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.target[len("unix:") :])
+            return sock.makefile("w", encoding="utf-8")
+        finally:
+            # The file object keeps the connection open
+            sock.close()
+
+    def emit(self, record: Dict[str, Any]):
+        """Write a record as one line of JSON"""
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            try:
+                if self._stream is None:
+                    self._stream = self._open()
+                self._stream.write(line)
+                self._stream.flush()
+            except OSError as e:
+                self._close_stream()
+                if not self._warned:
+                    self._warned = True
+                    Console(stderr=True).print(
+                        f"[yellow]Warning: Could not write metrics to "
+                        f"{self.target}: {e}[/yellow]"
+                    )
+
+    def _close_stream(self):
+        if self._stream is not None:
+            try:
+                self._stream.close()
+            except OSError:
+                pass
+            self._stream = None
+
+    def close(self):
+        with self._lock:
+            self._close_stream()
+
+
+def _turn_metrics(stats: GenerationStats, **context) -> Dict[str, Any]:
+    """The MetricsSink record for one generation
+
+    context (command, model, session, turn, ...) is included as is.
+    """
+    return {
+        "ts": round(time.time(), 3),
+        **context,
+        "prompt_tokens": stats.prompt_tokens,
+        "reused_tokens": stats.reused_tokens,
+        "prefilled_tokens": stats.prefilled_tokens,
+        "completion_tokens": stats.completion_tokens,
+        "thinking_tokens": stats.thinking_tokens,
+        "ttft": round(stats.time_to_first_token, 4),
+        "prefill_tps": round(stats.prefill_tokens_per_second, 2),
+        "decode_tps": round(stats.decode_tokens_per_second, 2),
+        "total_time": round(stats.total_time, 4),
+        "tool_rounds": stats.tool_rounds,
+        "tool_time": round(stats.tool_time, 4),
+        "draft_acceptance_rate": round(stats.draft_acceptance_rate, 4),
+        "peak_memory_gb": round(stats.peak_memory, 3),
+        "stop_reason": stats.stop_reason,
+    }
+
+
+# Exported series: (name, type, help, value from GenerationStats). Counters
+# add the value up, gauges keep the latest one
+PROMETHEUS_SERIES = [
+    ("requests_total", "counter", "Generations completed", lambda s: 1),
+    (
+        "prompt_tokens_total",
+        "counter",
+        "Prompt tokens, including those reused from the KV cache",
+        lambda s: s.prompt_tokens,
+    ),
+    (
+        "reused_tokens_total",
+        "counter",
+        "Prompt tokens reused from the KV cache",
+        lambda s: s.reused_tokens,
+    ),
+    (
+        "completion_tokens_total",
+        "counter",
+        "Generated tokens",
+        lambda s: s.completion_tokens,
+    ),
+    (
+        "prefill_seconds_total",
+        "counter",
+        "Time spent prefilling prompts",
+        lambda s: s.prefill_time,
+    ),
+    (
+        "decode_seconds_total",
+        "counter",
+        "Time spent decoding",
+        lambda s: s.decode_time,
+    ),
+    ("tool_rounds_total", "counter", "Tool call rounds", lambda s: s.tool_rounds),
+    (
+        "decode_tokens_per_second",
+        "gauge",
+        "Decode rate of the latest generation",
+        lambda s: s.decode_tokens_per_second,
+    ),
+    (
+        "peak_memory_bytes",
+        "gauge",
+        "Peak memory reported by the latest generation",
+        lambda s: s.peak_memory * 1e9,
+    ),
+]
+
+
+def _prometheus_labels(labels: tuple[tuple[str, str], ...], **extra) -> str:
+    def escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    pairs = [*labels, *extra.items()]
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in pairs) + "}"
+
+
+def _prometheus_value(value: float) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class PrometheusMetrics:
+    """Per-generation counters for daemon/serve in Prometheus text format
+
+    Series are labelled with the command and model, so a throughput
+    regression after a model upgrade shows up as a new series.
+    """
+
+    def __init__(self):
+        self.values: Dict[tuple, List[float]] = {}
+        # Labels -> (per-bucket counts, sum, count) of time to first token
+        self.ttft: Dict[tuple, tuple[List[int], float, int]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stats: GenerationStats, command: str, model: str):
+        """Record one completed generation"""
+        labels = (("command", command), ("model", model))
+        with self._lock:
+            values = self.values.setdefault(labels, [0.0] * len(PROMETHEUS_SERIES))
+            for i, (_, kind, _, value) in enumerate(PROMETHEUS_SERIES):
+                values[i] = (
+                    values[i] + value(stats) if kind == "counter" else value(stats)
+                )
+
+            buckets, total, count = self.ttft.get(
+                labels, ([0] * len(PROMETHEUS_TTFT_BUCKETS), 0.0, 0)
+            )
+            for i, bound in enumerate(PROMETHEUS_TTFT_BUCKETS):
+                if stats.time_to_first_token <= bound:
+                    buckets[i] += 1
+            self.ttft[labels] = (
+                buckets,
+                total + stats.time_to_first_token,
+                count + 1,
+            )
+
+    def render(self) -> str:
+        """The text exposition format served on /metrics"""
+        lines = []
+        with self._lock:
+            for i, (name, kind, help_text, _) in enumerate(PROMETHEUS_SERIES):
+                lines.append(f"# HELP bizarro_{name} {help_text}")
+                lines.append(f"# TYPE bizarro_{name} {kind}")
+                for labels, values in self.values.items():
+                    lines.append(
+                        f"bizarro_{name}{_prometheus_labels(labels)} "
+                        f"{_prometheus_value(values[i])}"
+                    )
+
+            name = "bizarro_time_to_first_token_seconds"
+            lines.append(f"# HELP {name} Time from request to first generated token")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, (buckets, total, count) in self.ttft.items():
+                for bound, bucket in zip(PROMETHEUS_TTFT_BUCKETS, buckets):
+                    le = _prometheus_labels(labels, le=f"{bound:g}")
+                    lines.append(f"{name}_bucket{le} {bucket}")
+                le = _prometheus_labels(labels, le="+Inf")
+                lines.append(f"{name}_bucket{le} {count}")
+                lines.append(
+                    f"{name}_sum{_prometheus_labels(labels)} {_prometheus_value(total)}"
+                )
+                lines.append(f"{name}_count{_prometheus_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    """Serves PrometheusMetrics on GET /metrics"""
+
+    server_version = "bizarro"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404, f"Unknown path: {self.path}")
+            return
+        payload = self.server.metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def start_metrics_server(metrics: PrometheusMetrics, port: int) -> ThreadingHTTPServer:
+    """Serve metrics on 127.0.0.1:port from a background thread
+
+    Raises:
+        ModelError: If the port cannot be bound
+    """
+    try:
+        server = ThreadingHTTPServer(("127.0.0.1", port), _MetricsRequestHandler)
+    except OSError as e:
+        raise ModelError(f"Could not listen for metrics on port {port}: {e}")
+    server.daemon_threads = True
+    server.metrics = metrics
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def load_model_quietly(model_path: str) -> tuple[Any, Any]:
+    """Load model with minimal output
+
+    Args:
+        model_path: Path to model (local or HuggingFace)
+
+    Returns:
+        Tuple of (model, tokenizer)
+
+    Raises:
+        ModelLoadError: If model loading fails
+    """
+    from mlx_lm import load
+
+    suppress_output = io.StringIO()
+    is_local = os.path.exists(model_path)
+
+    if not is_local:
+        print("● Downloading...", end="", flush=True)
+
+    try:
+        with redirect_stdout(suppress_output), redirect_stderr(suppress_output):
+            result = load(path_or_hf_repo=model_path)
+    except Exception as e:
+        if not is_local:
+            print(f"\r{' ' * 18}\r", end="", flush=True)
+        raise ModelLoadError(f"Failed to load model '{model_path}': {str(e)}") from e
+
+    if not is_local:
+        print(f"\r{' ' * 18}\r", end="", flush=True)
+
+    return result
+
+
+def load_draft_model(
+    draft_path: Optional[str],
+    tokenizer,
+    loader: Optional[Callable[[str], tuple[Any, Any]]] = None,
+) -> Optional[Any]:
+    """Load a draft model for speculative decoding
+
+    Args:
+        draft_path: Path to draft model (local or HuggingFace), or None
+        tokenizer: Tokenizer of the main model, which the draft must share
+        loader: Model loader (default: load_model_quietly)
+
+    Returns:
+        Draft model, or None if no path was given
+
+    Raises:
+        ModelLoadError: If loading fails or the vocabularies differ
+    """
+    if draft_path is None:
+        return None
+    draft_model, draft_tokenizer = (loader or load_model_quietly)(draft_path)
+    if draft_tokenizer.vocab_size != tokenizer.vocab_size:
+        raise ModelLoadError(
+            f"Draft model '{draft_path}' does not share the model's vocabulary"
+        )
+    return draft_model
+
+
+def get_model_context_length(model, tokenizer) -> int:
+    """Get the maximum context length for a model
+
+    Args:
+        model: Language model object
+        tokenizer: Tokenizer object
+
+    Returns:
+        Maximum context length in tokens
+    """
+    try:
+        # Check model config first - this is usually more accurate
+        if hasattr(model, "config"):
+            context_keys = [
+                "max_position_embeddings",
+                "n_positions",
+                "max_seq_len",
+                "seq_length",
+            ]
+            for key in context_keys:
+                max_context = getattr(model.config, key, None)
+                if (
+                    max_context
+                    and isinstance(max_context, (int, float))
+                    and max_context > 0
+                ):
+                    return int(max_context)
+
+        # Don't use tokenizer.model_max_length as it often reports incorrect values
+        # (e.g. 131k for models that actually support 40k)
+        return DEFAULT_CONTEXT_LENGTH
+    except Exception:
+        return DEFAULT_CONTEXT_LENGTH
+
+
+def validate_context_length(requested_length: int, model_max_length: int) -> None:
+    """Validate requested context length against model maximum
+
+    Args:
+        requested_length: Requested context length
+        model_max_length: Model's maximum context length
+
+    Raises:
+        ModelError: If requested length exceeds model maximum
+    """
+    if requested_length > model_max_length:
+        raise ModelError(
+            f"Requested context length {requested_length:,} exceeds model's maximum context length of {model_max_length:,}"
+        )
+
+
+# Resident model daemon
+#
+# The daemon keeps models loaded and serves run and chat requests over a Unix
+# domain socket. Each connection carries one request: the client sends a
+# single JSON line and the daemon answers with a stream of JSON lines, "output"
+# events carrying terminal text followed by a final "done" or "error" event.
+
+
+def _default_daemon_socket() -> Path:
+    """Default location of the daemon's Unix socket"""
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return Path(runtime_dir) / "bizarro.sock"
+    return Path.home() / ".cache" / "bizarro" / "daemon.sock"
+
+
+def _send_message(wfile, message: Dict[str, Any]):
+    """Write one newline-delimited JSON message"""
+    wfile.write(json.dumps(message).encode("utf-8") + b"\n")
+    wfile.flush()
+
+
+def _stats_from_dict(data: Optional[Dict[str, Any]]) -> Optional[GenerationStats]:
+    """Rebuild generation statistics received from the daemon"""
+    return GenerationStats(**data) if data else None
+
+
+class _DaemonOutput(io.TextIOBase):
+    """Text stream that forwards writes to a daemon client as output events"""
+
+    def __init__(self, wfile, is_tty: bool):
+        self._wfile = wfile
+        self._is_tty = is_tty
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        if text:
+            _send_message(self._wfile, {"type": "output", "text": text})
+        return len(text)
+
+    def isatty(self) -> bool:
+        return self._is_tty
+
+
+class _DaemonRequestHandler(socketserver.StreamRequestHandler):
+    """Read one request from a client and stream back the response"""
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            request = json.loads(line)
+            result = self.server.daemon.handle_request(request, self.wfile)
+            _send_message(self.wfile, {"type": "done", **result})
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away; nothing left to report to
+            pass
+        except Exception as e:
+            try:
+                _send_message(self.wfile, {"type": "error", "message": str(e)})
+            except OSError:
+                pass
+
+
+class ModelDaemon:
+    """Keeps models resident and serves generation requests to CLI clients
+
+    Generation is serialized with a single lock, so concurrent clients queue
+    rather than compete for the GPU. Loaded models are kept in LRU order up to
+    max_models, and chat sessions keep their KV cache between turns.
     """
-    tool_calls = []
-    patterns = [
-        (r"<tool_call>(.*?)</tool_call>", re.DOTALL),
-        (r"```json\s*({.*?})\s*```", re.DOTALL),
-    ]
 
-    for pattern, flags in patterns:
-        matches = re.findall(pattern, response_text, flags)
-        for match in matches:
+    def __init__(
+        self,
+        socket_path: Path,
+        max_models: int = DAEMON_MAX_MODELS,
+        max_sessions: int = DAEMON_MAX_SESSIONS,
+        metrics: Optional[PrometheusMetrics] = None,
+    ):
+        self.socket_path = socket_path
+        self.metrics = metrics
+        self.max_models = max_models
+        self.max_sessions = max_sessions
+        self.models: OrderedDict[str, tuple[Any, Any]] = OrderedDict()
+        # Session id -> ((model path, draft model path), cache)
+        self.sessions: OrderedDict[
+            str, tuple[tuple[str, Optional[str]], PromptCacheManager]
+        ] = OrderedDict()
+        # Session id -> context window, with the message token counts
+        self.windows: OrderedDict[str, ConversationWindow] = OrderedDict()
+        # Session id -> prompt builder, with the conversation rendered so far
+        self.builders: OrderedDict[str, PromptBuilder] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_model(self, model_path: str) -> tuple[Any, Any]:
+        """Return a loaded model, loading it and evicting the LRU one if needed"""
+        if model_path in self.models:
+            self.models.move_to_end(model_path)
+            return self.models[model_path]
+
+        model_obj, tokenizer = load_model_quietly(model_path)
+        self.models[model_path] = (model_obj, tokenizer)
+        while len(self.models) > self.max_models:
+            evicted, _ = self.models.popitem(last=False)
+            for session, (session_models, _) in list(self.sessions.items()):
+                if evicted in session_models:
+                    del self.sessions[session]
+        return model_obj, tokenizer
+
+    def get_session_cache(
+        self,
+        session: str,
+        models: tuple[str, Optional[str]],
+        model_obj,
+        max_kv_size: Optional[int],
+        draft_model=None,
+        **cache_options,
+    ) -> PromptCacheManager:
+        """Return the KV cache kept for a chat session
+
+        cache_options are passed on to PromptCacheManager: kv_bits,
+        kv_group_size, quantized_kv_start and keep.
+        """
+        entry = self.sessions.get(session)
+        if entry is not None and entry[0] == models:
+            self.sessions.move_to_end(session)
+            return entry[1]
+
+        cache_manager = PromptCacheManager(
+            model_obj, max_kv_size=max_kv_size, draft_model=draft_model, **cache_options
+        )
+        self.sessions[session] = (models, cache_manager)
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+        return cache_manager
+
+    def get_session_window(
+        self,
+        session: str,
+        tokenizer,
+        budget: int,
+        available_tools: Optional[Dict[str, Callable]],
+    ) -> ConversationWindow:
+        """Return the context window kept for a chat session"""
+        window = self.windows.get(session)
+        if window is not None and window.tokenizer is tokenizer:
+            window.budget = budget
+            self.windows.move_to_end(session)
+            return window
+
+        window = ConversationWindow(tokenizer, budget, available_tools)
+        self.windows[session] = window
+        while len(self.windows) > self.max_sessions:
+            self.windows.popitem(last=False)
+        return window
+
+    def get_session_builder(
+        self,
+        session: str,
+        tokenizer,
+        available_tools: Optional[Dict[str, Callable]],
+    ) -> PromptBuilder:
+        """Return the prompt builder kept for a chat session"""
+        builder = self.builders.get(session)
+        if (
+            builder is not None
+            and builder.tokenizer is tokenizer
+            and builder.available_tools == available_tools
+        ):
+            self.builders.move_to_end(session)
+            return builder
+
+        builder = PromptBuilder(tokenizer, available_tools)
+        self.builders[session] = builder
+        while len(self.builders) > self.max_sessions:
+            self.builders.popitem(last=False)
+        return builder
+
+    def handle_request(self, request: Dict[str, Any], wfile) -> Dict[str, Any]:
+        """Dispatch a client request and return the payload of its done event
+
+        Raises:
+            ModelError: If the request is invalid or generation fails
+        """
+        command = request.get("command")
+        if command == "ping":
+            return {}
+        if command == "close_session":
+            with self.lock:
+                self.sessions.pop(request.get("session"), None)
+                self.windows.pop(request.get("session"), None)
+                self.builders.pop(request.get("session"), None)
+            return {}
+        if command not in ("info", "run", "chat_turn"):
+            raise ModelError(f"Unknown daemon command: {command}")
+
+        global console
+        output = _DaemonOutput(wfile, bool(request.get("tty")))
+        with self.lock:
+            if command == "info":
+                model_obj, tokenizer = self.get_model(request["model"])
+                return {
+                    "context_length": get_model_context_length(model_obj, tokenizer)
+                }
+
+            # Route all terminal output for this request to the client
+            saved_console = console
+            console = Console(file=output, force_terminal=output.isatty())
             try:
-                tool_call = json.loads(match.strip())
-                if isinstance(tool_call, dict) and "name" in tool_call:
-                    tool_call.setdefault("arguments", {})
-                    tool_calls.append(tool_call)
-            except json.JSONDecodeError:
-                continue
-        if tool_calls:
-            break
-    return tool_calls
+                with redirect_stdout(output):
+                    if command == "run":
+                        return self._run(request)
+                    return self._chat_turn(request)
+            finally:
+                console = saved_console
+
+    def _run(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        config = RunConfig(**request["config"])
+        model_obj, tokenizer = self.get_model(config.model)
+        draft_model = load_draft_model(
+            config.draft_model, tokenizer, loader=self.get_model
+        )
+        stats, _ = _generate_run(model_obj, tokenizer, config, draft_model)
+        if stats and self.metrics:
+            self.metrics.observe(stats, "run", config.model)
+        return {"stats": asdict(stats) if stats else None}
+
+    def _chat_turn(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        model_path = request["model"]
+        draft_path = request.get("draft_model")
+        max_kv_size = request.get("max_kv_size")
+        quantization = {
+            "kv_bits": request.get("kv_bits"),
+            "kv_group_size": request.get("kv_group_size", DEFAULT_KV_GROUP_SIZE),
+            "quantized_kv_start": request.get(
+                "quantized_kv_start", DEFAULT_QUANTIZED_KV_START
+            ),
+        }
+        model_obj, tokenizer = self.get_model(model_path)
+        draft_model = load_draft_model(draft_path, tokenizer, loader=self.get_model)
+        available_tools = get_available_tools() if request.get("enable_tools") else None
+
+        cache_manager = None
+        if request.get("enable_cache", True):
+            keep = KV_SINK_TOKENS
+            if max_kv_size is not None:
+                keep = _pinned_prefix_length(
+                    tokenizer, request["conversation"], available_tools, max_kv_size
+                )
+            cache_manager = self.get_session_cache(
+                request["session"],
+                (model_path, draft_path),
+                model_obj,
+                max_kv_size,
+                draft_model=draft_model,
+                keep=keep,
+                **quantization,
+            )
 
+        max_tokens = request.get("max_tokens", 1000)
+        context_window = None
+        if request.get("context_length") is not None:
+            context_window = self.get_session_window(
+                request["session"],
+                tokenizer,
+                _context_budget(request["context_length"], max_kv_size, max_tokens),
+                available_tools,
+            )
 
-def execute_tool_call(
-    tool_call: Dict[str, Any], available_tools: Dict[str, Callable]
-) -> str:
-    """Execute a tool call and return the result
+        conversation = request["conversation"]
+        stats = handle_conversation_turn(
+            model_obj=model_obj,
+            tokenizer=tokenizer,
+            conversation=conversation,
+            available_tools=available_tools,
+            max_tokens=max_tokens,
+            show_thinking=request.get("show_thinking", False),
+            verbose=request.get("verbose", False),
+            print_assistant_label=True,
+            cache_manager=cache_manager,
+            max_kv_size=max_kv_size,
+            **quantization,
+            draft_model=draft_model,
+            num_draft_tokens=request.get("num_draft_tokens", DEFAULT_NUM_DRAFT_TOKENS),
+            prompt_lookup_tokens=request.get("prompt_lookup_tokens", 0),
+            max_tool_rounds=request.get("max_tool_rounds", DEFAULT_MAX_TOOL_ROUNDS),
+            stop_at_tool_call=request.get("stop_at_tool_call", False),
+            stop_sequences=request.get("stop_sequences"),
+            thinking_budget=request.get("thinking_budget"),
+            context_window=context_window,
+            prompt_builder=self.get_session_builder(
+                request["session"], tokenizer, available_tools
+            ),
+        )
+        if stats and self.metrics:
+            self.metrics.observe(stats, "chat", model_path)
+        return {
+            "stats": asdict(stats) if stats else None,
+            "conversation": conversation,
+        }
+
+    def serve_forever(self):
+        """Listen on the socket until interrupted"""
+        self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+        if self.socket_path.exists():
+            if DaemonClient.connect(str(self.socket_path)) is not None:
+                raise ModelError(f"A daemon is already listening on {self.socket_path}")
+            self.socket_path.unlink()
+
+        server = socketserver.ThreadingUnixStreamServer(
+            str(self.socket_path), _DaemonRequestHandler
+        )
+        server.daemon_threads = True
+        server.daemon = self
+        try:
+            os.chmod(self.socket_path, 0o600)
+            console.print(f"[bold blue]Listening on {self.socket_path}[/bold blue]")
+            server.serve_forever()
+        finally:
+            server.server_close()
+            try:
+                self.socket_path.unlink()
+            except FileNotFoundError:
+                pass
 
-    Args:
-        tool_call: Tool call dictionary with 'name' and 'arguments'
-        available_tools: Dictionary of available tool functions
 
-    Returns:
-        Tool execution result as string
+class DaemonClient:
+    """Thin client that forwards run and chat requests to a resident daemon"""
 
-    Raises:
-        ToolExecutionError: If tool execution fails
-    """
-    tool_name = tool_call.get("name")
-    tool_args = tool_call.get("arguments", {})
+    def __init__(self, socket_path: Path):
+        self.socket_path = socket_path
 
-    if tool_name not in available_tools:
-        raise ToolExecutionError(
-            f"Tool '{tool_name}' not found. Available tools: {', '.join(available_tools.keys())}"
+    @classmethod
+    def connect(cls, socket_path: Optional[str] = None) -> Optional["DaemonClient"]:
+        """Return a client for a live daemon, or None if none is listening"""
+        path = Path(socket_path) if socket_path else _default_daemon_socket()
+        if not path.exists():
+            return None
+        client = cls(path)
+        try:
+            client._request({"command": "ping"})
+        except (OSError, ModelError):
+            return None
+        return client
+
+    def _request(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Send a request, echo streamed output and return the done event
+
+        Raises:
+            ModelError: If the daemon reports an error or hangs up
+        """
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(str(self.socket_path))
+            with sock.makefile("rb") as rfile, sock.makefile("wb") as wfile:
+                _send_message(wfile, message)
+                for line in rfile:
+                    event = json.loads(line)
+                    if event["type"] == "output":
+                        sys.stdout.write(event["text"])
+                        sys.stdout.flush()
+                    elif event["type"] == "error":
+                        raise ModelError(event["message"])
+                    elif event["type"] == "done":
+                        return event
+        raise ModelError("Daemon closed the connection unexpectedly")
+
+    def run(self, config: RunConfig) -> Optional[GenerationStats]:
+        """Generate a one-shot response in the daemon"""
+        data = asdict(config)
+        # Resolve anything that depends on the client's filesystem view
+        data["system"] = load_system_prompt(config.system)
+        data["model"] = _daemon_model_path(config.model)
+        if config.draft_model:
+            data["draft_model"] = _daemon_model_path(config.draft_model)
+        if config.snapshot_dir:
+            data["snapshot_dir"] = os.path.abspath(config.snapshot_dir)
+        event = self._request(
+            {"command": "run", "config": data, "tty": sys.stdout.isatty()}
+        )
+        return _stats_from_dict(event.get("stats"))
+
+    def context_length(self, model: str) -> int:
+        """Maximum context length of a model, loading it if necessary"""
+        event = self._request({"command": "info", "model": _daemon_model_path(model)})
+        return event["context_length"]
+
+    def chat_turn(
+        self, session: str, model: str, conversation: List[Dict[str, str]], **options
+    ) -> Optional[GenerationStats]:
+        """Run one chat turn in the daemon, updating conversation in place"""
+        event = self._request(
+            {
+                "command": "chat_turn",
+                "session": session,
+                "model": _daemon_model_path(model),
+                "conversation": conversation,
+                "tty": sys.stdout.isatty(),
+                **options,
+            }
         )
+        conversation[:] = event["conversation"]
+        return _stats_from_dict(event.get("stats"))
 
-    try:
-        return str(available_tools[tool_name](**tool_args))
-    except Exception as e:
-        raise ToolExecutionError(f"Error executing {tool_name}: {str(e)}") from e
+    def close_session(self, session: str):
+        """Release the KV cache the daemon keeps for a chat session"""
+        self._request({"command": "close_session", "session": session})
 
 
-def _execute_tool_calls(
-    tool_calls: List[Dict[str, Any]],
-    available_tools: Dict[str, Callable],
-    conversation: List[Dict[str, str]],
-    verbose: bool,
-) -> None:
-    """Execute tool calls and add results to conversation
+def _daemon_model_path(model: str) -> str:
+    """Model identifier as the daemon should see it"""
+    return os.path.abspath(model) if os.path.exists(model) else model
 
-    Args:
-        tool_calls: List of tool calls to execute
-        available_tools: Available tool functions
-        conversation: Conversation history to update
-        verbose: Whether to print verbose output
+
+# OpenAI-compatible server with continuous batching
+
+
+@dataclass
+class _BatchRequest:
+    """A sequence submitted to the BatchScheduler"""
+
+    prompt: List[int]
+    max_tokens: int
+    events: "queue.Queue" = field(default_factory=queue.Queue)
+    uid: Optional[int] = None
+    finished: bool = False
+
+
+class BatchScheduler:
+    """Continuous batching of concurrent generation requests
+
+    A single worker thread owns the model. Every step decodes one token for
+    all active sequences in one batched forward pass, and requests submitted
+    in the meantime are admitted between steps instead of waiting for the
+    current batch to drain.
     """
-    for tool_call in tool_calls:
-        if verbose:
-            console.print(f"[dim]Executing tool: {tool_call.get('name')}[/dim]")
 
+    def __init__(
+        self,
+        model,
+        tokenizer,
+        max_batch_size: int = SERVE_MAX_BATCH_SIZE,
+        max_kv_size: Optional[int] = None,
+        prefill_batch_size: int = SERVE_PREFILL_BATCH_SIZE,
+    ):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.max_kv_size = max_kv_size
+        self.prefill_batch_size = min(max_batch_size, prefill_batch_size)
+        self.closed = False
+        self._submissions: "queue.Queue[_BatchRequest]" = queue.Queue()
+        self._cancellations: "queue.Queue[_BatchRequest]" = queue.Queue()
+        self._active: Dict[int, _BatchRequest] = {}
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def generate(self, prompt_tokens: List[int], max_tokens: int):
+        """Yield (token, finish_reason) pairs for one sequence
+
+        Closing the generator early removes the sequence from the batch.
+
+        Raises:
+            ModelError: If the prompt is empty or the batch step fails
+        """
+        if not prompt_tokens:
+            raise PromptError("Prompt is empty")
+        if self.closed:
+            raise ModelError("Batch scheduler is closed")
+
+        request = _BatchRequest(prompt=list(prompt_tokens), max_tokens=max_tokens)
+        self._submissions.put(request)
         try:
-            tool_result = execute_tool_call(tool_call, available_tools)
-        except ToolExecutionError as e:
-            tool_result = str(e)
+            while True:
+                event = request.events.get()
+                if isinstance(event, Exception):
+                    raise ModelError(f"Batched generation failed: {event}") from event
+                yield event
+                if event[1] is not None:
+                    return
+        finally:
+            if not request.finished:
+                self._cancellations.put(request)
+
+    def close(self):
+        """Fail all queued and active sequences so their callers return"""
+        self.closed = True
+        error = ModelError("Batch scheduler is closed")
+        while True:
+            try:
+                self._submissions.get_nowait().events.put(error)
+            except queue.Empty:
+                break
+        for request in list(self._active.values()):
+            request.events.put(error)
+
+    def _run(self):
+        import mlx.core as mx
+        from mlx_lm.generate import BatchGenerator
+
+        # Generate on a stream owned by this thread
+        stream = mx.default_stream(mx.default_device())
+        generator = BatchGenerator(
+            self.model,
+            stop_tokens=[[token] for token in self.tokenizer.eos_token_ids],
+            completion_batch_size=self.max_batch_size,
+            prefill_batch_size=self.prefill_batch_size,
+            max_kv_size=self.max_kv_size,
+            stream=stream,
+        )
 
-        if verbose:
-            console.print(f"[green]Tool result: {tool_result}[/green]")
+        while True:
+            self._admit(generator)
+            try:
+                responses = generator.next_generated()
+            except Exception as e:
+                # Fail every sequence in the broken batch and start over
+                generator.remove(list(self._active))
+                for request in self._active.values():
+                    request.finished = True
+                    request.events.put(e)
+                self._active.clear()
+                continue
 
-        # Add tool result to conversation
-        conversation.append(
-            {
-                "role": "tool",
-                "name": tool_call.get("name"),
-                "content": tool_result,
-            }
+            for response in responses:
+                request = self._active.get(response.uid)
+                if request is None:
+                    continue
+                if response.finish_reason is not None:
+                    request.finished = True
+                    del self._active[response.uid]
+                request.events.put((response.token, response.finish_reason))
+
+    def _admit(self, generator):
+        """Insert newly submitted sequences and drop cancelled ones"""
+        requests = []
+        if not self._active:
+            # Nothing to decode, so sleep until a request arrives
+            requests.append(self._submissions.get())
+        while True:
+            try:
+                requests.append(self._submissions.get_nowait())
+            except queue.Empty:
+                break
+
+        if requests:
+            uids = generator.insert(
+                [request.prompt for request in requests],
+                max_tokens=[request.max_tokens for request in requests],
+            )
+            for uid, request in zip(uids, requests):
+                request.uid = uid
+                self._active[uid] = request
+
+        cancelled = []
+        while True:
+            try:
+                request = self._cancellations.get_nowait()
+            except queue.Empty:
+                break
+            if self._active.pop(request.uid, None) is not None:
+                cancelled.append(request.uid)
+        if cancelled:
+            generator.remove(cancelled)
+
+
+class _CompletionRenderer(StreamRenderer):
+    """Renderer that hands response deltas to a callback instead of a terminal"""
+
+    def __init__(self, on_delta: Callable[[str, str], None], show_thinking: bool):
+        super().__init__(
+            show_thinking=show_thinking, print_assistant_label=False, enabled=False
         )
+        self.on_delta = on_delta
 
+    def thinking(self, text: str, message: str = "Thinking..."):
+        if self.show_thinking and text:
+            self.on_delta("reasoning_content", text)
 
-def handle_conversation_turn(
-    model_obj,
+    def text(self, text: str):
+        if not self.visible_content_printed:
+            # Skip leading whitespace before the first visible character
+            text = text.lstrip()
+            if not text:
+                return
+            self.visible_content_printed = True
+        self.on_delta("content", text)
+
+
+def _generate_batched(
+    scheduler: BatchScheduler,
     tokenizer,
-    conversation: List[Dict[str, str]],
-    available_tools: Optional[Dict[str, Callable]],
+    prompt_tokens: List[int],
     max_tokens: int,
-    show_thinking: bool,
-    verbose: bool,
-    print_assistant_label: bool = True,
-    prompt_cache: Optional[List] = None,
-    max_kv_size: Optional[int] = None,
-) -> Optional[GenerationStats]:
+    tools,
+    renderer: StreamRenderer,
+) -> tuple[StreamResult, Optional[str]]:
+    """Generate one response through the batch scheduler
+
+    Returns:
+        Tuple of (stream result, finish reason)
     """
-    Handle a complete conversation turn including tool calls if needed.
+    import mlx.core as mx
+
+    state = StreamState(collect_tool_calls=bool(tools))
+    parser = StreamTagParser()
+    detokenizer = tokenizer.detokenizer
+    detokenizer.reset()
+
+    finish_reason = None
+    events = scheduler.generate(prompt_tokens, max_tokens)
+    try:
+        for token, finish_reason in events:
+            # Stop tokens end the sequence without adding text
+            if finish_reason != "stop":
+                detokenizer.add_token(token)
+            if finish_reason is not None:
+                detokenizer.finalize()
+            _handle_response_text(
+                state, parser, renderer, detokenizer.last_segment, verbose=False
+            )
+        state.stop_reason = finish_reason
+        # Shared by the whole batch, like the peak memory stream_generate reports
+        state.peak_memory = mx.get_peak_memory() / 1e9
+    finally:
+        events.close()
+
+    result = _finish_stream(
+        state,
+        parser,
+        renderer,
+        tools,
+        verbose=False,
+        prompt_tokens=len(prompt_tokens),
+        prefilled_tokens=len(prompt_tokens),
+    )
+    return result, finish_reason
+
+
+@dataclass
+class CompletionResult:
+    """A conversation turn generated through the BatchScheduler"""
+
+    response: str
+    tool_calls: List[Dict[str, Any]]
+    finish_reason: Optional[str]
+    stats: GenerationStats
+
 
-    Updates conversation in place and returns statistics.
+def _complete_batched(
+    scheduler: BatchScheduler,
+    tokenizer,
+    conversation: List[Dict[str, Any]],
+    max_tokens: int,
+    available_tools: Optional[Dict[str, Callable]] = None,
+    tool_schemas: Optional[List[Dict[str, Any]]] = None,
+    on_delta: Optional[Callable[[str, str], None]] = None,
+    show_thinking: bool = False,
+    max_tool_rounds: int = DEFAULT_MAX_TOOL_ROUNDS,
+) -> CompletionResult:
+    """Generate an assistant turn, running built-in tools as they are called
+
+    Mirrors handle_conversation_turn: conversation is updated in place with
+    tool calls and results, and generation continues after each tool round.
+    Tool calls against tool_schemas are returned to the caller instead.
 
     Args:
-        model_obj: Language model object
+        scheduler: Batch scheduler to generate through
         tokenizer: Tokenizer object
         conversation: Conversation history (updated in place)
-        available_tools: Available tool functions
-        max_tokens: Maximum tokens to generate
-        show_thinking: Whether to show thinking process
-        verbose: Enable verbose output
-        print_assistant_label: Whether to print assistant label
-        prompt_cache: Optional prompt cache
-        max_kv_size: Maximum KV cache size
+        max_tokens: Maximum tokens to generate per round
+        available_tools: Built-in tool functions to execute
+        tool_schemas: Client tool schemas to render but not execute
+        on_delta: Optional callback for streamed (kind, text) deltas
+        show_thinking: Whether to pass thinking text to on_delta
+        max_tool_rounds: Maximum rounds of built-in tool calls
 
     Returns:
-        Generation statistics or None
+        CompletionResult with the response of every round joined
     """
-    tools_list = list(available_tools.values()) if available_tools else None
-
-    # Generate the prompt
-    if tools_list:
-        prompt = tokenizer.apply_chat_template(
-            conversation=conversation,
-            add_generation_prompt=True,
-            tools=tools_list,
+    responses = []
+    stats = None
+    for tool_round in range(max_tool_rounds + 1):
+        prompt = _render_prompt(
+            tokenizer, conversation, available_tools, tool_schemas=tool_schemas
         )
-    else:
-        prompt = tokenizer.apply_chat_template(
-            conversation=conversation, add_generation_prompt=True
+        renderer = _CompletionRenderer(
+            on_delta or (lambda kind, text: None), show_thinking
+        )
+        result, finish_reason = _generate_batched(
+            scheduler,
+            tokenizer,
+            prompt,
+            max_tokens,
+            available_tools or tool_schemas,
+            renderer,
         )
+        stats = (
+            _combine_generation_stats(stats, result.stats) if stats else result.stats
+        )
+        if result.response:
+            responses.append(result.response)
 
-    # Generate response
-    result = stream_with_thinking_handler(
-        model=model_obj,
-        tokenizer=tokenizer,
-        prompt=prompt,
-        max_tokens=max_tokens,
-        show_thinking=show_thinking,
-        tools=available_tools,
-        verbose=verbose,
-        print_assistant_label=print_assistant_label,
-        prompt_cache=prompt_cache,
-        max_kv_size=max_kv_size,
+        # Run built-in tools and generate the follow-up response
+        if not (result.tool_calls and available_tools) or tool_round == max_tool_rounds:
+            break
+        if result.response:
+            conversation.append({"role": "assistant", "content": result.response})
+        tool_start = time.time()
+        _execute_tool_calls(
+            result.tool_calls, available_tools, conversation, verbose=False, stats=stats
+        )
+        stats.tool_rounds += 1
+        stats.tool_time += time.time() - tool_start
+
+    return CompletionResult(
+        response="\n\n".join(responses),
+        tool_calls=result.tool_calls,
+        finish_reason="tool_calls" if result.tool_calls else finish_reason,
+        stats=stats,
     )
 
-    response_text = result.response
-    tool_calls = result.tool_calls
-    visible_content_printed = result.visible_content_printed
-    stats = result.stats
 
-    # Add assistant response to conversation if there's content
-    if response_text:
-        conversation.append({"role": "assistant", "content": response_text})
+def _normalize_messages(messages: Any) -> List[Dict[str, Any]]:
+    """Validate chat-completions messages and flatten content part lists
+
+    Raises:
+        PromptError: If the messages are malformed
+    """
+    if not isinstance(messages, list) or not messages:
+        raise PromptError("'messages' must be a non-empty list")
+
+    conversation = []
+    for message in messages:
+        if not isinstance(message, dict) or "role" not in message:
+            raise PromptError("Each message must be an object with a 'role'")
+        message = dict(message)
+        content = message.get("content")
+        if isinstance(content, list):
+            message["content"] = "".join(
+                part.get("text", "") for part in content if isinstance(part, dict)
+            )
+        elif content is None:
+            message["content"] = ""
+        conversation.append(message)
+    return conversation
 
-    # If content was printed, add newline
-    if visible_content_printed:
-        print()  # Newline after response
 
-    # Handle tool calls if present
-    if tool_calls:
-        _execute_tool_calls(tool_calls, available_tools, conversation, verbose)
+class CompletionServer:
+    """Chat-completions endpoint backed by a BatchScheduler
 
-        # Generate follow-up response after tools
-        follow_up_stats = handle_conversation_turn(
-            model_obj=model_obj,
-            tokenizer=tokenizer,
-            conversation=conversation,
+    Requests are rendered with the chat template and generated through the
+    shared scheduler. Thinking is stripped from the response the same way as
+    in run/chat; with --enable-tools, built-in tool calls are executed and
+    the follow-up generated as in handle_conversation_turn, while tools sent
+    by the client are returned to it as tool_calls.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        tokenizer,
+        scheduler: BatchScheduler,
+        max_tokens: int,
+        system_prompt: Optional[str] = None,
+        available_tools: Optional[Dict[str, Callable]] = None,
+        show_thinking: bool = False,
+        verbose: bool = False,
+        metrics: Optional[PrometheusMetrics] = None,
+        metrics_sink: Optional[MetricsSink] = None,
+    ):
+        self.model_name = model_name
+        self.tokenizer = tokenizer
+        self.scheduler = scheduler
+        self.max_tokens = max_tokens
+        self.system_prompt = system_prompt
+        self.available_tools = available_tools
+        self.show_thinking = show_thinking
+        self.verbose = verbose
+        self.metrics = metrics
+        self.metrics_sink = metrics_sink
+
+    def complete(self, body: Dict[str, Any], send: Callable[[Dict[str, Any]], None]):
+        """Generate a chat completion, calling send with each streamed chunk
+
+        Returns:
+            The chat.completion object (also when streaming, for logging)
+
+        Raises:
+            PromptError: If the request is malformed
+            ModelError: If generation fails
+        """
+        conversation = _normalize_messages(body.get("messages"))
+        if self.system_prompt and conversation[0]["role"] != "system":
+            conversation.insert(0, {"role": "system", "content": self.system_prompt})
+
+        tool_schemas = body.get("tools") or None
+        available_tools = None if tool_schemas else self.available_tools
+        max_tokens = (
+            body.get("max_completion_tokens")
+            or body.get("max_tokens")
+            or self.max_tokens
+        )
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        model_name = body.get("model") or self.model_name
+
+        def send_delta(delta: Dict[str, Any], finish_reason: Optional[str] = None):
+            send(
+                {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model_name,
+                    "choices": [
+                        {"index": 0, "delta": delta, "finish_reason": finish_reason}
+                    ],
+                }
+            )
+
+        def renderer_delta(kind: str, text: str):
+            send_delta({kind: text})
+
+        send_delta({"role": "assistant", "content": ""})
+
+        result = _complete_batched(
+            self.scheduler,
+            self.tokenizer,
+            conversation,
+            max_tokens,
             available_tools=available_tools,
-            max_tokens=max_tokens,
-            show_thinking=show_thinking,
-            verbose=verbose,
-            print_assistant_label=print_assistant_label,
-            prompt_cache=prompt_cache,
-            max_kv_size=max_kv_size,
+            tool_schemas=tool_schemas,
+            on_delta=renderer_delta,
+            show_thinking=self.show_thinking,
         )
-        # Aggregate stats
-        if follow_up_stats:
-            stats = GenerationStats(
-                prompt_tokens=stats.prompt_tokens,
-                completion_tokens=stats.completion_tokens
-                + follow_up_stats.completion_tokens,
-                total_tokens=stats.total_tokens + follow_up_stats.total_tokens,
-                total_time=stats.total_time + follow_up_stats.total_time,
-                time_to_first_token=stats.time_to_first_token,
-                tokens_per_second=(
-                    stats.completion_tokens + follow_up_stats.completion_tokens
+        stats = result.stats
+        finish_reason = result.finish_reason
+        if self.metrics:
+            self.metrics.observe(stats, "serve", self.model_name)
+        if self.metrics_sink:
+            self.metrics_sink.emit(
+                _turn_metrics(
+                    stats, command="serve", model=self.model_name, request=completion_id
                 )
-                / (stats.total_time + follow_up_stats.total_time),
             )
 
-    return stats
+        message: Dict[str, Any] = {"role": "assistant", "content": result.response}
+        if result.tool_calls:
+            message["tool_calls"] = [
+                {
+                    "id": f"call_{uuid.uuid4().hex[:24]}",
+                    "type": "function",
+                    "function": {
+                        "name": tool_call["name"],
+                        "arguments": json.dumps(tool_call.get("arguments", {})),
+                    },
+                }
+                for tool_call in result.tool_calls
+            ]
+            send_delta(
+                {
+                    "tool_calls": [
+                        {"index": i, **tool_call}
+                        for i, tool_call in enumerate(message["tool_calls"])
+                    ]
+                }
+            )
+        send_delta({}, finish_reason=finish_reason)
+
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model_name,
+            "choices": [
+                {"index": 0, "message": message, "finish_reason": finish_reason}
+            ],
+            # Prompt tokens of every round, including those after tool calls
+            "usage": {
+                "prompt_tokens": stats.total_tokens - stats.completion_tokens,
+                "completion_tokens": stats.completion_tokens,
+                "total_tokens": stats.total_tokens,
+            },
+        }
+
+
+class _CompletionRequestHandler(BaseHTTPRequestHandler):
+    """HTTP front end for CompletionServer"""
+
+    server_version = "bizarro"
+
+    def log_message(self, format, *args):
+        if self.server.app.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        if self.path.rstrip("/") != "/v1/models":
+            self._send_error(404, f"Unknown path: {self.path}")
+            return
+        self._send_json(
+            200,
+            {
+                "object": "list",
+                "data": [
+                    {
+                        "id": self.server.app.model_name,
+                        "object": "model",
+                        "owned_by": "bizarro",
+                    }
+                ],
+            },
+        )
 
+    def do_POST(self):
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            self._send_error(404, f"Unknown path: {self.path}")
+            return
 
-def load_system_prompt(system_input: Optional[str]) -> Optional[str]:
-    """Load system prompt from string or file
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length))
+            if not isinstance(body, dict):
+                raise ValueError("request body must be a JSON object")
+        except ValueError as e:
+            self._send_error(400, f"Invalid JSON body: {e}")
+            return
+
+        if body.get("stream"):
+            self._stream_completion(body)
+            return
 
-    Args:
-        system_input: System prompt string or file path
+        try:
+            completion = self.server.app.complete(body, lambda chunk: None)
+        except PromptError as e:
+            self._send_error(400, str(e))
+            return
+        except ModelError as e:
+            self._send_error(500, str(e))
+            return
+        self._send_json(200, completion)
+
+    def _stream_completion(self, body: Dict[str, Any]):
+        include_usage = (body.get("stream_options") or {}).get("include_usage")
+        started = False
+
+        def send(chunk: Dict[str, Any]):
+            nonlocal started
+            if not started:
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.end_headers()
+                started = True
+            self._send_event(chunk)
 
-    Returns:
-        System prompt text or None
+        try:
+            completion = self.server.app.complete(body, send)
+            if include_usage:
+                send(
+                    {
+                        "id": completion["id"],
+                        "object": "chat.completion.chunk",
+                        "created": completion["created"],
+                        "model": completion["model"],
+                        "choices": [],
+                        "usage": completion["usage"],
+                    }
+                )
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client disconnected; its sequence was already cancelled
+            pass
+        except ModelError as e:
+            status = 400 if isinstance(e, PromptError) else 500
+            if not started:
+                self._send_error(status, str(e))
+            else:
+                self._send_event({"error": {"message": str(e)}})
 
-    Raises:
-        PromptError: If file reading fails
-    """
-    if not system_input:
-        return None
+    def _send_event(self, data: Dict[str, Any]):
+        self.wfile.write(f"data: {json.dumps(data)}\n\n".encode("utf-8"))
+        self.wfile.flush()
 
-    # Try file first, then treat as string
-    if os.path.isfile(system_input):
-        try:
-            with open(system_input, "r", encoding="utf-8") as f:
-                return f.read().strip()
-        except Exception as e:
-            raise PromptError(
-                f"Error reading system prompt file '{system_input}': {e}"
-            ) from e
+    def _send_json(self, status: int, data: Dict[str, Any]):
+        payload = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
 
-    return system_input
+    def _send_error(self, status: int, message: str):
+        self._send_json(status, {"error": {"message": message, "code": status}})
 
 
-def print_generation_stats(stats: GenerationStats, verbose: bool = False):
-    """Print generation statistics in a concise format"""
-    if not stats:
-        return
+# Offline batch generation over JSONL records
 
-    # Create a console that outputs to stderr
-    err_console = Console(stderr=True)
 
-    # Only print detailed stats if verbose, otherwise just the summary
-    if verbose:
-        err_console.print("\n[dim]─" * 50 + "[/dim]")
-        err_console.print("[bold]Generation Statistics:[/bold]")
-        err_console.print(f"[dim]Prompt tokens: {stats.prompt_tokens:,}[/dim]")
-        err_console.print(f"[dim]Completion tokens: {stats.completion_tokens:,}[/dim]")
-        err_console.print(f"[dim]Total tokens: {stats.total_tokens:,}[/dim]")
-        err_console.print(
-            f"[dim]Time to first token: {stats.time_to_first_token:.3f}s[/dim]"
-        )
-        err_console.print(f"[dim]Total time: {stats.total_time:.2f}s[/dim]")
-        err_console.print(f"[dim]Tokens/second: {stats.tokens_per_second:.1f}[/dim]")
+def _batch_record_conversation(
+    record: Dict[str, Any], system_prompt: Optional[str]
+) -> tuple[List[Dict[str, Any]], Optional[str]]:
+    """Build the conversation for a batch input record
+
+    Records hold either a "prompt" string or a "messages" list in the
+    data/train.jsonl format. A trailing assistant message is the reference
+    answer and is returned separately rather than generated from.
+
+    Returns:
+        Tuple of (conversation, reference answer or None)
+
+    Raises:
+        PromptError: If the record has neither prompt nor messages
+    """
+    reference = None
+    if "messages" in record:
+        conversation = _normalize_messages(record["messages"])
+        if conversation[-1]["role"] == "assistant":
+            reference = conversation.pop()["content"]
+        if not conversation:
+            raise PromptError("'messages' has no turns before the assistant answer")
+    elif isinstance(record.get("prompt"), str):
+        conversation = [{"role": "user", "content": record["prompt"]}]
+        reference = record.get("completion")
     else:
-        # Concise one-line summary
-        err_console.print(
-            f"\n[dim]{stats.completion_tokens} tokens in {stats.total_time:.1f}s "
-            f"({stats.tokens_per_second:.1f} tokens/s)[/dim]"
-        )
+        raise PromptError("Record needs a 'prompt' string or a 'messages' list")
 
+    if system_prompt and conversation[0]["role"] != "system":
+        conversation.insert(0, {"role": "system", "content": system_prompt})
+    return conversation, reference
 
-def print_chat_session_summary(session_stats: SessionStats):
-    """Print a summary of the chat session statistics"""
-    session_duration = time.time() - session_stats.session_start
 
-    # Create a console that outputs to stderr
-    err_console = Console(stderr=True)
+def _generate_batch_record(
+    scheduler: BatchScheduler,
+    tokenizer,
+    index: int,
+    line: str,
+    max_tokens: int,
+    system_prompt: Optional[str],
+    available_tools: Optional[Dict[str, Callable]],
+) -> Dict[str, Any]:
+    """Generate the output record for one input line
 
-    err_console.print("\n[bold]Chat Session Summary:[/bold]")
-    err_console.print("[dim]─" * 50 + "[/dim]")
+    Failures are reported in the record's "error" field, so every input line
+    produces exactly one output line.
+    """
+    output: Dict[str, Any] = {"index": index}
+    try:
+        record = json.loads(line)
+        if not isinstance(record, dict):
+            raise PromptError("Record must be a JSON object")
+        if "id" in record:
+            output["id"] = record["id"]
+
+        conversation, reference = _batch_record_conversation(record, system_prompt)
+        tool_schemas = record.get("tools") or None
+        result = _complete_batched(
+            scheduler,
+            tokenizer,
+            conversation,
+            record.get("max_tokens") or max_tokens,
+            available_tools=None if tool_schemas else available_tools,
+            tool_schemas=tool_schemas,
+        )
+    except (ValueError, ModelError) as e:
+        output["error"] = str(e)
+        return output
+
+    output["response"] = result.response
+    if result.tool_calls:
+        output["tool_calls"] = result.tool_calls
+    output["finish_reason"] = result.finish_reason
+    if reference is not None:
+        output["reference"] = reference
+    output["stats"] = asdict(result.stats)
+    return output
+
+
+def _resume_batch_output(path: Path, offset: int = 0) -> int:
+    """Find the input index to resume a batch job from
+
+    A partially written last line from an interrupted run is truncated so
+    appending continues on a clean line boundary. The job continues after
+    the index of the last complete record, or at offset if there is none.
+    """
+    if not path.exists():
+        return offset
+
+    with open(path, "rb+") as f:
+        data = f.read()
+        complete = data.rfind(b"\n") + 1
+        if complete < len(data):
+            f.truncate(complete)
+
+    lines = data[:complete].splitlines()
+    if not lines:
+        return offset
+    try:
+        return json.loads(lines[-1])["index"] + 1
+    except (ValueError, KeyError, TypeError):
+        raise ModelError(f"Cannot resume from {path}: last record has no index")
 
-    # Basic stats
-    err_console.print(f"Total turns: {session_stats.total_turns}")
-    err_console.print(f"Total prompt tokens: {session_stats.total_prompt_tokens:,}")
-    err_console.print(
-        f"Total completion tokens: {session_stats.total_completion_tokens:,}"
-    )
-    err_console.print(f"Total tokens: {session_stats.total_tokens:,}")
 
-    # Time stats
-    err_console.print(f"Total generation time: {session_stats.total_time:.1f}s")
-    err_console.print(f"Session duration: {session_duration:.1f}s")
+# Reproducible inference benchmarks
 
-    # Average stats
-    if session_stats.total_turns > 0:
-        avg_completion_tokens = (
-            session_stats.total_completion_tokens / session_stats.total_turns
+
+@dataclass
+class BenchResult:
+    """Median metrics of one cell of the bench matrix"""
+
+    prompt_tokens: int
+    generation_tokens: int
+    max_kv_size: Optional[int]
+    q_bits: Optional[int]
+    kv_bits: Optional[int] = None
+    prefill_tokens_per_second: float = 0.0
+    decode_tokens_per_second: float = 0.0
+    time_to_first_token: float = 0.0
+    # Peak memory and KV cache size at the end of the run, in GB
+    peak_memory: float = 0.0
+    kv_cache_memory: float = 0.0
+    # Perplexity of the prompt text; 0 when not measured
+    perplexity: float = 0.0
+    runs: List[Dict[str, float]] = field(default_factory=list)
+
+    @property
+    def key(self) -> tuple:
+        """Identifies the cell when comparing against a baseline"""
+        return (
+            self.prompt_tokens,
+            self.generation_tokens,
+            self.max_kv_size,
+            self.q_bits,
+            self.kv_bits,
         )
-        avg_time_per_turn = session_stats.total_time / session_stats.total_turns
-        err_console.print(f"Average tokens/turn: {avg_completion_tokens:.0f}")
-        err_console.print(f"Average time/turn: {avg_time_per_turn:.1f}s")
 
-    # Overall performance
-    if session_stats.total_time > 0:
-        overall_tps = session_stats.total_completion_tokens / session_stats.total_time
-        err_console.print(f"Overall tokens/second: {overall_tps:.1f}")
 
-    err_console.print("[dim]─" * 50 + "[/dim]")
+# Compared metrics: (field, True if higher is better)
+BENCH_METRICS = [
+    ("prefill_tokens_per_second", True),
+    ("decode_tokens_per_second", True),
+    ("time_to_first_token", False),
+    ("peak_memory", False),
+    ("kv_cache_memory", False),
+    ("perplexity", False),
+]
 
 
-def load_model_quietly(model_path: str) -> tuple[Any, Any]:
-    """Load model with minimal output
+def _bench_prompt(tokenizer, length: int, text: str = BENCH_PROMPT_TEXT) -> List[int]:
+    """A deterministic prompt of exactly length tokens, repeating text"""
+    tokens = tokenizer.encode(text, add_special_tokens=False)
+    return (tokens * (length // len(tokens) + 1))[:length]
 
-    Args:
-        model_path: Path to model (local or HuggingFace)
 
-    Returns:
-        Tuple of (model, tokenizer)
+def _suppress_tokens_processor(token_ids):
+    """Build a logits processor that never samples token_ids
 
-    Raises:
-        ModelLoadError: If model loading fails
+    The bench masks the EOS tokens so every run decodes exactly the
+    requested number of tokens.
     """
-    suppress_output = io.StringIO()
-    is_local = os.path.exists(model_path)
+    import mlx.core as mx
 
-    if not is_local:
-        print("● Downloading...", end="", flush=True)
+    ids = list(token_ids)
 
-    try:
-        with redirect_stdout(suppress_output), redirect_stderr(suppress_output):
-            result = load(path_or_hf_repo=model_path)
-    except Exception as e:
-        if not is_local:
-            print(f"\r{' ' * 18}\r", end="", flush=True)
-        raise ModelLoadError(f"Failed to load model '{model_path}': {str(e)}") from e
+    def processor(tokens, logits):
+        mask = mx.zeros(logits.shape[-1], dtype=logits.dtype)
+        mask[ids] = float("-inf")
+        return logits + mask
 
-    if not is_local:
-        print(f"\r{' ' * 18}\r", end="", flush=True)
+    return processor
 
-    return result
 
+def _bench_once(
+    model,
+    tokenizer,
+    prompt: List[int],
+    generation_tokens: int,
+    max_kv_size: Optional[int],
+    **quantization,
+) -> Dict[str, float]:
+    """Prefill prompt into a fresh cache and decode generation_tokens
+
+    quantization holds stream_generate's kv_bits, kv_group_size and
+    quantized_kv_start.
+    """
+    import mlx.core as mx
+    from mlx_lm import stream_generate
+    from mlx_lm.models.cache import make_prompt_cache
+
+    mx.clear_cache()
+    mx.reset_peak_memory()
+    prompt_cache = make_prompt_cache(model, max_kv_size=max_kv_size)
 
-def get_model_context_length(model, tokenizer) -> int:
-    """Get the maximum context length for a model
+    start = time.perf_counter()
+    first_token_time = None
+    response = None
+    for response in stream_generate(
+        model,
+        tokenizer,
+        mx.array(prompt),
+        max_tokens=generation_tokens,
+        prompt_cache=prompt_cache,
+        logits_processors=[_suppress_tokens_processor(tokenizer.eos_token_ids)],
+        **quantization,
+    ):
+        if first_token_time is None:
+            first_token_time = time.perf_counter()
 
-    Args:
-        model: Language model object
-        tokenizer: Tokenizer object
+    return {
+        "prefill_tokens_per_second": response.prompt_tps,
+        "decode_tokens_per_second": response.generation_tps,
+        "time_to_first_token": first_token_time - start,
+        "peak_memory": response.peak_memory,
+        "kv_cache_memory": sum(c.nbytes for c in prompt_cache) / 1e9,
+    }
 
-    Returns:
-        Maximum context length in tokens
-    """
-    try:
-        # Check model config first - this is usually more accurate
-        if hasattr(model, "config"):
-            context_keys = [
-                "max_position_embeddings",
-                "n_positions",
-                "max_seq_len",
-                "seq_length",
-            ]
-            for key in context_keys:
-                max_context = getattr(model.config, key, None)
-                if (
-                    max_context
-                    and isinstance(max_context, (int, float))
-                    and max_context > 0
-                ):
-                    return int(max_context)
 
-        # Don't use tokenizer.model_max_length as it often reports incorrect values
-        # (e.g. 131k for models that actually support 40k)
-        return DEFAULT_CONTEXT_LENGTH
-    except Exception:
-        return DEFAULT_CONTEXT_LENGTH
+def _bench_perplexity(
+    model,
+    prompt: List[int],
+    max_kv_size: Optional[int],
+    kv_bits: Optional[int],
+    kv_group_size: int,
+    quantized_kv_start: int,
+) -> float:
+    """Perplexity of prompt, fed through the cache in chunks
+
+    The cache is quantized between chunks as it would be during prefill, so
+    later chunks attend to quantized keys and values.
+    """
+    import mlx.core as mx
+    from mlx_lm.models.cache import make_prompt_cache
+
+    prompt_cache = make_prompt_cache(model, max_kv_size=max_kv_size)
+    total = 0.0
+    for start in range(0, len(prompt) - 1, BENCH_PERPLEXITY_CHUNK):
+        inputs = prompt[start : start + BENCH_PERPLEXITY_CHUNK]
+        targets = mx.array(prompt[start + 1 : start + 1 + len(inputs)])
+        logits = model(mx.array(inputs)[None], cache=prompt_cache)[0]
+        logits = logits[: len(targets)].astype(mx.float32)
+        nll = mx.logsumexp(logits, axis=-1) - mx.take_along_axis(
+            logits, targets[:, None], axis=-1
+        ).squeeze(-1)
+        total += nll.sum().item()
+        _quantize_kv_cache(prompt_cache, kv_bits, kv_group_size, quantized_kv_start)
+    return math.exp(total / (len(prompt) - 1))
+
+
+def run_bench_cell(
+    model,
+    tokenizer,
+    prompt_tokens: int,
+    generation_tokens: int,
+    max_kv_size: Optional[int],
+    q_bits: Optional[int],
+    warmup: int,
+    repeats: int,
+    kv_bits: Optional[int] = None,
+    kv_group_size: int = DEFAULT_KV_GROUP_SIZE,
+    quantized_kv_start: int = DEFAULT_QUANTIZED_KV_START,
+    prompt_text: str = BENCH_PROMPT_TEXT,
+    measure_perplexity: bool = False,
+) -> BenchResult:
+    """Benchmark one cell, reporting the median of repeats after warmup runs"""
+    prompt = _bench_prompt(tokenizer, prompt_tokens, prompt_text)
+    quantization = {
+        "kv_bits": kv_bits,
+        "kv_group_size": kv_group_size,
+        "quantized_kv_start": quantized_kv_start,
+    }
+    for _ in range(warmup):
+        _bench_once(
+            model, tokenizer, prompt, generation_tokens, max_kv_size, **quantization
+        )
+    runs = [
+        _bench_once(
+            model, tokenizer, prompt, generation_tokens, max_kv_size, **quantization
+        )
+        for _ in range(repeats)
+    ]
 
+    result = BenchResult(
+        prompt_tokens=prompt_tokens,
+        generation_tokens=generation_tokens,
+        max_kv_size=max_kv_size,
+        q_bits=q_bits,
+        kv_bits=kv_bits,
+        runs=runs,
+    )
+    for name, _ in BENCH_METRICS:
+        if name not in runs[0]:
+            continue
+        values = [run[name] for run in runs]
+        # Memory does not vary with timing noise; report the worst run
+        if name in ("peak_memory", "kv_cache_memory"):
+            setattr(result, name, max(values))
+        else:
+            setattr(result, name, statistics.median(values))
+    # Teacher-forced, so the same on every run
+    if measure_perplexity and prompt_tokens > 1:
+        result.perplexity = _bench_perplexity(
+            model, prompt, max_kv_size, **quantization
+        )
+    return result
 
-def validate_context_length(requested_length: int, model_max_length: int) -> None:
-    """Validate requested context length against model maximum
 
-    Args:
-        requested_length: Requested context length
-        model_max_length: Model's maximum context length
+def _load_bench_model(model_path: str, q_bits: Optional[int], q_group_size: int):
+    """Load the model, quantizing its weights to q_bits in memory
 
     Raises:
-        ModelError: If requested length exceeds model maximum
+        ModelError: If the model cannot be loaded or is already quantized
     """
-    if requested_length > model_max_length:
+    model_obj, tokenizer = load_model_quietly(model_path)
+    if q_bits is None:
+        return model_obj, tokenizer
+
+    import mlx.nn as nn
+    from mlx_lm.utils import quantize_model
+
+    if any(isinstance(m, nn.QuantizedLinear) for _, m in model_obj.named_modules()):
         raise ModelError(
-            f"Requested context length {requested_length:,} exceeds model's maximum context length of {model_max_length:,}"
+            f"{model_path} is already quantized; --q-bits needs full-precision weights"
         )
+    with redirect_stdout(io.StringIO()):
+        model_obj, _ = quantize_model(model_obj, {}, q_group_size, q_bits)
+    return model_obj, tokenizer
+
+
+def compare_bench_results(
+    results: List[BenchResult], baseline: Dict[str, Any], threshold: float
+) -> List[str]:
+    """Describe every metric that regressed past threshold against baseline
+
+    Cells missing from the baseline are not compared.
+    """
+    # Ignore fields that this version does not know about
+    names = {f.name for f in fields(BenchResult)}
+    baseline_cells = {}
+    for cell in baseline.get("results", []):
+        result = BenchResult(**{k: v for k, v in cell.items() if k in names})
+        baseline_cells[result.key] = result
+
+    regressions = []
+    for result in results:
+        base = baseline_cells.get(result.key)
+        if base is None:
+            continue
+        for name, higher_is_better in BENCH_METRICS:
+            old, new = getattr(base, name), getattr(result, name)
+            if old <= 0:
+                continue
+            change = (new - old) / old
+            if (-change if higher_is_better else change) > threshold:
+                regressions.append(
+                    f"{_bench_cell_label(result)}: {name} {old:.4g} -> {new:.4g} "
+                    f"({change:+.0%})"
+                )
+    return regressions
+
+
+def _bench_cell_label(result: BenchResult) -> str:
+    kv = f"kv {result.max_kv_size:,}" if result.max_kv_size else "kv full"
+    if result.kv_bits:
+        kv += f" {result.kv_bits}-bit"
+    weights = f"{result.q_bits}-bit" if result.q_bits else "as loaded"
+    return (
+        f"prompt {result.prompt_tokens:,}, gen {result.generation_tokens:,}, "
+        f"{kv}, weights {weights}"
+    )
+
+
+def _bench_kv_cost(result: BenchResult, reference: BenchResult) -> str:
+    """Describe what KV quantization saved and cost against reference"""
+
+    def change(name: str) -> str:
+        old, new = getattr(reference, name), getattr(result, name)
+        return f"{(new - old) / old:+.1%}" if old > 0 else "n/a"
+
+    parts = [
+        f"KV cache {change('kv_cache_memory')}",
+        f"decode {change('decode_tokens_per_second')}",
+    ]
+    if result.perplexity:
+        parts.append(f"perplexity {change('perplexity')}")
+    return ", ".join(parts)
 
 
 @click.group()
@@ -1029,6 +4900,32 @@ def cli(ctx, system, verbose, show_thinking, enable_tools, no_stats):
     ctx.obj["no_stats"] = no_stats
 
 
+def _check_draft_options(
+    draft_model: Optional[str], max_kv_size: Optional[int], prompt_lookup_tokens: int
+):
+    """Reject option combinations speculative decoding cannot support"""
+    if prompt_lookup_tokens < 0:
+        raise click.UsageError("--prompt-lookup-tokens must not be negative")
+    if draft_model and prompt_lookup_tokens:
+        raise click.UsageError(
+            "--draft-model cannot be combined with --prompt-lookup-tokens"
+        )
+    # Rejected draft tokens are trimmed, which a rotated cache cannot do
+    if draft_model and max_kv_size is not None:
+        raise click.UsageError("--draft-model cannot be combined with --max-kv-size")
+    if prompt_lookup_tokens and max_kv_size is not None:
+        raise click.UsageError(
+            "--prompt-lookup-tokens cannot be combined with --max-kv-size"
+        )
+
+
+def _check_kv_options(max_kv_size: Optional[int], kv_bits: Optional[int]):
+    """Reject option combinations KV cache quantization cannot support"""
+    # mlx_lm cannot quantize the rotating cache --max-kv-size uses
+    if kv_bits is not None and max_kv_size is not None:
+        raise click.UsageError("--kv-bits cannot be combined with --max-kv-size")
+
+
 def _resolve_cli_options(ctx, verbose, show_thinking, system, enable_tools, no_stats):
     """Resolve CLI options from command-specific or global context"""
     return {
@@ -1078,12 +4975,105 @@ def _resolve_cli_options(ctx, verbose, show_thinking, system, enable_tools, no_s
     default=None,
     help="Disable generation statistics output",
 )
+@click.option(
+    "--max-tool-rounds",
+    default=DEFAULT_MAX_TOOL_ROUNDS,
+    help="Maximum rounds of tool calls per response",
+)
+@click.option(
+    "--stop-at-tool-call",
+    is_flag=True,
+    help="Stop generating and run a tool as soon as its call is complete",
+)
+@click.option(
+    "--stop",
+    "stop_sequences",
+    multiple=True,
+    help="Stop generating when this string is produced (repeatable)",
+)
+@click.option(
+    "--thinking-budget",
+    type=click.IntRange(min=0),
+    default=None,
+    help="Close each <think> block after N tokens and move on to the answer",
+)
 @click.option(
     "--max-kv-size",
     type=int,
     default=None,
     help="Maximum size of the key-value cache (limits context window)",
 )
+@click.option(
+    "--kv-bits",
+    type=click.IntRange(2, 8),
+    default=None,
+    help="Quantize the KV cache to this many bits (full precision if unset)",
+)
+@click.option(
+    "--kv-group-size",
+    default=DEFAULT_KV_GROUP_SIZE,
+    help="Group size for KV cache quantization",
+)
+@click.option(
+    "--quantized-kv-start",
+    type=click.IntRange(min=0),
+    default=DEFAULT_QUANTIZED_KV_START,
+    help="Quantize the KV cache once it holds this many tokens",
+)
+@click.option(
+    "--snapshots/--no-snapshots",
+    default=True,
+    help="Reuse on-disk KV snapshots of the system prompt and tool schema",
+)
+@click.option(
+    "--snapshot-dir",
+    type=str,
+    default=None,
+    help="Directory for prompt KV snapshots (default: ~/.cache/bizarro)",
+)
+@click.option(
+    "--draft-model",
+    type=str,
+    default=None,
+    help="Smaller model from the same family for speculative decoding",
+)
+@click.option(
+    "--num-draft-tokens",
+    default=DEFAULT_NUM_DRAFT_TOKENS,
+    help="Tokens proposed by the draft model per step",
+)
+@click.option(
+    "--prompt-lookup-tokens",
+    default=0,
+    help="Draft up to N tokens per step by matching n-grams in the context",
+)
+@click.option(
+    "--trace",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Write a latency trace here: Chrome trace JSON, or JSONL for .jsonl "
+    "files (always generates in-process)",
+)
+@click.option(
+    "--metrics",
+    "metrics_target",
+    default=None,
+    help="Append a JSON metrics record per turn to this file, or to a Unix "
+    "socket given as unix:PATH",
+)
+@click.option(
+    "--daemon/--no-daemon",
+    "use_daemon",
+    default=True,
+    help="Use a running bizarro daemon if one is listening",
+)
+@click.option(
+    "--socket",
+    "socket_path",
+    type=str,
+    default=None,
+    help="Daemon socket path (default: $XDG_RUNTIME_DIR/bizarro.sock)",
+)
 @click.pass_context
 def run(
     ctx,
@@ -1097,7 +5087,23 @@ def run(
     context_length,
     enable_tools,
     no_stats,
+    max_tool_rounds,
+    stop_at_tool_call,
+    stop_sequences,
+    thinking_budget,
     max_kv_size,
+    kv_bits,
+    kv_group_size,
+    quantized_kv_start,
+    snapshots,
+    snapshot_dir,
+    draft_model,
+    num_draft_tokens,
+    prompt_lookup_tokens,
+    trace,
+    metrics_target,
+    use_daemon,
+    socket_path,
 ):
     """Run the language model with the given prompt"""
     # Resolve CLI options
@@ -1116,38 +5122,42 @@ def run(
         verbose=options["verbose"],
         print_output=True,
         max_kv_size=max_kv_size,
+        kv_bits=kv_bits,
+        kv_group_size=kv_group_size,
+        quantized_kv_start=quantized_kv_start,
+        use_snapshots=snapshots,
+        snapshot_dir=snapshot_dir,
+        draft_model=draft_model,
+        num_draft_tokens=num_draft_tokens,
+        prompt_lookup_tokens=prompt_lookup_tokens,
+        max_tool_rounds=max_tool_rounds,
+        stop_at_tool_call=stop_at_tool_call,
+        stop_sequences=list(stop_sequences),
+        thinking_budget=thinking_budget,
     )
+    _check_draft_options(draft_model, max_kv_size, prompt_lookup_tokens)
+    _check_kv_options(max_kv_size, kv_bits)
 
     try:
-        # Load the model and tokenizer
-        model_obj, tokenizer = load_model_quietly(config.model)
-
-        model_max_context = get_model_context_length(model_obj, tokenizer)
-        if config.context_length is not None:
-            validate_context_length(config.context_length, model_max_context)
-
-        # Prepare conversation
-        conversation = _prepare_conversation(config)
-
-        # Get available tools if enabled
-        available_tools = get_available_tools() if config.enable_tools else None
+        # Hand the request to a resident daemon if one is running; a trace
+        # has to be recorded in this process
+        client = DaemonClient.connect(socket_path) if use_daemon and not trace else None
+        if trace:
+            _start_trace()
+        if client is not None:
+            stats = client.run(config)
+        else:
+            # Load the model and tokenizer
+            model_obj, tokenizer = load_model_quietly(config.model)
+            draft_obj = load_draft_model(config.draft_model, tokenizer)
 
-        # Create prompt cache for single run
-        prompt_cache = make_prompt_cache(model_obj, max_kv_size=max_kv_size)
+            # Generate response and collect statistics
+            stats, _ = _generate_run(model_obj, tokenizer, config, draft_obj)
 
-        # Generate response and collect statistics
-        stats = handle_conversation_turn(
-            model_obj=model_obj,
-            tokenizer=tokenizer,
-            conversation=conversation,
-            available_tools=available_tools,
-            max_tokens=config.max_tokens,
-            show_thinking=config.show_thinking,
-            verbose=config.verbose,
-            print_assistant_label=False,  # Don't print "Assistant:" in run mode
-            prompt_cache=prompt_cache,
-            max_kv_size=max_kv_size,
-        )
+        if metrics_target and stats:
+            sink = MetricsSink(metrics_target)
+            sink.emit(_turn_metrics(stats, command="run", model=config.model))
+            sink.close()
 
         # Print statistics unless disabled
         if not options["no_stats"] and stats:
@@ -1155,6 +5165,9 @@ def run(
 
     except ModelError as e:
         raise click.ClickException(str(e))
+    finally:
+        if trace:
+            _finish_trace(trace)
 
 
 @cli.command()
@@ -1175,31 +5188,115 @@ def run(
     help="Maximum context length to use (defaults to min(16384, model_max))",
 )
 @click.option(
-    "--enable-tools",
-    is_flag=True,
+    "--enable-tools",
+    is_flag=True,
+    default=None,
+    help="Enable tool support for function calling",
+)
+@click.option(
+    "--no-stats",
+    is_flag=True,
+    default=None,
+    help="Disable generation statistics output",
+)
+@click.option(
+    "--max-tool-rounds",
+    default=DEFAULT_MAX_TOOL_ROUNDS,
+    help="Maximum rounds of tool calls per response",
+)
+@click.option(
+    "--stop-at-tool-call",
+    is_flag=True,
+    help="Stop generating and run a tool as soon as its call is complete",
+)
+@click.option(
+    "--stop",
+    "stop_sequences",
+    multiple=True,
+    help="Stop generating when this string is produced (repeatable)",
+)
+@click.option(
+    "--thinking-budget",
+    type=click.IntRange(min=0),
+    default=None,
+    help="Close each <think> block after N tokens and move on to the answer",
+)
+@click.option(
+    "--enable-cache/--no-cache",
+    default=True,
+    help="Reuse the KV cache for the shared prompt prefix across turns",
+)
+@click.option(
+    "--cache-file",
+    type=str,
+    default=None,
+    help="Path to store prompt cache on disk (implies --enable-cache)",
+)
+@click.option(
+    "--max-kv-size",
+    type=int,
+    default=None,
+    help="Maximum size of the key-value cache (limits context window)",
+)
+@click.option(
+    "--kv-bits",
+    type=click.IntRange(2, 8),
+    default=None,
+    help="Quantize the KV cache to this many bits (full precision if unset)",
+)
+@click.option(
+    "--kv-group-size",
+    default=DEFAULT_KV_GROUP_SIZE,
+    help="Group size for KV cache quantization",
+)
+@click.option(
+    "--quantized-kv-start",
+    type=click.IntRange(min=0),
+    default=DEFAULT_QUANTIZED_KV_START,
+    help="Quantize the KV cache once it holds this many tokens",
+)
+@click.option(
+    "--draft-model",
+    type=str,
+    default=None,
+    help="Smaller model from the same family for speculative decoding",
+)
+@click.option(
+    "--num-draft-tokens",
+    default=DEFAULT_NUM_DRAFT_TOKENS,
+    help="Tokens proposed by the draft model per step",
+)
+@click.option(
+    "--prompt-lookup-tokens",
+    default=0,
+    help="Draft up to N tokens per step by matching n-grams in the context",
+)
+@click.option(
+    "--trace",
+    type=click.Path(dir_okay=False),
     default=None,
-    help="Enable tool support for function calling",
+    help="Write a latency trace here: Chrome trace JSON, or JSONL for .jsonl "
+    "files (always generates in-process)",
 )
 @click.option(
-    "--no-stats",
-    is_flag=True,
+    "--metrics",
+    "metrics_target",
     default=None,
-    help="Disable generation statistics output",
+    help="Append a JSON metrics record per turn to this file, or to a Unix "
+    "socket given as unix:PATH",
 )
 @click.option(
-    "--enable-cache", is_flag=True, help="Enable prompt caching for faster generation"
+    "--daemon/--no-daemon",
+    "use_daemon",
+    default=True,
+    help="Use a running bizarro daemon if one is listening",
 )
 @click.option(
-    "--cache-file",
+    "--socket",
+    "socket_path",
     type=str,
     default=None,
-    help="Path to store prompt cache on disk (implies --enable-cache)",
-)
-@click.option(
-    "--max-kv-size",
-    type=int,
-    default=None,
-    help="Maximum size of the key-value cache (limits context window)",
+    help="Daemon socket path (default: $XDG_RUNTIME_DIR/bizarro.sock)",
 )
 @click.pass_context
 def chat(
@@ -1211,32 +5308,76 @@ def chat(
     context_length,
     enable_tools,
     no_stats,
+    max_tool_rounds,
+    stop_at_tool_call,
+    stop_sequences,
+    thinking_budget,
     enable_cache,
     cache_file,
     max_kv_size,
+    kv_bits,
+    kv_group_size,
+    quantized_kv_start,
+    draft_model,
+    num_draft_tokens,
+    prompt_lookup_tokens,
+    trace,
+    metrics_target,
+    use_daemon,
+    socket_path,
 ):
     """Start an interactive chat session with the model"""
     # Resolve CLI options
     options = _resolve_cli_options(
         ctx, verbose, show_thinking, system, enable_tools, no_stats
     )
+    _check_draft_options(draft_model, max_kv_size, prompt_lookup_tokens)
+    _check_kv_options(max_kv_size, kv_bits)
+    quantization = {
+        "kv_bits": kv_bits,
+        "kv_group_size": kv_group_size,
+        "quantized_kv_start": quantized_kv_start,
+    }
+
+    # Hand turns to a resident daemon if one is running; a cache file or a
+    # trace needs the generation in this process, so it always runs locally
+    client = (
+        DaemonClient.connect(socket_path)
+        if use_daemon and not cache_file and not trace
+        else None
+    )
+    if trace:
+        _start_trace()
+    session_id = uuid.uuid4().hex
+    metrics_sink = MetricsSink(metrics_target) if metrics_target else None
 
     try:
-        console.print(f"[bold green]Loading model: {model}[/bold green]")
-        model_obj, tokenizer = load_model_quietly(model)
+        if client is not None:
+            console.print(f"[bold green]Using daemon for model: {model}[/bold green]")
+            model_max_context = client.context_length(model)
+        else:
+            console.print(f"[bold green]Loading model: {model}[/bold green]")
+            model_obj, tokenizer = load_model_quietly(model)
+            if draft_model:
+                console.print(
+                    f"[bold green]Loading draft model: {draft_model}[/bold green]"
+                )
+            draft_obj = load_draft_model(draft_model, tokenizer)
+
+            # Get model's maximum context length
+            model_max_context = get_model_context_length(model_obj, tokenizer)
     except ModelError as e:
         raise click.ClickException(str(e))
 
-    # Get model's maximum context length
-    model_max_context = get_model_context_length(model_obj, tokenizer)
-
     # Determine effective context length
     if context_length is None:
         effective_context_length = min(16384, model_max_context)
     else:
-        effective_context_length = validate_context_length(
-            context_length, model_max_context
-        )
+        try:
+            validate_context_length(context_length, model_max_context)
+        except ModelError as e:
+            raise click.ClickException(str(e))
+        effective_context_length = context_length
 
     # Build cache status string
     if enable_cache:
@@ -1252,6 +5393,8 @@ def chat(
         kv_info = f" | KV cache size: {max_kv_size:,}"
     else:
         kv_info = ""
+    if kv_bits is not None:
+        kv_info += f" | KV cache: {kv_bits}-bit from {quantized_kv_start:,} tokens"
 
     console.print(
         f"[dim]Using context length: {effective_context_length:,} tokens (model max: {model_max_context:,}) | Cache: {cache_status}{kv_info}[/dim]"
@@ -1282,25 +5425,57 @@ def chat(
     # Initialize session statistics
     session_stats = SessionStats()
 
+    # Evict old turns before the prompt outgrows the context, and render
+    # only the messages each turn adds
+    context_window = None
+    prompt_builder = None
+    if client is None:
+        context_window = ConversationWindow(
+            tokenizer,
+            _context_budget(effective_context_length, max_kv_size, 1000),
+            available_tools,
+        )
+        prompt_builder = PromptBuilder(tokenizer, available_tools)
+
     # Initialize prompt cache
-    prompt_cache = None
-    cache_loaded = False
+    cache_manager = None
 
     # Enable cache if cache_file is specified
     if cache_file:
         enable_cache = True
 
     # Only initialize cache if enabled
-    if enable_cache:
-        prompt_cache = []
+    if enable_cache and client is None:
+        keep = KV_SINK_TOKENS
+        if max_kv_size is not None:
+            keep = _pinned_prefix_length(
+                tokenizer, conversation, available_tools, max_kv_size
+            )
+            console.print(
+                f"[dim]KV cache keeps the first {keep:,} tokens (system prompt "
+                "and tools) once full[/dim]"
+            )
+        cache_manager = PromptCacheManager(
+            model_obj,
+            max_kv_size=max_kv_size,
+            draft_model=draft_obj,
+            keep=keep,
+            **quantization,
+        )
 
     # Load cache from file if specified
     if cache_file:
         cache_path = Path(cache_file)
         if cache_path.exists():
             try:
-                prompt_cache = load_prompt_cache(str(cache_path))
-                cache_loaded = True
+                cache_manager = PromptCacheManager.load(
+                    str(cache_path),
+                    model_obj,
+                    max_kv_size=max_kv_size,
+                    draft_model=draft_obj,
+                    keep=cache_manager.keep,
+                    **quantization,
+                )
                 console.print(f"[dim]Loaded prompt cache from {cache_file}[/dim]")
             except Exception as e:
                 console.print(
@@ -1310,6 +5485,12 @@ def chat(
             console.print(f"[dim]Will save prompt cache to {cache_file}[/dim]")
 
     # Setup prompt_toolkit session with history and auto-suggestions
+    from prompt_toolkit import PromptSession
+    from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
+    from prompt_toolkit.completion import WordCompleter
+    from prompt_toolkit.history import FileHistory
+    from prompt_toolkit.styles import Style
+
     history_file = Path.home() / ".bizarro_chat_history"
     session = PromptSession(
         history=FileHistory(str(history_file)),
@@ -1367,29 +5548,53 @@ def chat(
                 # Add user message to conversation
                 conversation.append({"role": "user", "content": user_input})
 
-                # Create prompt cache if enabled, not loaded from file, and not created yet
-                if (
-                    enable_cache
-                    and not cache_loaded
-                    and prompt_cache is not None
-                    and not prompt_cache
-                ):
-                    # Make an empty cache for the model
-                    prompt_cache = make_prompt_cache(model_obj, max_kv_size=max_kv_size)
-
                 # Handle the conversation turn
-                stats = handle_conversation_turn(
-                    model_obj=model_obj,
-                    tokenizer=tokenizer,
-                    conversation=conversation,
-                    available_tools=available_tools,
-                    max_tokens=1000,
-                    show_thinking=options["show_thinking"],
-                    verbose=options["verbose"],
-                    print_assistant_label=True,
-                    prompt_cache=prompt_cache,
-                    max_kv_size=max_kv_size,
-                )
+                if client is not None:
+                    stats = client.chat_turn(
+                        session_id,
+                        model,
+                        conversation,
+                        enable_tools=options["enable_tools"],
+                        max_tokens=1000,
+                        show_thinking=options["show_thinking"],
+                        verbose=options["verbose"],
+                        enable_cache=enable_cache,
+                        max_kv_size=max_kv_size,
+                        **quantization,
+                        draft_model=_daemon_model_path(draft_model)
+                        if draft_model
+                        else None,
+                        num_draft_tokens=num_draft_tokens,
+                        prompt_lookup_tokens=prompt_lookup_tokens,
+                        max_tool_rounds=max_tool_rounds,
+                        stop_at_tool_call=stop_at_tool_call,
+                        stop_sequences=list(stop_sequences),
+                        thinking_budget=thinking_budget,
+                        context_length=effective_context_length,
+                    )
+                else:
+                    stats = handle_conversation_turn(
+                        model_obj=model_obj,
+                        tokenizer=tokenizer,
+                        conversation=conversation,
+                        available_tools=available_tools,
+                        max_tokens=1000,
+                        show_thinking=options["show_thinking"],
+                        verbose=options["verbose"],
+                        print_assistant_label=True,
+                        cache_manager=cache_manager,
+                        max_kv_size=max_kv_size,
+                        **quantization,
+                        draft_model=draft_obj,
+                        num_draft_tokens=num_draft_tokens,
+                        prompt_lookup_tokens=prompt_lookup_tokens,
+                        max_tool_rounds=max_tool_rounds,
+                        stop_at_tool_call=stop_at_tool_call,
+                        stop_sequences=list(stop_sequences),
+                        thinking_budget=thinking_budget,
+                        context_window=context_window,
+                        prompt_builder=prompt_builder,
+                    )
 
                 # Update session statistics
                 if stats:
@@ -1397,7 +5602,33 @@ def chat(
                     session_stats.total_prompt_tokens += stats.prompt_tokens
                     session_stats.total_completion_tokens += stats.completion_tokens
                     session_stats.total_tokens += stats.total_tokens
+                    session_stats.total_reused_tokens += stats.reused_tokens
+                    session_stats.total_draft_proposed_tokens += (
+                        stats.draft_proposed_tokens
+                    )
+                    session_stats.total_draft_accepted_tokens += (
+                        stats.draft_accepted_tokens
+                    )
+                    session_stats.total_tool_cache_hits += stats.tool_cache_hits
+                    session_stats.total_tool_cache_misses += stats.tool_cache_misses
+                    session_stats.total_prefilled_tokens += stats.prefilled_tokens
+                    session_stats.total_prefill_time += stats.prefill_time
+                    session_stats.total_decode_time += stats.decode_time
+                    session_stats.total_time_to_first_token += stats.time_to_first_token
+                    session_stats.peak_memory = max(
+                        session_stats.peak_memory, stats.peak_memory
+                    )
                     session_stats.total_time += stats.total_time
+                    if metrics_sink:
+                        metrics_sink.emit(
+                            _turn_metrics(
+                                stats,
+                                command="chat",
+                                model=model,
+                                session=session_id,
+                                turn=session_stats.total_turns,
+                            )
+                        )
 
                 # Print statistics unless disabled
                 if not options["no_stats"] and stats:
@@ -1412,18 +5643,584 @@ def chat(
 
     finally:
         # Save cache to file if specified and caching is enabled
-        if enable_cache and cache_file and prompt_cache:
+        if cache_file and cache_manager and cache_manager.tokens:
             try:
-                save_prompt_cache(str(cache_path), prompt_cache)
+                with _trace_span("cache_save"):
+                    cache_manager.save(str(cache_path))
                 console.print(f"\n[dim]Saved prompt cache to {cache_file}[/dim]")
             except Exception as e:
                 console.print(
                     f"\n[yellow]Warning: Could not save cache to {cache_file}: {e}[/yellow]"
                 )
 
+        # Release the session's KV cache in the daemon
+        if client is not None:
+            try:
+                client.close_session(session_id)
+            except Exception:
+                pass
+
+        if metrics_sink:
+            metrics_sink.close()
+
         # Print session summary
         if not options["no_stats"] and session_stats.total_turns > 0:
             print_chat_session_summary(session_stats)
+        if trace:
+            _finish_trace(trace)
+
+
+@cli.command()
+@click.option(
+    "--socket",
+    "socket_path",
+    type=str,
+    default=None,
+    help="Socket to listen on (default: $XDG_RUNTIME_DIR/bizarro.sock)",
+)
+@click.option(
+    "--model",
+    "models",
+    multiple=True,
+    help="Model to load at startup (may be given more than once)",
+)
+@click.option(
+    "--max-models",
+    default=DAEMON_MAX_MODELS,
+    help="Maximum number of models kept resident",
+)
+@click.option(
+    "--metrics-port",
+    type=int,
+    default=None,
+    help="Serve Prometheus metrics on http://127.0.0.1:PORT/metrics",
+)
+def daemon(socket_path, models, max_models, metrics_port):
+    """Keep models resident and serve run/chat requests over a Unix socket"""
+    path = Path(socket_path) if socket_path else _default_daemon_socket()
+    metrics = PrometheusMetrics() if metrics_port is not None else None
+    model_daemon = ModelDaemon(
+        path, max_models=max(max_models, len(models), 1), metrics=metrics
+    )
+
+    # Exit through the normal cleanup path (removing the socket) on SIGTERM
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        if metrics is not None:
+            start_metrics_server(metrics, metrics_port)
+            console.print(
+                f"[dim]Metrics on http://127.0.0.1:{metrics_port}/metrics[/dim]"
+            )
+        for model in models:
+            console.print(f"[bold green]Loading model: {model}[/bold green]")
+            model_daemon.get_model(_daemon_model_path(model))
+
+        model_daemon.serve_forever()
+    except KeyboardInterrupt:
+        console.print("\n[yellow]Daemon stopped.[/yellow]")
+    except ModelError as e:
+        raise click.ClickException(str(e))
+
+
+@cli.command()
+@click.option("--model", default="Qwen/Qwen3-0.6B", help="Model to use")
+@click.option("--host", default="127.0.0.1", help="Address to listen on")
+@click.option("--port", default=8080, help="Port to listen on")
+@click.option(
+    "--max-batch-size",
+    default=SERVE_MAX_BATCH_SIZE,
+    help="Maximum number of sequences decoded together",
+)
+@click.option(
+    "--max-tokens",
+    default=1000,
+    help="Maximum tokens to generate when a request does not set a limit",
+)
+@click.option(
+    "--max-kv-size",
+    type=int,
+    default=None,
+    help="Maximum size of the key-value cache (limits context window)",
+)
+@click.option("--system", default=None, help="System message (string or file path)")
+@click.option(
+    "--show-thinking",
+    is_flag=True,
+    default=None,
+    help="Return thinking as reasoning_content instead of dropping it",
+)
+@click.option(
+    "--enable-tools",
+    is_flag=True,
+    default=None,
+    help="Execute built-in tools for requests that do not send their own",
+)
+@click.option("--verbose", is_flag=True, default=None, help="Log requests")
+@click.option(
+    "--metrics",
+    "metrics_target",
+    default=None,
+    help="Append a JSON metrics record per request to this file, or to a Unix "
+    "socket given as unix:PATH",
+)
+@click.option(
+    "--metrics-port",
+    type=int,
+    default=None,
+    help="Serve Prometheus metrics on http://127.0.0.1:PORT/metrics",
+)
+@click.pass_context
+def serve(
+    ctx,
+    model,
+    host,
+    port,
+    max_batch_size,
+    max_tokens,
+    max_kv_size,
+    system,
+    show_thinking,
+    enable_tools,
+    verbose,
+    metrics_target,
+    metrics_port,
+):
+    """Serve an OpenAI-compatible /v1/chat/completions endpoint"""
+    # Resolve CLI options
+    options = _resolve_cli_options(
+        ctx, verbose, show_thinking, system, enable_tools, None
+    )
+
+    try:
+        system_prompt = load_system_prompt(options["system"])
+        console.print(f"[bold green]Loading model: {model}[/bold green]")
+        model_obj, tokenizer = load_model_quietly(model)
+        metrics = PrometheusMetrics() if metrics_port is not None else None
+        if metrics is not None:
+            start_metrics_server(metrics, metrics_port)
+    except ModelError as e:
+        raise click.ClickException(str(e))
+
+    scheduler = BatchScheduler(
+        model_obj, tokenizer, max_batch_size=max_batch_size, max_kv_size=max_kv_size
+    )
+    server = ThreadingHTTPServer((host, port), _CompletionRequestHandler)
+    server.daemon_threads = True
+    server.app = CompletionServer(
+        model_name=model,
+        tokenizer=tokenizer,
+        scheduler=scheduler,
+        max_tokens=max_tokens,
+        system_prompt=system_prompt,
+        available_tools=get_available_tools() if options["enable_tools"] else None,
+        show_thinking=options["show_thinking"],
+        verbose=options["verbose"],
+        metrics=metrics,
+        metrics_sink=MetricsSink(metrics_target) if metrics_target else None,
+    )
+
+    console.print(
+        f"[bold blue]Serving {model} on http://{host}:{port}/v1 "
+        f"(batch size {max_batch_size})[/bold blue]"
+    )
+    if metrics is not None:
+        console.print(f"[dim]Metrics on http://127.0.0.1:{metrics_port}/metrics[/dim]")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        console.print("\n[yellow]Server stopped.[/yellow]")
+    finally:
+        server.server_close()
+
+
+@cli.command()
+@click.argument("input_file", type=click.File("r"), default="-")
+@click.option("--model", default="Qwen/Qwen3-0.6B", help="Model to use")
+@click.option(
+    "--output",
+    "-o",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Write results to this file instead of stdout",
+)
+@click.option(
+    "--max-tokens",
+    default=1000,
+    help="Maximum tokens to generate when a record does not set a limit",
+)
+@click.option(
+    "--batch-size",
+    default=SERVE_MAX_BATCH_SIZE,
+    help="Number of records prefilled and decoded together",
+)
+@click.option("--offset", default=0, help="Skip this many input records")
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Append to --output, continuing after the last record it contains",
+)
+@click.option(
+    "--max-kv-size",
+    type=int,
+    default=None,
+    help="Maximum size of the key-value cache (limits context window)",
+)
+@click.option("--system", default=None, help="System message (string or file path)")
+@click.option(
+    "--enable-tools",
+    is_flag=True,
+    default=None,
+    help="Execute built-in tools for records that do not send their own",
+)
+@click.option(
+    "--no-stats",
+    is_flag=True,
+    default=None,
+    help="Disable the summary printed at the end",
+)
+@click.pass_context
+def batch(
+    ctx,
+    input_file,
+    model,
+    output,
+    max_tokens,
+    batch_size,
+    offset,
+    resume,
+    max_kv_size,
+    system,
+    enable_tools,
+    no_stats,
+):
+    """Generate responses for a JSONL file of prompts or messages records
+
+    Results are written as JSONL in input order, one line per input record,
+    each with its GenerationStats.
+    """
+    # Resolve CLI options
+    options = _resolve_cli_options(ctx, None, None, system, enable_tools, no_stats)
+
+    if resume and output is None:
+        raise click.UsageError("--resume needs --output")
+
+    try:
+        if resume:
+            offset = _resume_batch_output(Path(output), offset)
+        system_prompt = load_system_prompt(options["system"])
+        model_obj, tokenizer = load_model_quietly(model)
+    except ModelError as e:
+        raise click.ClickException(str(e))
+
+    # Offline jobs can afford to pad whole batches for prefill
+    scheduler = BatchScheduler(
+        model_obj,
+        tokenizer,
+        max_batch_size=batch_size,
+        max_kv_size=max_kv_size,
+        prefill_batch_size=batch_size,
+    )
+    available_tools = get_available_tools() if options["enable_tools"] else None
+
+    out = (
+        open(output, "a" if resume else "w", encoding="utf-8") if output else sys.stdout
+    )
+    start_time = time.time()
+    records = 0
+    completion_tokens = 0
+
+    def write(future):
+        nonlocal records, completion_tokens
+        result = future.result()
+        out.write(json.dumps(result) + "\n")
+        out.flush()
+        records += 1
+        if "stats" in result:
+            completion_tokens += result["stats"]["completion_tokens"]
+
+    try:
+        # Workers block on the scheduler, which batches whatever is in flight;
+        # results are written oldest first to keep input order
+        with ThreadPoolExecutor(max_workers=batch_size) as pool:
+            pending = deque()
+            try:
+                lines = (line for line in input_file if line.strip())
+                for index, line in enumerate(lines):
+                    if index < offset:
+                        continue
+                    pending.append(
+                        pool.submit(
+                            _generate_batch_record,
+                            scheduler,
+                            tokenizer,
+                            index,
+                            line,
+                            max_tokens,
+                            system_prompt,
+                            available_tools,
+                        )
+                    )
+                    if len(pending) >= 2 * batch_size:
+                        write(pending.popleft())
+                while pending:
+                    write(pending.popleft())
+            except KeyboardInterrupt:
+                # Drop queued and in-flight records instead of finishing them
+                for future in pending:
+                    future.cancel()
+                scheduler.close()
+                raise
+    except KeyboardInterrupt:
+        Console(stderr=True).print(
+            f"\n[yellow]Interrupted after {offset + records} records; "
+            "rerun with --resume to continue.[/yellow]"
+        )
+        raise SystemExit(130)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    if not options["no_stats"]:
+        total_time = time.time() - start_time
+        err_console = Console(stderr=True)
+        err_console.print(
+            f"\n[dim]{records} records, {completion_tokens:,} tokens in "
+            f"{total_time:.1f}s ({records / total_time if total_time > 0 else 0:.2f} "
+            f"records/s, {completion_tokens / total_time if total_time > 0 else 0:.1f} "
+            "tokens/s)[/dim]"
+        )
+
+
+@cli.command()
+@click.option("--model", default="Qwen/Qwen3-0.6B", help="Model to benchmark")
+@click.option(
+    "--prompt-length",
+    "prompt_lengths",
+    type=click.IntRange(min=1),
+    multiple=True,
+    help="Prompt tokens to prefill (repeatable; default: 128, 1k, 8k and 32k)",
+)
+@click.option(
+    "--generation-length",
+    "generation_lengths",
+    type=click.IntRange(min=1),
+    multiple=True,
+    help="Tokens to decode (repeatable; default: 128)",
+)
+@click.option(
+    "--max-kv-size",
+    "max_kv_sizes",
+    type=click.IntRange(min=0),
+    multiple=True,
+    help="KV cache size limit (repeatable; 0, the default, is unbounded)",
+)
+@click.option(
+    "--q-bits",
+    "q_bits_levels",
+    type=click.IntRange(min=0, max=8),
+    multiple=True,
+    help="Quantize the weights to this many bits in memory (repeatable; 0, the "
+    "default, runs the model as loaded)",
+)
+@click.option("--q-group-size", default=64, help="Group size for --q-bits")
+@click.option(
+    "--kv-bits",
+    "kv_bits_levels",
+    type=click.IntRange(min=0, max=8),
+    multiple=True,
+    help="Also run with the KV cache quantized to this many bits (repeatable), "
+    "measuring perplexity against full precision",
+)
+@click.option(
+    "--kv-group-size",
+    default=DEFAULT_KV_GROUP_SIZE,
+    help="Group size for --kv-bits",
+)
+@click.option(
+    "--quantized-kv-start",
+    type=click.IntRange(min=0),
+    default=0,
+    help="Cache length at which --kv-bits quantization starts",
+)
+@click.option(
+    "--prompt-file",
+    type=click.File("r", encoding="utf-8"),
+    default=None,
+    help="Build prompts from this text instead of a fixed passage; use real "
+    "text when comparing perplexity",
+)
+@click.option("--warmup", default=1, help="Untimed runs before each cell")
+@click.option("--repeats", default=3, help="Timed runs per cell (the median is kept)")
+@click.option(
+    "--output",
+    "-o",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Write JSON results to this file instead of stdout",
+)
+@click.option(
+    "--baseline",
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    help="Fail if a metric regressed against these saved results",
+)
+@click.option(
+    "--threshold",
+    default=BENCH_REGRESSION_THRESHOLD,
+    help="Relative change counted as a regression (default: 0.1, i.e. 10%)",
+)
+def bench(
+    model,
+    prompt_lengths,
+    generation_lengths,
+    max_kv_sizes,
+    q_bits_levels,
+    q_group_size,
+    kv_bits_levels,
+    kv_group_size,
+    quantized_kv_start,
+    prompt_file,
+    warmup,
+    repeats,
+    output,
+    baseline,
+    threshold,
+):
+    """Benchmark prefill, decode, TTFT and peak memory over a fixed matrix
+
+    Every combination of prompt length, generation length, KV cache size,
+    weight quantization and KV cache quantization is run --warmup times
+    untimed and --repeats times timed, and the medians are written as JSON.
+    Quantized KV cache cells are also compared against full precision. With
+    --baseline, exits non-zero when any metric regressed by more than
+    --threshold.
+    """
+    import mlx.core as mx
+    import mlx_lm
+
+    baseline_data = None
+    if baseline:
+        try:
+            with open(baseline, "r", encoding="utf-8") as f:
+                baseline_data = json.load(f)
+        except ValueError as e:
+            raise click.ClickException(f"Invalid baseline {baseline}: {e}")
+
+    prompt_text = prompt_file.read() if prompt_file else BENCH_PROMPT_TEXT
+    if not prompt_text.strip():
+        raise click.ClickException("--prompt-file is empty")
+    # Full precision always runs first, as the reference for quantized cells
+    kv_bits_levels = sorted(set(kv_bits_levels) | {0})
+    measure_perplexity = any(kv_bits_levels)
+
+    err_console = Console(stderr=True)
+    results: List[BenchResult] = []
+    try:
+        for q_bits in q_bits_levels or (0,):
+            err_console.print(f"[bold green]Loading model: {model}[/bold green]")
+            model_obj, tokenizer = _load_bench_model(
+                model, q_bits or None, q_group_size
+            )
+            context_length = get_model_context_length(model_obj, tokenizer)
+
+            for prompt_tokens in prompt_lengths or BENCH_PROMPT_LENGTHS:
+                for generation_tokens in generation_lengths or BENCH_GENERATION_LENGTHS:
+                    if prompt_tokens + generation_tokens > context_length:
+                        err_console.print(
+                            f"[yellow]Skipping prompt {prompt_tokens:,} + gen "
+                            f"{generation_tokens:,}: over the {context_length:,} "
+                            "token context[/yellow]"
+                        )
+                        continue
+                    for max_kv_size, kv_bits in itertools.product(
+                        max_kv_sizes or (0,), kv_bits_levels
+                    ):
+                        if max_kv_size and kv_bits:
+                            # mlx_lm cannot quantize a rotating cache
+                            continue
+                        result = run_bench_cell(
+                            model_obj,
+                            tokenizer,
+                            prompt_tokens,
+                            generation_tokens,
+                            max_kv_size or None,
+                            q_bits or None,
+                            warmup,
+                            repeats,
+                            kv_bits=kv_bits or None,
+                            kv_group_size=kv_group_size,
+                            quantized_kv_start=quantized_kv_start,
+                            prompt_text=prompt_text,
+                            measure_perplexity=measure_perplexity,
+                        )
+                        results.append(result)
+                        line = (
+                            f"{_bench_cell_label(result)}: "
+                            f"prefill {result.prefill_tokens_per_second:.1f} tok/s, "
+                            f"decode {result.decode_tokens_per_second:.1f} tok/s, "
+                            f"TTFT {result.time_to_first_token:.3f}s, "
+                            f"peak {result.peak_memory:.2f} GB, "
+                            f"KV cache {result.kv_cache_memory:.3f} GB"
+                        )
+                        if result.perplexity:
+                            line += f", perplexity {result.perplexity:.3f}"
+                        err_console.print(line)
+                        if kv_bits:
+                            reference = next(
+                                r
+                                for r in results
+                                if r.key[:-1] == result.key[:-1] and r.kv_bits is None
+                            )
+                            err_console.print(
+                                f"  [dim]vs full precision: "
+                                f"{_bench_kv_cost(result, reference)}[/dim]"
+                            )
+
+            # Free this quantization level before loading the next one
+            del model_obj
+            mx.clear_cache()
+    except ModelError as e:
+        raise click.ClickException(str(e))
+
+    report = {
+        "model": model,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "environment": {
+            "platform": platform.platform(),
+            "mlx": mx.__version__,
+            "mlx_lm": mlx_lm.__version__,
+        },
+        "q_group_size": q_group_size,
+        "kv_group_size": kv_group_size,
+        "quantized_kv_start": quantized_kv_start,
+        "prompt_file": prompt_file.name if prompt_file else None,
+        "warmup": warmup,
+        "repeats": repeats,
+        "results": [asdict(result) for result in results],
+    }
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    else:
+        print(json.dumps(report, indent=2))
+
+    if baseline_data is not None:
+        if baseline_data.get("model") != model:
+            err_console.print(
+                f"[yellow]Warning: baseline is for {baseline_data.get('model')}, "
+                f"not {model}[/yellow]"
+            )
+        regressions = compare_bench_results(results, baseline_data, threshold)
+        for regression in regressions:
+            err_console.print(f"[red]Regression: {regression}[/red]")
+        if regressions:
+            raise click.ClickException(
+                f"{len(regressions)} metrics regressed by more than "
+                f"{threshold:.0%} against {baseline}"
+            )
+        err_console.print(f"[green]No regressions against {baseline}[/green]")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,131 @@
+#!/usr/bin/env -S uv run --script
+# /// script
+# requires-python = "==3.12.*"
+# dependencies = [
+#     "mlx>=0.26.2",
+#     "mlx-lm>=0.32.0",
+#     "urllib3==1.26.6",
+#     "click>=8.0.0",
+#     "rich>=13.0.0",
+#     "prompt-toolkit>=3.0.0",
+# ]
+# ///
+
+# SPDX-FileCopyrightText: © 2024-2025 Austin Seipp
+# SPDX-License-Identifier: Apache-2.0
+
+# Check and benchmark for the incremental PromptBuilder used by bizarro.py.
+# Replays a synthetic chat (with tool calls every few turns) through the
+# builder and through a full apply_chat_template render, fails if they ever
+# differ by a byte or a token, and reports the per-turn render time of each.
+# Also checks that tool results can be appended to a cached response without
+# re-templating the conversation:
+#
+#   t/bench_prompt_builder.py --model Qwen/Qwen3-0.6B --turns 200
+
+import sys
+import time
+from pathlib import Path
+
+import click
+from huggingface_hub import snapshot_download
+from mlx_lm.utils import load_tokenizer
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import bizarro  # noqa: E402
+
+
+def synthetic_turn(turn: int):
+    """Messages one chat turn adds: a question, tool calls, and an answer"""
+    user = {"role": "user", "content": f"Question {turn}: what is {turn} * 7?"}
+    if turn % 3:
+        return [user], [{"role": "assistant", "content": f"It is {turn * 7}."}]
+    return [user], [
+        {"role": "assistant", "content": "Let me check."},
+        {"role": "tool", "name": "calculator", "content": str(turn * 7)},
+        {"role": "tool", "name": "get_current_time", "content": "12:00:00"},
+        {"role": "assistant", "content": f"The calculator says {turn * 7}."},
+    ]
+
+
+def check_tool_results_suffix(tokenizer, available_tools, system):
+    """Fail unless _tool_results_suffix reproduces a full render"""
+    conversation = [{"role": "system", "content": system}] if system else []
+    conversation.append({"role": "user", "content": "What is 6 * 7?"})
+    response = (
+        "<think>\nI should use the calculator.\n</think>\n\n"
+        '<tool_call>\n{"name": "calculator", "arguments": {"expression": "6 * 7"}}'
+        "\n</tool_call>"
+    )
+    generated = tokenizer.encode(response, add_special_tokens=False)
+    generated.append(tokenizer.eos_token_id)
+    tool_messages = [{"role": "tool", "name": "calculator", "content": "42"}]
+
+    suffix = bizarro._tool_results_suffix(tokenizer, generated, tool_messages)
+    if suffix is None:
+        raise click.ClickException("No tool results suffix for this chat template")
+    prompt = bizarro._render_prompt(tokenizer, conversation, available_tools)
+    expected = bizarro._render_prompt(
+        tokenizer,
+        conversation + [{"role": "assistant", "content": response}] + tool_messages,
+        available_tools,
+    )
+    if tokenizer.decode(prompt + generated + suffix) != tokenizer.decode(expected):
+        raise click.ClickException("Tool results suffix differs from a full render")
+
+
+@click.command()
+@click.option("--model", default="Qwen/Qwen3-0.6B", help="Model whose template to use")
+@click.option("--turns", default=100, help="Chat turns to replay")
+@click.option("--tools/--no-tools", default=True, help="Render the tool schema")
+@click.option("--system", default="You are a helpful assistant.", help="System prompt")
+def main(model, turns, tools, system):
+    """Compare PromptBuilder against full renders, byte for byte"""
+    model_path = Path(model)
+    if not model_path.exists():
+        # Only the tokenizer and chat template are needed, not the weights
+        model_path = Path(
+            snapshot_download(model, allow_patterns=["*.json", "*.jinja", "*.txt"])
+        )
+    tokenizer = load_tokenizer(model_path)
+    available_tools = bizarro.get_available_tools() if tools else None
+    check_tool_results_suffix(tokenizer, available_tools, system)
+    builder = bizarro.PromptBuilder(tokenizer, available_tools, verify_renders=0)
+
+    conversation = [{"role": "system", "content": system}] if system else []
+    full_time = 0.0
+    builder_time = 0.0
+    for turn in range(turns):
+        question, answer = synthetic_turn(turn)
+        conversation += question
+
+        start = time.perf_counter()
+        expected = bizarro._render_prompt(tokenizer, conversation, available_tools)
+        full_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        tokens = builder.render(conversation)
+        builder_time += time.perf_counter() - start
+
+        text = tokenizer.apply_chat_template(
+            conversation=conversation,
+            tools=bizarro._tool_schemas(available_tools) if available_tools else None,
+            tokenize=False,
+        )
+        if builder.text != text:
+            raise click.ClickException(f"Rendered text differs at turn {turn}")
+        if tokens != expected:
+            raise click.ClickException(f"Prompt tokens differ at turn {turn}")
+        conversation += answer
+
+    mode = "incremental" if builder.incremental else "full (template not local)"
+    click.echo(f"{turns} turns, {len(expected):,} prompt tokens at the end")
+    click.echo(f"full render:   {full_time * 1000 / turns:8.2f} ms/turn")
+    click.echo(f"PromptBuilder: {builder_time * 1000 / turns:8.2f} ms/turn ({mode})")
+    click.echo("byte-for-byte: ok")
+    click.echo("tool results suffix: ok")
+
+
+if __name__ == "__main__":
+    main()
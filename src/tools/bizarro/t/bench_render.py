@@ -0,0 +1,99 @@
+#!/usr/bin/env -S uv run --script
+# /// script
+# requires-python = "==3.12.*"
+# dependencies = [
+#     "mlx>=0.26.2",
+#     "mlx-lm>=0.32.0",
+#     "urllib3==1.26.6",
+#     "click>=8.0.0",
+#     "rich>=13.0.0",
+#     "prompt-toolkit>=3.0.0",
+# ]
+# ///
+
+# SPDX-FileCopyrightText: © 2024-2025 Austin Seipp
+# SPDX-License-Identifier: Apache-2.0
+
+# Benchmark for the terminal renderer used by bizarro.py. Generates the same
+# response with rendering disabled, with a flush on every write (the old
+# per-character behaviour), and with the default frame interval, and reports
+# decode tok/s for each. Run it in a real terminal to measure terminal cost:
+#
+#   t/bench_render.py --model Qwen/Qwen3-0.6B --show-thinking
+
+import sys
+from pathlib import Path
+
+import click
+from mlx_lm.models.cache import make_prompt_cache
+from rich.console import Console
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import bizarro  # noqa: E402
+
+
+def generate(model_obj, tokenizer, prompt_tokens, max_tokens, renderer):
+    prompt_cache = make_prompt_cache(model_obj)
+    result = bizarro.stream_with_thinking_handler(
+        model=model_obj,
+        tokenizer=tokenizer,
+        prompt=prompt_tokens,
+        max_tokens=max_tokens,
+        show_thinking=renderer.show_thinking,
+        prompt_cache=prompt_cache,
+        renderer=renderer,
+    )
+    print()
+    return result.stats
+
+
+@click.command()
+@click.option("--model", default="Qwen/Qwen3-0.6B", help="Model to use")
+@click.option(
+    "--prompt",
+    default="Think carefully, then explain how a hash map works.",
+    help="Prompt to generate from",
+)
+@click.option("--max-tokens", default=512, help="Tokens generated per run")
+@click.option("--show-thinking", is_flag=True, help="Render thinking text too")
+def main(model, prompt, max_tokens, show_thinking):
+    """Compare decode tok/s with terminal rendering on and off"""
+    model_obj, tokenizer = bizarro.load_model_quietly(model)
+    prompt_tokens = tokenizer.apply_chat_template(
+        conversation=[{"role": "user", "content": prompt}],
+        add_generation_prompt=True,
+    )
+
+    modes = [
+        ("off", dict(enabled=False)),
+        ("unbuffered", dict(frame_interval=0.0)),
+        ("framed", dict()),
+    ]
+
+    # Warm up so the first timed mode does not pay for compilation
+    generate(
+        model_obj,
+        tokenizer,
+        prompt_tokens,
+        16,
+        bizarro.StreamRenderer(enabled=False),
+    )
+
+    results = []
+    for name, options in modes:
+        renderer = bizarro.StreamRenderer(show_thinking=show_thinking, **options)
+        stats = generate(model_obj, tokenizer, prompt_tokens, max_tokens, renderer)
+        results.append((name, stats))
+
+    err_console = Console(stderr=True)
+    err_console.print("\n[bold]Rendering benchmark:[/bold]")
+    for name, stats in results:
+        err_console.print(
+            f"{name:>10}: {stats.completion_tokens} tokens in "
+            f"{stats.total_time:.2f}s ({stats.decode_tokens_per_second:.1f} tokens/s decode)"
+        )
+
+
+if __name__ == "__main__":
+    main()
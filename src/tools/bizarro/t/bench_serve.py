@@ -0,0 +1,85 @@
+#!/usr/bin/env -S uv run --script
+# /// script
+# requires-python = "==3.12.*"
+# dependencies = [
+#     "mlx>=0.26.2",
+#     "mlx-lm>=0.32.0",
+#     "urllib3==1.26.6",
+#     "click>=8.0.0",
+#     "rich>=13.0.0",
+#     "prompt-toolkit>=3.0.0",
+# ]
+# ///
+
+# SPDX-FileCopyrightText: © 2024-2025 Austin Seipp
+# SPDX-License-Identifier: Apache-2.0
+
+# Throughput benchmark for the continuous-batching scheduler behind
+# `bizarro.py serve`. Submits the same set of concurrent requests with several
+# maximum batch sizes and reports requests/s and decode tok/s for each:
+#
+#   t/bench_serve.py --model Qwen/Qwen3-0.6B --requests 32 --batch-sizes 1,4,16
+
+import sys
+import threading
+import time
+from pathlib import Path
+
+import click
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import bizarro  # noqa: E402
+
+
+def run_requests(scheduler, prompts, max_tokens):
+    """Generate all prompts concurrently; returns (seconds, tokens generated)"""
+    counts = [0] * len(prompts)
+
+    def worker(i):
+        for _ in scheduler.generate(prompts[i], max_tokens):
+            counts[i] += 1
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(prompts))]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, sum(counts)
+
+
+@click.command()
+@click.option("--model", default="Qwen/Qwen3-0.6B", help="Model to use")
+@click.option("--requests", "num_requests", default=32, help="Concurrent requests")
+@click.option("--max-tokens", default=128, help="Tokens generated per request")
+@click.option("--batch-sizes", default="1,4,16", help="Comma-separated batch sizes")
+def main(model, num_requests, max_tokens, batch_sizes):
+    """Compare serve throughput across maximum batch sizes"""
+    model_obj, tokenizer = bizarro.load_model_quietly(model)
+    prompts = [
+        tokenizer.apply_chat_template(
+            conversation=[
+                {"role": "user", "content": f"Write a short story about robot #{i}."}
+            ],
+            add_generation_prompt=True,
+        )
+        for i in range(num_requests)
+    ]
+
+    click.echo(f"{num_requests} requests x {max_tokens} tokens")
+    for batch_size in [int(size) for size in batch_sizes.split(",")]:
+        scheduler = bizarro.BatchScheduler(
+            model_obj, tokenizer, max_batch_size=batch_size
+        )
+        # Warm up so compilation is not timed
+        run_requests(scheduler, prompts[:1], 8)
+        elapsed, tokens = run_requests(scheduler, prompts, max_tokens)
+        click.echo(
+            f"batch {batch_size:>3}: {num_requests / elapsed:6.2f} req/s, "
+            f"{tokens / elapsed:8.1f} tokens/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env -S uv run --script
+# /// script
+# requires-python = "==3.12.*"
+# dependencies = [
+#     "mlx>=0.26.2",
+#     "mlx-lm>=0.32.0",
+#     "urllib3==1.26.6",
+#     "click>=8.0.0",
+#     "rich>=13.0.0",
+#     "prompt-toolkit>=3.0.0",
+# ]
+# ///
+
+# SPDX-FileCopyrightText: © 2024-2025 Austin Seipp
+# SPDX-License-Identifier: Apache-2.0
+
+# Startup benchmark for bizarro.py and tuner.py. Runs `<script> --help` under
+# `python -X importtime` and reports the wall time and the slowest top-level
+# imports. Heavy modules (mlx, mlx_lm, numpy, prompt_toolkit, ...) are only
+# imported by the subcommands that need them; the run fails if --help pulls
+# one of them in again, or if it is slower than --max-seconds:
+#
+#   t/bench_startup.py --max-seconds 1.0
+
+import re
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import click
+
+SCRIPT_DIR = Path(__file__).resolve().parent.parent
+SCRIPTS = ["bizarro.py", "tuner.py"]
+DEFERRED_MODULES = [
+    "mlx",
+    "mlx_lm",
+    "numpy",
+    "prompt_toolkit",
+    "huggingface_hub",
+    "transformers",
+]
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+
+def measure(script: str):
+    """Run script --help with -X importtime, returning (seconds, imports)
+
+    imports maps each top-level module to its cumulative import time in
+    microseconds.
+    """
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", str(SCRIPT_DIR / script), "--help"],
+        capture_output=True,
+        text=True,
+    )
+    elapsed = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise click.ClickException(f"{script} --help failed:\n{proc.stderr}")
+
+    imports = {}
+    for line in proc.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        # Nested imports are indented; their time is included in the parent
+        if match and not match.group(3):
+            imports[match.group(4)] = int(match.group(2))
+    return elapsed, imports
+
+
+@click.command()
+@click.option("--repeats", default=5, help="Timing repetitions (best is reported)")
+@click.option("--top", default=8, help="Slowest top-level imports to show")
+@click.option("--max-seconds", type=float, default=None, help="Fail above this")
+def main(repeats, top, max_seconds):
+    """Measure --help startup time and per-module import time"""
+    failures = []
+    for script in SCRIPTS:
+        runs = [measure(script) for _ in range(repeats)]
+        elapsed, imports = min(runs, key=lambda run: run[0])
+
+        click.echo(f"{script} --help: {elapsed * 1000:.0f} ms")
+        slowest = sorted(imports.items(), key=lambda item: item[1], reverse=True)
+        for module, micros in slowest[:top]:
+            click.echo(f"  {micros / 1000:8.1f} ms  {module}")
+
+        loaded = sorted(
+            {module for module in imports if module.split(".")[0] in DEFERRED_MODULES}
+        )
+        if loaded:
+            failures.append(f"{script} --help imports {', '.join(loaded)}")
+        if max_seconds is not None and elapsed > max_seconds:
+            failures.append(
+                f"{script} --help took {elapsed:.2f}s (limit {max_seconds:.2f}s)"
+            )
+
+    if failures:
+        raise click.ClickException("; ".join(failures))
+
+
+if __name__ == "__main__":
+    main()
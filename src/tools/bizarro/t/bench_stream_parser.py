@@ -0,0 +1,261 @@
+#!/usr/bin/env -S uv run --script
+# /// script
+# requires-python = "==3.12.*"
+# dependencies = [
+#     "mlx>=0.26.2",
+#     "mlx-lm>=0.32.0",
+#     "urllib3==1.26.6",
+#     "click>=8.0.0",
+#     "rich>=13.0.0",
+#     "prompt-toolkit>=3.0.0",
+# ]
+# ///
+
+# SPDX-FileCopyrightText: © 2024-2025 Austin Seipp
+# SPDX-License-Identifier: Apache-2.0
+
+# Micro-benchmark for the streaming tag parser used by bizarro.py. Replays a
+# stream of generated text chunks through the per-character scanner that
+# stream_with_thinking_handler used to run and through StreamTagParser, and
+# reports the per-token overhead of each.
+#
+# Streams are JSONL files with one {"text": ...} object per generated chunk.
+# Record one from a real model with:
+#
+#   t/bench_stream_parser.py --record trace.jsonl --model Qwen/Qwen3-0.6B \
+#       --prompt "Prove that there are infinitely many primes"
+#
+# and replay it with --stream trace.jsonl. Without --stream a synthetic
+# Qwen3-shaped trace (long <think> block followed by a tool call) is used.
+#
+# Before timing, the parser is checked against the legacy scanner on the
+# joined stream, and StreamTagParser and StopSequenceMatcher are fed fixed texts
+# split at every chunk boundary; the run fails on any difference.
+
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+import click
+from mlx_lm import stream_generate
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import bizarro  # noqa: E402
+
+
+def legacy_scan(chunks):
+    """The old per-character scan, with terminal output removed"""
+    in_thinking = False
+    in_tool_call = False
+    counts = {"text": 0, "thinking": 0, "tool_call": 0}
+    for text in chunks:
+        i = 0
+        while i < len(text):
+            if text[i:].startswith("<think>"):
+                in_thinking = True
+                i += 7
+                continue
+            elif text[i:].startswith("</think>"):
+                in_thinking = False
+                i += 8
+                continue
+            elif text[i:].startswith("<tool_call>"):
+                in_tool_call = True
+                i += 11
+                continue
+            elif text[i:].startswith("</tool_call>"):
+                in_tool_call = False
+                i += 12
+                continue
+
+            if in_thinking:
+                counts["thinking"] += 1
+            elif in_tool_call:
+                counts["tool_call"] += 1
+            else:
+                counts["text"] += 1
+            i += 1
+    return counts
+
+
+def parser_scan(chunks):
+    """Classify the same stream with StreamTagParser"""
+    parser = bizarro.StreamTagParser()
+    counts = {"text": 0, "thinking": 0, "tool_call": 0}
+    for text in chunks:
+        for segment in parser.feed(text):
+            if segment.text:
+                counts[segment.kind] += len(segment.text)
+    for segment in parser.flush():
+        counts[segment.kind] += len(segment.text)
+    return counts
+
+
+# (text, expected (kind, text) content runs) for the chunk boundary checks
+PARSER_CASES = [
+    (
+        "<think>\nhmm, x < y</think>\n\nAnswer",
+        [("thinking", "\nhmm, x < y"), ("text", "\n\nAnswer")],
+    ),
+    (
+        'a<tool_call>\n{"name": "f"}\n</tool_call>b',
+        [("text", "a"), ("tool_call", '\n{"name": "f"}\n'), ("text", "b")],
+    ),
+    # A tag cut off by the end of the stream is plain text
+    ("done <thin", [("text", "done <thin")]),
+    ("<<think>>", [("text", "<"), ("thinking", ">")]),
+]
+
+# (text, stop strings, expected output, expected match)
+STOP_CASES = [
+    ("Hello STOP more", ["STOP"], "Hello ", "STOP"),
+    ("one\n\nUser: two", ["\n\nUser:", "END"], "one", "\n\nUser:"),
+    # A partial stop string at the end of the stream is kept
+    ("almost STO", ["STOP"], "almost STO", None),
+    ("STSTOP", ["STOP"], "ST", "STOP"),
+]
+
+
+def splits(text: str):
+    """Every split of text into two chunks, and one chunk per character"""
+    for i in range(len(text) + 1):
+        yield [text[:i], text[i:]]
+    yield list(text)
+
+
+def parse_runs(chunks):
+    """Feed chunks through StreamTagParser, merging content into (kind, text)"""
+    parser = bizarro.StreamTagParser()
+    runs = []
+    segments = [s for chunk in chunks for s in parser.feed(chunk)] + parser.flush()
+    for segment in segments:
+        if not segment.text:
+            continue
+        if runs and runs[-1][0] == segment.kind:
+            runs[-1] = (segment.kind, runs[-1][1] + segment.text)
+        else:
+            runs.append((segment.kind, segment.text))
+    return runs
+
+
+def check_stop(chunks, stop_sequences):
+    """Feed chunks through StopSequenceMatcher until it matches"""
+    matcher = bizarro.StopSequenceMatcher(stop_sequences)
+    output = ""
+    for chunk in chunks:
+        output += matcher.feed(chunk)
+        if matcher.matched is not None:
+            return output, matcher.matched
+    return output + matcher.flush(), None
+
+
+def check_boundaries():
+    """Describe every chunking where the parser or stop matcher goes wrong"""
+    failures = []
+    for text, expected in PARSER_CASES:
+        for chunks in splits(text):
+            if parse_runs(chunks) != expected:
+                failures.append(f"StreamTagParser on {chunks!r}: {parse_runs(chunks)}")
+                break
+    for text, stops, expected, match in STOP_CASES:
+        for chunks in splits(text):
+            if check_stop(chunks, stops) != (expected, match):
+                failures.append(
+                    f"StopSequenceMatcher on {chunks!r}: {check_stop(chunks, stops)}"
+                )
+                break
+    return failures
+
+
+def synthetic_stream(thinking_tokens: int, seed: int = 0):
+    """Build a Qwen3-like chunk stream with tags split across chunks"""
+    rng = random.Random(seed)
+    words = (
+        "so the user wants me to work out the answer step by step , let me "
+        "check the constraints again and compare x < y before I respond ."
+    ).split()
+    chunks = ["<th", "ink>", "\n"]
+    for _ in range(thinking_tokens):
+        chunks.append(" " + rng.choice(words))
+    chunks += ["\n", "</", "think>", "\n\n", "<tool", "_call>", "\n"]
+    chunks += ['{"name": "calculator", ', '"arguments": {"expression": "2 + 2"}}']
+    chunks += ["\n", "</tool_call>", "\n", "The", " answer", " is", " 4", "."]
+    return chunks
+
+
+def load_stream(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line)["text"] for line in f if line.strip()]
+
+
+def record_stream(path: str, model: str, prompt: str, max_tokens: int):
+    model_obj, tokenizer = bizarro.load_model_quietly(model)
+    conversation = [{"role": "user", "content": prompt}]
+    prompt_tokens = tokenizer.apply_chat_template(
+        conversation=conversation, add_generation_prompt=True
+    )
+    with open(path, "w", encoding="utf-8") as f:
+        for response in stream_generate(
+            model_obj, tokenizer, prompt_tokens, max_tokens=max_tokens
+        ):
+            f.write(json.dumps({"text": response.text}) + "\n")
+
+
+def time_scan(scan, chunks, repeats: int) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        scan(chunks)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+@click.command()
+@click.option("--stream", "stream_path", default=None, help="Recorded stream JSONL")
+@click.option("--record", "record_path", default=None, help="Record a stream here")
+@click.option("--model", default="Qwen/Qwen3-0.6B", help="Model used by --record")
+@click.option(
+    "--prompt", default="Explain why the sky is blue.", help="Prompt used by --record"
+)
+@click.option("--max-tokens", default=4096, help="Tokens generated by --record")
+@click.option("--thinking-tokens", default=8192, help="Synthetic thinking length")
+@click.option("--repeats", default=5, help="Timing repetitions (best is reported)")
+def main(stream_path, record_path, model, prompt, max_tokens, thinking_tokens, repeats):
+    """Check StreamTagParser, then compare its per-token overhead with the
+    legacy scanner's"""
+    if record_path:
+        record_stream(record_path, model, prompt, max_tokens)
+        stream_path = record_path
+
+    if stream_path:
+        chunks = load_stream(stream_path)
+        source = stream_path
+    else:
+        chunks = synthetic_stream(thinking_tokens)
+        source = f"synthetic ({thinking_tokens} thinking tokens)"
+
+    failures = check_boundaries()
+    # The legacy scanner misses tags split across chunks, so it only gets
+    # the whole stream as one chunk
+    if parser_scan(chunks) != legacy_scan(["".join(chunks)]):
+        failures.append("StreamTagParser and the legacy scanner disagree on the stream")
+    if failures:
+        raise click.ClickException("\n".join(failures))
+    click.echo("chunk boundary checks: ok")
+
+    legacy_time = time_scan(legacy_scan, chunks, repeats)
+    parser_time = time_scan(parser_scan, chunks, repeats)
+    tokens = len(chunks)
+
+    click.echo(f"Stream: {source}, {tokens:,} chunks, {sum(map(len, chunks)):,} chars")
+    click.echo(f"legacy scan:     {legacy_time * 1e6 / tokens:8.2f} us/token")
+    click.echo(f"StreamTagParser: {parser_time * 1e6 / tokens:8.2f} us/token")
+    if parser_time > 0:
+        click.echo(f"speedup: {legacy_time / parser_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -26,8 +26,25 @@ print_warning() {
 TEMP_DIR=$(mktemp -d)
 print_status "Created temporary directory: $TEMP_DIR"
 
+# Servers started in the background, stopped on exit
+BACKGROUND_PIDS=()
+
+# Wait up to 300 seconds for a command to succeed
+wait_for() {
+    for _ in $(seq 1 300); do
+        if "$@" > /dev/null 2>&1; then
+            return 0
+        fi
+        sleep 1
+    done
+    return 1
+}
+
 # Cleanup function to remove temporary directory
 cleanup() {
+    for pid in ${BACKGROUND_PIDS[@]+"${BACKGROUND_PIDS[@]}"}; do
+        kill "$pid" 2>/dev/null || true
+    done
     if [ -d "$TEMP_DIR" ]; then
         print_status "Cleaning up temporary directory: $TEMP_DIR"
         rm -rf "$TEMP_DIR"
@@ -127,6 +144,175 @@ for BITS in 3 8; do
     print_status "✓ Quantized to $BITS bits successfully"
 done
 
+# Test 11: Run through a resident daemon
+print_status "Test 11: Testing run through the daemon..."
+DAEMON_SOCKET="$TEMP_DIR/bizarro.sock"
+src/tools/bizarro/bizarro.py daemon --socket "$DAEMON_SOCKET" --model "$BASE_MODEL" \
+    > "$TEMP_DIR/daemon.log" 2>&1 &
+DAEMON_PID=$!
+BACKGROUND_PIDS+=("$DAEMON_PID")
+if ! wait_for test -S "$DAEMON_SOCKET"; then
+    print_error "Daemon did not start listening"
+    cat "$TEMP_DIR/daemon.log"
+    exit 1
+fi
+OUTPUT=$(src/tools/bizarro/bizarro.py run "What is 2+2?" \
+    --model "$BASE_MODEL" \
+    --socket "$DAEMON_SOCKET" \
+    --max-tokens 32 \
+    --no-stats)
+if [ -z "$OUTPUT" ] || ! kill -0 "$DAEMON_PID" 2>/dev/null; then
+    print_error "Run through the daemon failed"
+    cat "$TEMP_DIR/daemon.log"
+    exit 1
+fi
+kill "$DAEMON_PID"
+wait "$DAEMON_PID" || true
+if [ -e "$DAEMON_SOCKET" ]; then
+    print_error "Daemon left its socket behind"
+    exit 1
+fi
+print_status "✓ Daemon run successful"
+
+# Test 12: OpenAI-compatible server
+print_status "Test 12: Testing serve..."
+SERVE_PORT=$(python3 -c 'import socket; s = socket.socket(); s.bind(("127.0.0.1", 0)); print(s.getsockname()[1])')
+src/tools/bizarro/bizarro.py serve --model "$BASE_MODEL" --port "$SERVE_PORT" \
+    > "$TEMP_DIR/serve.log" 2>&1 &
+SERVE_PID=$!
+BACKGROUND_PIDS+=("$SERVE_PID")
+if ! wait_for curl -sf "http://127.0.0.1:$SERVE_PORT/v1/models"; then
+    print_error "Server did not start listening"
+    cat "$TEMP_DIR/serve.log"
+    exit 1
+fi
+RESPONSE=$(curl -sf "http://127.0.0.1:$SERVE_PORT/v1/chat/completions" \
+    -H "Content-Type: application/json" \
+    -d '{"messages": [{"role": "user", "content": "What is 2+2?"}], "max_tokens": 32}')
+if ! echo "$RESPONSE" | grep -q '"choices"'; then
+    print_error "Unexpected chat completion: $RESPONSE"
+    exit 1
+fi
+kill "$SERVE_PID"
+wait "$SERVE_PID" || true
+print_status "✓ Serve chat completion successful"
+
+# Test 13: Bench against its own results as the baseline
+print_status "Test 13: Testing bench with a baseline..."
+src/tools/bizarro/bizarro.py bench --model "$BASE_MODEL" \
+    --prompt-length 64 \
+    --generation-length 16 \
+    --warmup 0 \
+    --repeats 1 \
+    -o "$TEMP_DIR/bench.json"
+# Timings are noisy on shared machines; only the comparison path is tested
+src/tools/bizarro/bizarro.py bench --model "$BASE_MODEL" \
+    --prompt-length 64 \
+    --generation-length 16 \
+    --warmup 0 \
+    --repeats 1 \
+    --baseline "$TEMP_DIR/bench.json" \
+    --threshold 100 > /dev/null
+print_status "✓ Bench baseline comparison successful"
+
+# Test 14: Batch output order and resume
+print_status "Test 14: Testing batch with --resume..."
+printf '%s\n' '{"prompt": "Count to three."}' \
+    '{"prompt": "Name a colour."}' \
+    '{"messages": [{"role": "user", "content": "Say hello."}]}' \
+    > "$TEMP_DIR/batch.jsonl"
+src/tools/bizarro/bizarro.py batch "$TEMP_DIR/batch.jsonl" \
+    --model "$BASE_MODEL" \
+    --max-tokens 20 \
+    -o "$TEMP_DIR/batch_out.jsonl"
+check_batch_order() {
+    python3 -c 'import json, sys
+indices = [json.loads(line)["index"] for line in open(sys.argv[1])]
+sys.exit(indices != [0, 1, 2])' "$1"
+}
+if ! check_batch_order "$TEMP_DIR/batch_out.jsonl"; then
+    print_error "Batch output is not one record per input in order"
+    exit 1
+fi
+# Keep the first record and half of the second, as an interrupted run would
+head -n 1 "$TEMP_DIR/batch_out.jsonl" > "$TEMP_DIR/batch_partial.jsonl"
+sed -n 2p "$TEMP_DIR/batch_out.jsonl" | head -c 10 >> "$TEMP_DIR/batch_partial.jsonl"
+src/tools/bizarro/bizarro.py batch "$TEMP_DIR/batch.jsonl" \
+    --model "$BASE_MODEL" \
+    --max-tokens 20 \
+    --resume \
+    -o "$TEMP_DIR/batch_partial.jsonl"
+if ! check_batch_order "$TEMP_DIR/batch_partial.jsonl"; then
+    print_error "Resumed batch output has missing or duplicate records"
+    exit 1
+fi
+print_status "✓ Batch resume successful"
+
+# Test 15: Stop sequences
+print_status "Test 15: Testing run with --stop..."
+STOP_PROMPT="Count from one to twenty in words."
+FULL_OUTPUT=$(src/tools/bizarro/bizarro.py run --no-stats "$STOP_PROMPT" \
+    --model "$BASE_MODEL" \
+    --max-tokens 60)
+# Decoding is greedy, so stop at a word from the middle of the full output
+STOP=$(python3 -c 'import sys
+words = sys.argv[1].split()
+print(words[len(words) // 2])' "$FULL_OUTPUT")
+STOP_OUTPUT=$(src/tools/bizarro/bizarro.py run --no-stats "$STOP_PROMPT" \
+    --model "$BASE_MODEL" \
+    --max-tokens 60 \
+    --stop "$STOP")
+if ! python3 -c 'import sys
+full, stopped, stop = sys.argv[1:]
+expected = full[: full.index(stop)]
+sys.exit(stop in stopped or expected.split() != stopped.split())' \
+    "$FULL_OUTPUT" "$STOP_OUTPUT" "$STOP"; then
+    print_error "Output with --stop '$STOP' does not end before the stop string"
+    exit 1
+fi
+print_status "✓ Stop sequence successful"
+
+# Test 16: Quantized KV cache
+print_status "Test 16: Testing run with --kv-bits..."
+# Start quantizing early so the short prompt is quantized
+OUTPUT=$(src/tools/bizarro/bizarro.py run --no-stats "What is AI?" \
+    --model "$BASE_MODEL" \
+    --max-tokens 50 \
+    --kv-bits 8 \
+    --quantized-kv-start 16)
+if [ -z "$OUTPUT" ]; then
+    print_error "No output with a quantized KV cache"
+    exit 1
+fi
+STATUS=0
+src/tools/bizarro/bizarro.py run --no-stats "What is AI?" \
+    --model "$BASE_MODEL" \
+    --kv-bits 4 \
+    --max-kv-size 256 > /dev/null 2> "$TEMP_DIR/kv_error.txt" || STATUS=$?
+if [ "$STATUS" -ne 2 ] || ! grep -q "cannot be combined" "$TEMP_DIR/kv_error.txt"; then
+    print_error "--kv-bits with --max-kv-size was not rejected as a usage error"
+    exit 1
+fi
+print_status "✓ Quantized KV cache successful"
+
+# Test 17: Bounded KV cache that wraps
+print_status "Test 17: Testing run with --max-kv-size..."
+# The system prompt alone is longer than the window, and decoding wraps the
+# rotating cache again while the pinned leading tokens stay in place
+for i in $(seq 1 40); do
+    echo "Rule $i: answer politely and keep the reply short."
+done > "$TEMP_DIR/long_system.txt"
+src/tools/bizarro/bizarro.py run "What is AI?" \
+    --model "$BASE_MODEL" \
+    --system "$TEMP_DIR/long_system.txt" \
+    --max-kv-size 128 \
+    --max-tokens 200 > /dev/null 2> "$TEMP_DIR/kv_stats.txt"
+if ! grep -qE "^[1-9][0-9]* tokens in" "$TEMP_DIR/kv_stats.txt"; then
+    print_error "No tokens generated with a wrapped KV cache"
+    exit 1
+fi
+print_status "✓ Bounded KV cache successful"
+
 # Summary
 print_status "========================================="
 print_status "All tests completed successfully! 🎉"
@@ -142,4 +328,11 @@ print_status "  7. Chat mode"
 print_status "  8. Chat with tools"
 print_status "  9. System prompt"
 print_status " 10. Multiple quantization levels"
+print_status " 11. Daemon run"
+print_status " 12. Serve chat completion"
+print_status " 13. Bench baseline comparison"
+print_status " 14. Batch resume"
+print_status " 15. Stop sequence"
+print_status " 16. Quantized KV cache"
+print_status " 17. Bounded KV cache"
 print_status "========================================="
@@ -25,23 +25,12 @@ from typing import Any, Dict, List, Optional, Tuple
 
 # Third-party imports
 import click
-import mlx.core as mx
-import mlx.optimizers as optim
-import numpy as np
 from rich.console import Console
 from rich.table import Table
 
-# MLX imports
-from mlx.utils import tree_flatten, tree_unflatten
-from mlx_lm import convert, load
-from mlx_lm.tuner import TrainingArgs, train
-from mlx_lm.tuner.datasets import CacheDataset, load_dataset
-from mlx_lm.tuner.utils import (
-    dequantize,
-    linear_to_lora_layers,
-    load_adapters,
-)
-from mlx_lm.utils import fetch_from_hub, get_model_path, save
+# MLX, mlx_lm and numpy are imported where they are used: the mlx_lm tuner
+# stack takes seconds to import, which --help and argument errors should not
+# pay for. t/bench_startup.py measures the import cost.
 
 # Global console instance
 console = Console()
@@ -113,6 +102,8 @@ class DatasetArgs:
 
 def load_model_quietly(model_path: str) -> Tuple[Any, Any]:
     """Load model with minimal output"""
+    from mlx_lm import load
+
     suppress_output = io.StringIO()
 
     is_local = os.path.exists(model_path)
@@ -222,6 +213,8 @@ def quantize_model(
     if not 3 <= q_bits <= 8:
         raise QuantizationError("q_bits must be between 3 and 8")
 
+    from mlx_lm import convert
+
     try:
         convert(
             model_path,
@@ -244,6 +237,8 @@ def _prepare_model_for_tuning(
     Returns:
         LoRA parameters dict if using LoRA/DoRA, None otherwise
     """
+    from mlx_lm.tuner.utils import linear_to_lora_layers
+
     model.freeze()
 
     if config.num_layers > len(model.layers):
@@ -322,6 +317,12 @@ def tune_model(
     if not adapter_path:
         adapter_path = generate_adapter_path(model_path)
 
+    import mlx.core as mx
+    import mlx.optimizers as optim
+    import numpy as np
+    from mlx_lm.tuner import TrainingArgs, train
+    from mlx_lm.tuner.datasets import CacheDataset, load_dataset
+
     # Set random seeds
     mx.random.seed(config.seed)
     np.random.seed(config.seed)
@@ -383,6 +384,8 @@ def _fuse_adapter_layers(model: Any, de_quantize: bool) -> int:
     Returns:
         Number of layers fused
     """
+    from mlx.utils import tree_unflatten
+
     fused_linears = [
         (n, m.fuse(de_quantize=de_quantize))
         for n, m in model.named_modules()
@@ -425,6 +428,9 @@ def fuse_model(
                 "Use adapter_path to specify the adapter location."
             )
 
+    from mlx_lm.tuner.utils import dequantize, load_adapters
+    from mlx_lm.utils import fetch_from_hub, get_model_path, save
+
     try:
         # Load model with config
         resolved_model_path = get_model_path(model_path)
@@ -467,6 +473,8 @@ def fuse_model(
 
 def _calculate_model_size(model) -> Tuple[int, int]:
     """Calculate total parameters and size in bytes"""
+    import mlx.core as mx
+
     total_params = 0
     total_size_bytes = 0
 
@@ -523,6 +531,9 @@ def _export_to_gguf(
             "[yellow]Note: GGUF export requires de-quantizing the model first[/yellow]"
         )
 
+    from mlx.utils import tree_flatten
+    from mlx_lm.utils import fetch_from_hub, get_model_path
+
     try:
         # Load the original model
         resolved_model_path = get_model_path(model_path)